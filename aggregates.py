@@ -0,0 +1,283 @@
+"""
+Agrégats précalculés à partir de maindf, utilisés par les figures
+à la place des lignes brutes.
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import numpy as np
+import pandas as pd
+
+from instrumentation import timed_stage
+
+# Dimensions du cube d'agrégats
+DIMENSIONS_CUBE = ['year', 'continent', 'group']
+
+
+@timed_stage('build_cube')
+def build_cube(df):
+    """
+    Agrège les météorites par année, continent et groupe
+
+    Args:
+        df : maindf ou une de ses sous-dataframes
+
+    Returns:
+        build_cube(df) : pd.DataFrame (year, continent, group, count,
+        mass_count, mass, mass_mean), une ligne par combinaison présente
+        count compte les météorites, mass_count celles dont la masse est connue
+    """
+    groupes = df.groupby(DIMENSIONS_CUBE, observed=True, sort=True)['mass']
+    cube = pd.DataFrame({
+        'count': groupes.size(),
+        'mass_count': groupes.count(),
+        'mass': groupes.sum(),
+    }).reset_index()
+    # Avec observed=True, pandas ne trie pas toujours les clés catégorielles
+    cube = cube.sort_values(DIMENSIONS_CUBE, ignore_index=True)
+    cube['mass_mean'] = cube['mass'] / cube['mass_count']
+    return cube
+
+
+def roll_up(cube, dimensions):
+    """
+    Ré-agrège le cube sur une partie de ses dimensions
+
+    Args:
+        cube : résultat de build_cube
+        dimensions : liste des dimensions conservées
+
+    Returns:
+        roll_up(cube, dimensions) : pd.DataFrame au même format que le cube
+    """
+    resultat = cube.groupby(dimensions, observed=True, sort=True)[
+        ['count', 'mass_count', 'mass']
+    ].sum().reset_index()
+    resultat = resultat.sort_values(dimensions, ignore_index=True)
+    resultat['mass_mean'] = resultat['mass'] / resultat['mass_count']
+    return resultat
+
+
+def mean_mass_by_year(cube):
+    """
+    Retourne la masse moyenne des météorites pour chaque année
+
+    Args:
+        cube : résultat de build_cube
+
+    Returns:
+        mean_mass_by_year(cube) : pd.DataFrame indexée par year, colonne mass
+    """
+    annees = roll_up(cube, ['year'])
+    return annees.set_index('year')[['mass_mean']].rename(columns={'mass_mean': 'mass'})
+
+
+def _fusionner_valeurs(valeurs, ajouts):
+    """
+    Ajoute des valeurs à un tableau trié de valeurs distinctes
+
+    Args:
+        valeurs : np.ndarray trié, sans doublon
+        ajouts : valeurs à ajouter (dans n'importe quel ordre, doublons acceptés)
+
+    Returns:
+        _fusionner_valeurs(valeurs, ajouts) : (np.ndarray trié sans doublon,
+        nouveau rang de chaque élément de valeurs)
+    """
+    ajouts = np.unique(ajouts)
+    ou = np.searchsorted(valeurs, ajouts)
+    connues = ou < len(valeurs)
+    connues[connues] = valeurs[ou[connues]] == ajouts[connues]
+    ou, ajouts = ou[~connues], ajouts[~connues]
+    # Chaque ancienne valeur est décalée du nombre de valeurs insérées avant elle
+    rangs = np.arange(len(valeurs)) + np.searchsorted(ou, np.arange(len(valeurs)), side='right')
+    return np.insert(valeurs, ou, ajouts), rangs
+
+
+class FilterIndex:
+    """
+    Index permettant de filtrer les météorites par intervalle d'années et par
+    seuil de masse sans reparcourir la dataframe
+
+    Les lignes sont triées par (année, masse) ; chaque ligne reçoit la clé
+    rang_annee * pas + rang_masse (rangs parmi les années et les masses
+    distinctes), croissante dans cet ordre. Le sous-ensemble « année i et
+    masse < seuil » est alors un intervalle [debut_annee[i], fin) trouvé par
+    recherche dichotomique, et ses totaux par continent sont des
+    différences de sommes cumulées.
+
+    Les sommes cumulées sont creuses : chaque continent ne garde que les
+    positions (dans l'ordre trié) de ses propres lignes et la somme cumulée de
+    leurs masses. L'index occupe donc O(n) et non O(n x continents) ; le
+    nombre de lignes d'un continent dans [debut, fin) est la différence de
+    deux recherches dichotomiques dans ses positions.
+
+    Attributs :
+        years : années présentes, triées
+        continents : continents présents
+        order : position dans df de chaque ligne, dans l'ordre trié
+    """
+
+    def __init__(self, df):
+        masse = df['mass'].to_numpy(dtype=np.float64)
+        # Les masses inconnues sont placées après toutes les autres :
+        # elles ne sont jamais sous le seuil, et ne pèsent rien dans les sommes
+        masse_triable = np.where(np.isnan(masse), np.inf, masse)
+        self.years, rang_annee = np.unique(df['year'].to_numpy(), return_inverse=True)
+        self._valeurs, rang_masse = np.unique(masse_triable, return_inverse=True)
+        continents = pd.Categorical(df['continent'])
+        self.continents = list(continents.categories)
+
+        self.order = np.lexsort((rang_masse, rang_annee))
+        self._pas = len(self._valeurs) + 1
+        self._cles = (rang_annee.astype(np.int64) * self._pas + rang_masse)[self.order]
+        self._masse_triee = np.nan_to_num(masse[self.order])
+        self._code = continents.codes[self.order]
+        self._indexer()
+
+    def _indexer(self):
+        """
+        Calcule, à partir des lignes triées, le début de chaque année et
+        les sommes cumulées de chaque continent
+        """
+        self._debut_annee = np.searchsorted(
+            self._cles, np.arange(len(self.years), dtype=np.int64) * self._pas
+        )
+        # Positions triées des lignes de chaque continent, et somme cumulée
+        # de leurs masses (premier élément = somme vide)
+        self._lignes_continent, self._masse_cumul = [], []
+        for code in range(len(self.continents)):
+            lignes = np.flatnonzero(self._code == code)
+            self._lignes_continent.append(lignes)
+            self._masse_cumul.append(
+                np.concatenate(([0.0], np.cumsum(self._masse_triee[lignes])))
+            )
+
+    def insert(self, lignes, positions, renumerotation=None):
+        """
+        Retourne l'index complété par de nouvelles lignes, sans retrier
+        les lignes existantes
+
+        Les clés des lignes existantes sont recalculées à partir des rangs
+        fusionnés des années et des masses, puis les nouvelles lignes, triées
+        entre elles, sont insérées à leur place par recherche dichotomique :
+        il ne reste que des copies linéaires des tableaux de l'index.
+        L'index d'origine n'est pas modifié.
+
+        Args:
+            lignes : nouvelles lignes (year, mass, continent)
+            positions : position de chacune dans la dataframe complétée
+            renumerotation : fonction donnant la nouvelle position des lignes
+            existantes (None si elles n'ont pas bougé)
+
+        Returns:
+            insert(lignes, positions, renumerotation) : FilterIndex
+        """
+        masse = lignes['mass'].to_numpy(dtype=np.float64)
+        masse_triable = np.where(np.isnan(masse), np.inf, masse)
+        annee = lignes['year'].to_numpy()
+        continents = lignes['continent'].astype(object)
+
+        index = FilterIndex.__new__(FilterIndex)
+        index.years, rang_annee = _fusionner_valeurs(self.years, annee)
+        index._valeurs, rang_masse = _fusionner_valeurs(self._valeurs, masse_triable)
+        index.continents = self.continents + [
+            c for c in pd.unique(continents.dropna()) if c not in set(self.continents)
+        ]
+        index._pas = len(index._valeurs) + 1
+
+        ancienne_annee, ancienne_masse = np.divmod(self._cles, self._pas)
+        cles = rang_annee[ancienne_annee].astype(np.int64) * index._pas + rang_masse[ancienne_masse]
+        cles_lot = (
+            np.searchsorted(index.years, annee).astype(np.int64) * index._pas
+            + np.searchsorted(index._valeurs, masse_triable)
+        )
+        tri = np.argsort(cles_lot, kind='stable')
+        # À clés égales, les nouvelles lignes passent après les anciennes
+        ou = np.searchsorted(cles, cles_lot[tri], side='right')
+
+        ordre = self.order if renumerotation is None else renumerotation(self.order)
+        index.order = np.insert(ordre, ou, np.asarray(positions)[tri])
+        index._cles = np.insert(cles, ou, cles_lot[tri])
+        index._masse_triee = np.insert(self._masse_triee, ou, np.nan_to_num(masse)[tri])
+        codes = pd.Categorical(continents, categories=index.continents).codes
+        index._code = np.insert(self._code.astype(codes.dtype), ou, codes[tri])
+        index._indexer()
+        return index
+
+    def _intervalles(self, annees, seuil):
+        """
+        Retourne, pour chaque année de l'intervalle, les bornes [debut, fin)
+        des lignes de masse inférieure au seuil dans l'ordre trié
+
+        Args:
+            annees : (première, dernière) année incluses, ou None pour toutes
+            seuil : masse maximale exclue (en g), ou None pour aucune limite
+
+        Returns:
+            _intervalles(annees, seuil) : (rangs des années, debut, fin)
+        """
+        if annees is None:
+            premier, dernier = 0, len(self.years)
+        else:
+            premier = np.searchsorted(self.years, annees[0], side='left')
+            dernier = np.searchsorted(self.years, annees[1], side='right')
+        rangs = np.arange(premier, dernier, dtype=np.int64)
+        if seuil is None:
+            # Toutes les lignes de l'année, y compris celles de masse inconnue
+            rang_seuil = self._pas
+        else:
+            rang_seuil = np.searchsorted(self._valeurs, seuil, side='left')
+        debut = self._debut_annee[rangs]
+        fin = np.searchsorted(self._cles, rangs * self._pas + rang_seuil, side='left')
+        return rangs, debut, fin
+
+    def totals(self, annees=None, seuil=None):
+        """
+        Retourne le nombre et la masse totale des météorites par année et par
+        continent, pour un intervalle d'années et un seuil de masse
+
+        Args:
+            annees : (première, dernière) année incluses, ou None pour toutes
+            seuil : masse maximale exclue (en g), ou None pour aucune limite
+
+        Returns:
+            totals(annees, seuil) : pd.DataFrame (year, continent, count, mass),
+            une ligne par combinaison non vide
+        """
+        rangs, debut, fin = self._intervalles(annees, seuil)
+        nombre = np.empty((len(rangs), len(self.continents)), dtype=np.int64)
+        masse = np.empty((len(rangs), len(self.continents)))
+        for c, (lignes, cumul) in enumerate(zip(self._lignes_continent, self._masse_cumul)):
+            premier = np.searchsorted(lignes, debut, side='left')
+            dernier = np.searchsorted(lignes, fin, side='left')
+            nombre[:, c] = dernier - premier
+            masse[:, c] = cumul[dernier] - cumul[premier]
+        nombre = nombre.ravel()
+        non_vides = nombre > 0
+        return pd.DataFrame({
+            'year': np.repeat(self.years[rangs], len(self.continents))[non_vides],
+            'continent': np.tile(np.array(self.continents, dtype=object), len(rangs))[non_vides],
+            'count': nombre[non_vides],
+            'mass': masse.ravel()[non_vides],
+        })
+
+    def rows(self, annees=None, seuil=None):
+        """
+        Retourne les positions (dans la dataframe indexée) des météorites
+        d'un intervalle d'années et sous un seuil de masse
+
+        Args:
+            annees : (première, dernière) année incluses, ou None pour toutes
+            seuil : masse maximale exclue (en g), ou None pour aucune limite
+
+        Returns:
+            rows(annees, seuil) : np.ndarray de positions, à utiliser avec df.iloc
+        """
+        _, debut, fin = self._intervalles(annees, seuil)
+        longueurs = fin - debut
+        if longueurs.sum() == 0:
+            return self.order[:0]
+        # Concaténation vectorisée des intervalles [debut, fin)
+        decalage = np.repeat(debut - np.concatenate(([0], np.cumsum(longueurs)[:-1])), longueurs)
+        return self.order[np.arange(longueurs.sum()) + decalage]
@@ -0,0 +1,74 @@
+/*
+ * Construction de la carte des météorites (graph7) dans le navigateur.
+ *
+ * Le serveur envoie une seule fois les données des trois types de météorites
+ * (dcc.Store geo-data, voir figures.geo_data) : changer de type avec le
+ * RadioItems ne demande donc aucun appel au serveur.
+ *
+ * Auteurs : Henriques Hugo & Leroux Gabriel
+ */
+
+// Équivalent du str() de Python pour un float : 1880 -> "1880.0", null -> "nan"
+function pyFloat(valeur) {
+    if (valeur === null || valeur === undefined) {
+        return 'nan';
+    }
+    return Number.isInteger(valeur) ? valeur.toFixed(1) : String(valeur);
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    carte: {
+        /*
+         * Retourne la figure géographique et son titre
+         *
+         * Args:
+         *     input_value : type de météorite ('stony', 'iron' ou 'stony-iron')
+         *     donnees : dict type -> données de figures.geo_data
+         *     style : mise en page, marqueurs et titres (dcc.Store geo-style)
+         *
+         * Returns:
+         *     [figure, titre]
+         */
+        update_scattergeo: function(input_value, donnees, style) {
+            if (!(input_value in style.titles)) {
+                input_value = 'stony-iron';
+            }
+            const titre = style.titles[input_value];
+            if (!donnees || !donnees[input_value]) {
+                return [window.dash_clientside.no_update, titre];
+            }
+            const d = donnees[input_value];
+            const marqueur = style.markers[input_value];
+            let texte, taille;
+            if (d.mode === 'cells') {
+                // Une cellule de la grille par marqueur, de taille croissante avec le nombre de météorites
+                texte = d.count.map((n, i) =>
+                    n + ' météorites' + '\n' + 'Masse totale : ' + pyFloat(d.mass[i]) + 'g.');
+                taille = d.count.map(n => Math.min(6 + 2 * Math.sqrt(n), 40));
+            } else {
+                texte = d.label.map((l, i) =>
+                    'Ville : ' + d.labels[l] + '.' + '\n' + ' Année de crash : ' + pyFloat(d.year[i]) +
+                    '\n' + 'Masse : ' + pyFloat(d.mass[i]) + 'g.');
+                taille = 8;
+            }
+            const figure = {
+                data: [{
+                    type: 'scattergeo',
+                    lat: d.lat,
+                    lon: d.lon,
+                    text: texte,
+                    marker: {
+                        size: taille,
+                        opacity: 0.8,
+                        reversescale: true,
+                        autocolorscale: true,
+                        symbol: marqueur.symbol,
+                        line: {width: 1, color: marqueur.color}
+                    }
+                }],
+                layout: style.layout
+            };
+            return [figure, titre];
+        }
+    }
+});
@@ -0,0 +1,53 @@
+/*
+ * Chargement à la demande des sections du dashboard.
+ *
+ * Les figures des sections sous la ligne de flottaison ne sont pas dans le
+ * layout : chaque section (classe section-differee) contient un bouton caché,
+ * sur lequel on clique la première fois que la section approche de la partie
+ * visible de la page. Le n_clicks du bouton déclenche le callback qui envoie
+ * ses figures (voir main.py).
+ *
+ * Auteurs : Henriques Hugo & Leroux Gabriel
+ */
+
+(function() {
+    // Marge autour de la fenêtre : la section est chargée un peu avant d'être visible
+    const MARGE = '300px';
+
+    // Clique une seule fois sur le bouton d'une section
+    function ouvrir(section) {
+        const bouton = section.querySelector('button.declencheur-section');
+        if (bouton && !section.dataset.ouverte) {
+            section.dataset.ouverte = '1';
+            bouton.click();
+        }
+    }
+
+    const observateur = 'IntersectionObserver' in window
+        ? new IntersectionObserver(function(entrees) {
+            entrees.forEach(function(entree) {
+                if (entree.isIntersecting) {
+                    observateur.unobserve(entree.target);
+                    ouvrir(entree.target);
+                }
+            });
+        }, {rootMargin: MARGE})
+        : null;
+
+    // Les sections n'existent qu'une fois le layout rendu par Dash :
+    // on surveille leur apparition dans la page
+    function surveiller() {
+        document.querySelectorAll('.section-differee:not([data-observee])').forEach(function(section) {
+            section.dataset.observee = '1';
+            if (observateur) {
+                observateur.observe(section);
+            } else {
+                // Navigateur sans IntersectionObserver : tout est chargé
+                ouvrir(section);
+            }
+        });
+    }
+
+    new MutationObserver(surveiller).observe(document.documentElement, {childList: true, subtree: true});
+    document.addEventListener('DOMContentLoaded', surveiller);
+})();
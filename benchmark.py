@@ -0,0 +1,459 @@
+"""
+Banc d'essai du dashboard sur des données synthétiques.
+
+Génère des jeux de données ayant la forme de meteorite-landings.csv,
+worldcitiespop.csv et countryContinent.csv à plusieurs échelles, puis mesure
+chaque étape : lecture des .csv, géocodage, index et jointure par nom, merge des
+continents, classification, agrégats, instantané, construction et
+sérialisation JSON de chaque figure, et callbacks de la carte (graph7)
+appelés via le client de test de Flask.
+
+À l'échelle 1, le jeu de météorites a la taille du vrai (45 716 lignes) ;
+celui des villes est dix fois plus petit que le vrai, afin que l'échelle 100
+reste générable. Chaque échelle est mesurée dans un processus séparé.
+
+    $ python benchmark.py --echelles 1 10 100 --sortie reference.json
+    $ python benchmark.py --echelles 1 10 --reference reference.json
+
+Avec --reference, les étapes dont la durée médiane dépasse celle de la
+référence de plus de --seuil (20 % par défaut) sont signalées, et le code
+de sortie vaut 1.
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import plotly
+import plotly.io as pio
+from plotly.utils import PlotlyJSONEncoder
+
+import pipeline
+from aggregates import FilterIndex
+from classification import classify
+from geocoder import ReverseGeocoder
+from name_index import CityNameStore
+
+# Nombre de lignes de chaque fichier à l'échelle 1
+TAILLES_1X = {'meteorites': 45716, 'cities': 317000}
+
+# Échelles mesurées par défaut
+ECHELLES = (1, 10, 100)
+
+# Nombre de mesures de chaque étape (on garde le minimum et la médiane)
+REPETITIONS = 3
+
+# Ralentissement relatif au-delà duquel une étape est signalée
+SEUIL_REGRESSION = 0.2
+
+# Écart absolu (en s) en dessous duquel un ralentissement est attribué au bruit
+ECART_MINIMAL = 0.005
+
+# Dossier des jeux de données générés
+DOSSIER_BENCHMARK = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.benchmark')
+
+# Lignes écrites à la fois lors de la génération
+TAILLE_BLOC = 1000000
+
+# Pays utilisés par les données synthétiques : (pays, code, continent)
+PAYS = [
+    ('France', 'FR', 'Europe'), ('Germany', 'DE', 'Europe'),
+    ('United States of America', 'US', 'Americas'), ('Chile', 'CL', 'Americas'),
+    ('Argentina', 'AR', 'Americas'), ('Oman', 'OM', 'Asia'), ('Japan', 'JP', 'Asia'),
+    ('China', 'CN', 'Asia'), ('Algeria', 'DZ', 'Africa'), ('Libya', 'LY', 'Africa'),
+    ('Morocco', 'MA', 'Africa'), ('Australia', 'AU', 'Oceania'),
+]
+
+# Valeurs de recclass, dans les proportions approximatives du vrai jeu
+CLASSES = {
+    'L6': 0.18, 'H5': 0.16, 'L5': 0.1, 'H4': 0.08, 'H6': 0.08, 'LL5': 0.05, 'LL6': 0.04,
+    'CM2': 0.02, 'CO3': 0.02, 'EH4': 0.01, 'Ureilite': 0.01, 'Diogenite': 0.01,
+    'Eucrite-pmict': 0.01, 'Howardite': 0.01, 'Angrite': 0.005, 'Aubrite': 0.005,
+    'Martian (shergottite)': 0.005, 'Iron, IIIAB': 0.03, 'Iron, IIAB': 0.02,
+    'Iron, IAB-MG': 0.02, 'Mesosiderite-A1': 0.01, 'Pallasite, PMG': 0.01,
+    'Stone-uncl': 0.01, 'Lunar': 0.005, 'OC': 0.14,
+}
+
+
+def generate_dataset(dossier, echelle, graine=0):
+    """
+    Écrit les trois fichiers .csv synthétiques d'une échelle
+
+    Les fichiers déjà générés avec la même échelle et la même graine sont réutilisés.
+
+    Args:
+        dossier : dossier de destination
+        echelle : facteur multipliant TAILLES_1X
+        graine : graine du générateur aléatoire
+
+    Returns:
+        generate_dataset(dossier, echelle, graine) : dossier
+    """
+    marque = os.path.join(dossier, '.genere-%d-%d' % (echelle, graine))
+    if os.path.exists(marque):
+        return dossier
+    shutil.rmtree(dossier, ignore_errors=True)
+    os.makedirs(dossier)
+    rng = np.random.default_rng(graine)
+
+    continents = pd.DataFrame({
+        'country': [p[0] for p in PAYS], 'code_2': [p[1] for p in PAYS],
+        'code_3': [p[1] + 'X' for p in PAYS], 'country_code': range(len(PAYS)),
+        'iso_3166_2': ['ISO 3166-2:' + p[1] for p in PAYS], 'continent': [p[2] for p in PAYS],
+        'sub_region': '', 'region_code': 1, 'sub_region_code': 1,
+    })
+    continents.to_csv(pipeline.chemin_source('continents', dossier), index=False)
+
+    # Les noms de villes se répètent (comme dans worldcitiespop.csv) ;
+    # une partie des météorites porte le nom d'une ville
+    nb_noms = max(TAILLES_1X['cities'] * echelle // 10, 1)
+    codes = np.array([p[1].lower() for p in PAYS] + ['zz'])
+    nb_villes = TAILLES_1X['cities'] * echelle
+    for debut in range(0, nb_villes, TAILLE_BLOC):
+        n = min(TAILLE_BLOC, nb_villes - debut)
+        noms = np.char.add('Ville ', rng.integers(0, nb_noms, n).astype(str))
+        pd.DataFrame({
+            'Country': rng.choice(codes, n), 'City': np.char.lower(noms), 'AccentCity': noms,
+            'Region': '01', 'Population': np.where(rng.random(n) < 0.1, 1000.0, np.nan),
+            'Latitude': rng.uniform(-60, 70, n), 'Longitude': rng.uniform(-180, 180, n),
+        }).to_csv(pipeline.chemin_source('cities', dossier), index=False,
+                  mode='a' if debut else 'w', header=not debut)
+
+    classes = np.array(list(CLASSES))
+    poids = np.array(list(CLASSES.values()))
+    nb_meteorites = TAILLES_1X['meteorites'] * echelle
+    for debut in range(0, nb_meteorites, TAILLE_BLOC):
+        n = min(TAILLE_BLOC, nb_meteorites - debut)
+        identifiants = np.arange(debut, debut + n)
+        noms = np.where(
+            rng.random(n) < 0.3,
+            np.char.add('Ville ', rng.integers(0, nb_noms, n).astype(str)),
+            np.char.add('Allan Hills ', identifiants.astype(str)),
+        )
+        lat = rng.uniform(-85, 75, n).round(5)
+        lon = rng.uniform(-180, 180, n).round(5)
+        sans_position = rng.random(n) < 0.15
+        lat[sans_position] = np.nan
+        lon[sans_position] = np.nan
+        geolocation = pd.Series(
+            np.char.add(np.char.add(np.char.add('(', lat.astype(str)), ', '),
+                        np.char.add(lon.astype(str), ')'))
+        ).where(~sans_position)
+        pd.DataFrame({
+            'name': noms, 'id': identifiants, 'nametype': 'Valid',
+            'recclass': rng.choice(classes, n, p=poids / poids.sum()),
+            'mass': np.where(rng.random(n) < 0.02, np.nan, rng.lognormal(4, 3, n).round(1)),
+            'fall': np.where(rng.random(n) < 0.97, 'Found', 'Fell'),
+            'year': np.where(rng.random(n) < 0.01, np.nan, rng.integers(1700, 2030, n)),
+            'reclat': lat, 'reclong': lon, 'GeoLocation': geolocation,
+        }).to_csv(pipeline.chemin_source('meteorites', dossier), index=False,
+                  mode='a' if debut else 'w', header=not debut)
+
+    open(marque, 'w').close()
+    return dossier
+
+
+def measure(fonction, repetitions=REPETITIONS):
+    """
+    Mesure plusieurs exécutions d'une fonction
+
+    Args:
+        fonction : fonction sans argument
+        repetitions : nombre d'exécutions
+
+    Returns:
+        measure(fonction, repetitions) : (dict min, median, runs en secondes,
+        résultat de la dernière exécution)
+    """
+    durees = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        resultat = fonction()
+        durees.append(time.perf_counter() - debut)
+    return {'min': min(durees), 'median': statistics.median(durees), 'runs': durees}, resultat
+
+
+def bench_pipeline(dossier, repetitions=REPETITIONS):
+    """
+    Mesure les étapes du traitement des données (pipeline.py)
+
+    Args:
+        dossier : dossier des données
+        repetitions : nombre de mesures de chaque étape
+
+    Returns:
+        bench_pipeline(dossier, repetitions) : dict étape -> mesures
+    """
+    resultats = {}
+
+    def etape(nom, fonction):
+        resultats[nom], resultat = measure(fonction, repetitions)
+        return resultat
+
+    meteorites = etape('load_meteorites', lambda: pipeline.read_meteorites(dossier))
+    continents = etape('load_continents', lambda: pipeline.read_continents(dossier))
+    geocoder = etape('cities_index', lambda: ReverseGeocoder.from_csv(
+        pipeline.chemin_source('cities', dossier)
+    ))
+    localisees = etape('geocode', lambda: pipeline.locate_meteorites(
+        meteorites, dossier, 'coordonnees', geocoder
+    ))
+    noms = etape('names_index', lambda: CityNameStore.from_csv(
+        pipeline.chemin_source('cities', dossier)
+    ))
+    etape('name_merge', lambda: pipeline.locate_meteorites(meteorites, dossier, 'nom', noms))
+    maindf = etape('continent_merge', lambda: pipeline.merge_continents(localisees, continents))
+    etape('classify', lambda: classify(maindf['recclass']))
+    maindf = etape('compact_dtypes', lambda: pipeline.compact_dtypes(maindf))
+    etape('aggregates', lambda: pipeline.derived_frames(maindf))
+    etape('filter_index', lambda: FilterIndex(maindf))
+    return resultats
+
+
+def bench_app(repetitions=REPETITIONS):
+    """
+    Mesure l'instantané, les figures, les callbacks et la préparation de démarrage
+
+    Les variables DASHBOARD_* doivent désigner le jeu de données mesuré :
+    main.py charge ses données dès l'import.
+
+    Args:
+        repetitions : nombre de mesures de chaque étape
+
+    Returns:
+        bench_app(repetitions) : dict étape -> mesures
+    """
+    import snapshot
+
+    resultats = {}
+    shutil.rmtree(snapshot.DOSSIER_SNAPSHOT, ignore_errors=True)
+    resultats['snapshot_build'], _ = measure(snapshot.load_frames, 1)
+    resultats['snapshot_load'], _ = measure(snapshot.load_frames, repetitions)
+
+    debut = time.perf_counter()
+    import main
+    duree = time.perf_counter() - debut
+    resultats['import_main'] = {'min': duree, 'median': duree, 'runs': [duree]}
+
+    annees = main.donnees['years']
+    parametres = {
+        'massMoy': {},
+        'barChart': {'years': annees},
+        'barChartMin': {'years': annees, 'mass': main.SEUIL_DEFAUT},
+        'stonyPie': {},
+        'ironPie': {},
+        'stonyIronPie': {},
+    }
+    for input_value in main.GEO_TITLES:
+        parametres['geoData:' + input_value] = {
+            'input_value': input_value, 'years': annees,
+            'mass': main.SEUIL_DEFAUT, 'viewport': main.VUE_DEFAUT,
+        }
+    for nom, params in parametres.items():
+        fabrique = main.figures._fabriques[nom.split(':')[0]]
+        resultats['figure_build:' + nom], figure = measure(lambda: fabrique(**params), repetitions)
+        if hasattr(figure, 'to_plotly_json'):
+            resultats['figure_json:' + nom], _ = measure(lambda: pio.to_json(figure), repetitions)
+        else:
+            # Données des cartes (dcc.Store) : sérialisées comme le fait Dash
+            resultats['figure_json:' + nom], _ = measure(
+                lambda: json.dumps(figure, cls=PlotlyJSONEncoder), repetitions
+            )
+
+    # Callbacks appelés comme par le navigateur, sections ouvertes : données des
+    # cartes (graph7) pour la vue du monde et un zoom, et histogrammes, pour deux
+    # filtres d'années, puis vagues de découvertes de tous les continents
+    client = main.server.test_client()
+    vues = {
+        'monde': None,
+        'zoom': {'geo.projection.scale': 8, 'geo.center.lon': 10, 'geo.center.lat': 45},
+    }
+    filtres = {'toutes_annees': annees, 'annees_1900_1950': [1900, 1950]}
+    requetes = {}
+    for nom_filtre, years in filtres.items():
+        sliders = [
+            {'id': 'years-slider', 'property': 'value', 'value': years},
+            {'id': 'mass-slider', 'property': 'value', 'value': main.SEUIL_DEFAUT},
+        ]
+        for nom_vue, relayout in vues.items():
+            requetes['update_geo_data:%s:%s' % (nom_vue, nom_filtre)] = {
+                'output': '..geo-data.data...geo-viewport.data..',
+                'inputs': sliders + [
+                    {'id': 'graph7', 'property': 'relayoutData', 'value': relayout},
+                    {'id': 'section-carte', 'property': 'n_clicks', 'value': 1},
+                ],
+                'state': [{'id': 'geo-viewport', 'property': 'data', 'value': main.VUE_DEFAUT}],
+                'changedPropIds': ['graph7.relayoutData'],
+            }
+        requetes['update_histograms:' + nom_filtre] = {
+            'output': '..graph1.figure...graph2.figure..',
+            'inputs': sliders + [
+                {'id': 'section-histogrammes', 'property': 'n_clicks', 'value': 1},
+            ],
+            'state': [],
+            'changedPropIds': ['years-slider.value'],
+        }
+    regions = main.donnees['discovery'].regions
+    requetes['update_waves'] = {
+        'output': '..graph8.figure...waves-table.children..',
+        'inputs': [
+            {'id': 'waves-regions', 'property': 'value', 'value': regions},
+            {'id': 'waves-window', 'property': 'value', 'value': 10},
+            {'id': 'section-vagues', 'property': 'n_clicks', 'value': 1},
+        ],
+        'state': [],
+        'changedPropIds': ['waves-regions.value'],
+    }
+    for nom, requete in requetes.items():
+        def appel(froid):
+            if froid:
+                # Caches vides : les figures et la réponse sont reconstruites
+                main.figures.clear()
+                main.reponses.clear()
+            reponse = client.post('/_dash-update-component', json=requete)
+            if reponse.status_code != 200:
+                raise RuntimeError('%s : réponse %d' % (nom, reponse.status_code))
+            return reponse
+
+        resultats['callback:%s:cold' % nom], reponse = measure(lambda: appel(True), repetitions)
+        resultats['callback:%s:warm' % nom], _ = measure(lambda: appel(False), repetitions)
+        resultats['callback:%s:cold' % nom]['bytes'] = len(reponse.get_data())
+
+    # Préparation de démarrage de serve.py (warmup.py), caches vides
+    def preparer():
+        main.figures.clear()
+        main.reponses.clear()
+        main.warm_up()
+    resultats['warm_up'], _ = measure(preparer, repetitions)
+    return resultats
+
+
+def run_scale(echelle, dossier, repetitions=REPETITIONS):
+    """
+    Génère le jeu de données d'une échelle et le mesure dans un processus séparé
+
+    Args:
+        echelle : facteur multipliant TAILLES_1X
+        dossier : dossier des jeux de données générés
+        repetitions : nombre de mesures de chaque étape
+
+    Returns:
+        run_scale(echelle, dossier, repetitions) : dict étape -> mesures
+    """
+    donnees = generate_dataset(os.path.join(dossier, 'x%d' % echelle), echelle)
+    environnement = dict(
+        os.environ,
+        DASHBOARD_DATA=donnees,
+        DASHBOARD_SNAPSHOT=os.path.join(donnees, '.snapshot'),
+        DASHBOARD_LOTS=os.path.join(donnees, 'lots'),
+        DASHBOARD_INTERVALLE_LOTS='0',
+    )
+    processus = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--mesurer', donnees,
+         '--repetitions', str(repetitions)],
+        env=environnement, stdout=subprocess.PIPE, check=True,
+    )
+    return json.loads(processus.stdout.decode('utf8').strip().splitlines()[-1])
+
+
+def compare(resultats, reference, seuil=SEUIL_REGRESSION):
+    """
+    Compare deux séries de résultats
+
+    Args:
+        resultats : résultats mesurés (format de la sortie JSON)
+        reference : résultats de référence
+        seuil : ralentissement relatif toléré
+
+    Returns:
+        compare(resultats, reference, seuil) : liste de (échelle, étape,
+        médiane de référence, médiane mesurée) des étapes plus lentes que
+        la référence de plus de seuil (et de plus de ECART_MINIMAL)
+    """
+    regressions = []
+    for echelle, etapes in resultats['scales'].items():
+        for nom, mesure in etapes.items():
+            avant = reference.get('scales', {}).get(echelle, {}).get(nom)
+            if avant and mesure['median'] > avant['median'] * (1 + seuil) \
+                    and mesure['median'] - avant['median'] > ECART_MINIMAL:
+                regressions.append((echelle, nom, avant['median'], mesure['median']))
+    return regressions
+
+
+def parse_args(args=None):
+    """
+    Lit les options de la ligne de commande
+
+    Args:
+        args : liste des arguments (sys.argv par défaut)
+
+    Returns:
+        parse_args(args) : argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description='Banc d\'essai du dashboard')
+    parser.add_argument('--echelles', type=int, nargs='+', default=list(ECHELLES),
+                        help='échelles mesurées (défaut : 1 10 100)')
+    parser.add_argument('--repetitions', type=int, default=REPETITIONS,
+                        help='mesures de chaque étape (défaut : %d)' % REPETITIONS)
+    parser.add_argument('--dossier', default=DOSSIER_BENCHMARK,
+                        help='dossier des jeux de données générés')
+    parser.add_argument('--sortie', default='benchmark.json',
+                        help='fichier JSON des résultats (défaut : benchmark.json)')
+    parser.add_argument('--reference', help='résultats JSON de référence à comparer')
+    parser.add_argument('--seuil', type=float, default=SEUIL_REGRESSION,
+                        help='ralentissement toléré (défaut : 0.2, soit 20 %%)')
+    # Utilisé par run_scale : mesure un jeu de données et écrit le JSON sur la sortie
+    parser.add_argument('--mesurer', help=argparse.SUPPRESS)
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    if arguments.mesurer:
+        mesures = bench_pipeline(arguments.mesurer, arguments.repetitions)
+        mesures.update(bench_app(arguments.repetitions))
+        print(json.dumps(mesures))
+        sys.exit(0)
+
+    resultats_echelles = {}
+    for echelle_mesuree in arguments.echelles:
+        print('Échelle %d...' % echelle_mesuree, file=sys.stderr)
+        resultats_echelles[str(echelle_mesuree)] = run_scale(
+            echelle_mesuree, arguments.dossier, arguments.repetitions
+        )
+    resultats_complets = {
+        'meta': {
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'pandas': pd.__version__,
+            'plotly': plotly.__version__,
+            'repetitions': arguments.repetitions,
+            'rows_1x': TAILLES_1X,
+        },
+        'scales': resultats_echelles,
+    }
+    with open(arguments.sortie, 'w', encoding='utf8') as fichier:
+        json.dump(resultats_complets, fichier, indent=1, sort_keys=True)
+    print('Résultats écrits dans', arguments.sortie, file=sys.stderr)
+
+    if arguments.reference:
+        with open(arguments.reference, encoding='utf8') as fichier:
+            resultats_reference = json.load(fichier)
+        lentes = compare(resultats_complets, resultats_reference, arguments.seuil)
+        for echelle_lente, etape_lente, avant_ms, apres_ms in lentes:
+            print('RÉGRESSION x%s %s : %.1f ms -> %.1f ms' % (
+                echelle_lente, etape_lente, avant_ms * 1000, apres_ms * 1000
+            ))
+        sys.exit(1 if lentes else 0)
@@ -0,0 +1,153 @@
+"""
+Classification des météorites d'après leur recclass.
+
+source : https://en.wikipedia.org/wiki/Meteorite_classification
+
+Chaque valeur distincte de recclass (quelques centaines) est comparée une
+seule fois à la table CLASSIFICATION ; le résultat est ensuite recopié sur
+toutes les lignes grâce aux codes d'un pd.Categorical. Ajouter une classe
+revient donc à ajouter une ligne à la table.
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import re
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import timed_stage
+
+# Groupes de météorites : rocheuses, ferreuses, mixtes, et les autres
+GROUPES = ['stony', 'iron', 'stony_iron', 'other']
+
+# Table de classification : (motif sur recclass, groupe, sous-groupe)
+# La première règle qui correspond l'emporte : les noms de classes
+# précis passent donc avant les simples initiales (Howardite avant ^H...)
+CLASSIFICATION = [
+    # stony materials
+    ('Ureilite',        'stony',      'Ureilite'),
+    ('^Diogenite',      'stony',      'Diogenite'),
+    ('^Eucrite',        'stony',      'Eucrite'),
+    ('^Angrite',        'stony',      'Angrite'),
+    ('^Aubrite',        'stony',      'Aubrite'),
+    ('^Howardite',      'stony',      'Howardite'),
+    ('^Stone',          'stony',      'Stone'),
+    ('^Martian',        'stony',      'Martian'),
+    ('^L',              'stony',      'L'),
+    ('^H',              'stony',      'H'),
+    ('^E',              'stony',      'E'),
+    ('^C',              'stony',      'C'),
+    # iron materials
+    ('^Iron',           'iron',       'Iron'),
+    # stony-iron materials
+    ('^Mesosiderite',   'stony_iron', 'Mesosiderite'),
+    ('^Pallasite',      'stony_iron', 'Pallasite'),
+]
+
+
+def classify_values(valeurs):
+    """
+    Retourne le groupe et le sous-groupe de chaque valeur de recclass
+
+    Args:
+        valeurs : valeurs distinctes de recclass
+
+    Returns:
+        classify_values(valeurs) : (liste des groupes, liste des sous-groupes),
+        'other' et None pour les valeurs qu'aucune règle ne reconnaît
+    """
+    regles = [(re.compile(motif), groupe, sous_groupe)
+              for motif, groupe, sous_groupe in CLASSIFICATION]
+    groupes, sous_groupes = [], []
+    for valeur in valeurs:
+        for motif, groupe, sous_groupe in regles:
+            if isinstance(valeur, str) and motif.search(valeur):
+                break
+        else:
+            groupe, sous_groupe = 'other', None
+        groupes.append(groupe)
+        sous_groupes.append(sous_groupe)
+    return groupes, sous_groupes
+
+
+@timed_stage('classify')
+def classify(recclass):
+    """
+    Classe une colonne recclass entière
+
+    Args:
+        recclass : pd.Series des classes
+
+    Returns:
+        classify(recclass) : pd.DataFrame (group, subgroup) de colonnes
+        catégorielles, alignée sur recclass
+    """
+    classes = pd.Categorical(recclass)
+    groupes, sous_groupes = classify_values(classes.categories)
+    sous_categories = list(dict.fromkeys(s for _, _, s in CLASSIFICATION))
+
+    # Code de chaque catégorie de recclass vers le code de son groupe,
+    # la dernière case servant aux valeurs manquantes (code -1)
+    code_groupe = np.array([GROUPES.index(g) for g in groupes] + [GROUPES.index('other')])
+    code_sous_groupe = np.array(
+        [sous_categories.index(s) if s else -1 for s in sous_groupes] + [-1]
+    )
+    return pd.DataFrame({
+        'group': pd.Categorical.from_codes(code_groupe[classes.codes], categories=GROUPES),
+        'subgroup': pd.Categorical.from_codes(
+            code_sous_groupe[classes.codes], categories=sous_categories
+        ),
+    }, index=recclass.index)
+
+
+def sort_by_group(df):
+    """
+    Range les météorites par groupe, dans l'ordre de GROUPES (tri stable :
+    l'ordre des lignes d'un même groupe est conservé)
+
+    Args:
+        df : dataframe avec sa colonne group
+
+    Returns:
+        sort_by_group(df) : nouvelle pd.DataFrame, index 0..n-1
+    """
+    return df.sort_values('group', kind='stable', ignore_index=True)
+
+
+def group_bounds(df):
+    """
+    Retourne les bornes des tranches de chaque groupe d'une dataframe
+    rangée par groupe (sort_by_group)
+
+    Args:
+        df : dataframe rangée par groupe
+
+    Returns:
+        group_bounds(df) : np.ndarray de len(GROUPES) + 1 positions, le groupe
+        i occupant les lignes [bornes[i], bornes[i + 1])
+    """
+    groupes = df['group'].cat
+    return np.searchsorted(groupes.codes.to_numpy(), np.arange(len(groupes.categories) + 1))
+
+
+def subset(maindf, groupe):
+    """
+    Retourne les météorites d'un groupe (comparaison des codes catégoriels,
+    sans nouvelle recherche dans le texte de recclass)
+
+    Si maindf est rangée par groupe (sort_by_group), le groupe est une tranche
+    de maindf, qui en partage la mémoire au lieu de recopier ses lignes.
+
+    Args:
+        maindf : dataframe principale, avec sa colonne group
+        groupe : élément de GROUPES
+
+    Returns:
+        subset(maindf, groupe) : pd.DataFrame
+    """
+    if not maindf['group'].cat.codes.is_monotonic_increasing:
+        return maindf[maindf['group'] == groupe]
+    code = maindf['group'].cat.categories.get_loc(groupe)
+    bornes = group_bounds(maindf)
+    return maindf.iloc[bornes[code]:bornes[code + 1]]
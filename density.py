@@ -0,0 +1,140 @@
+"""
+Agrégation des météorites de la carte sur une grille, côté serveur.
+
+Au lieu d'envoyer un marqueur par météorite, on regroupe les points de la
+zone visible dans des cellules carrées (en degrés) dont la taille dépend du
+zoom : chaque niveau de zoom divise la taille des cellules par deux, comme
+les niveaux d'un geohash. Le nombre de marqueurs envoyés au navigateur reste
+donc borné, quel que soit le nombre de météorites. Lorsque la zone visible
+en contient peu, on renvoie les météorites elles-mêmes.
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import numpy as np
+import pandas as pd
+
+# Au-delà de ce nombre de météorites visibles, on passe en mode agrégé
+MAX_MARQUEURS = 3000
+
+# Nombre de cellules souhaité sur la largeur visible de la carte
+CELLULES_PAR_VUE = 48
+
+# Vue par défaut : le monde entier (projection equirectangular de plotly)
+VUE_DEFAUT = {'lon': 0.0, 'lat': 0.0, 'scale': 1.0}
+
+
+def parse_viewport(relayout_data, viewport=None):
+    """
+    Met à jour la vue de la carte à partir du relayoutData de dcc.Graph
+
+    plotly n'envoie que les propriétés modifiées (par exemple seulement le
+    centre après un déplacement) : on part donc de la vue précédente.
+
+    Args:
+        relayout_data : relayoutData de la carte (ou None)
+        viewport : vue précédente (dict lon, lat, scale) ou None
+
+    Returns:
+        parse_viewport(relayout_data, viewport) : dict lon, lat, scale
+    """
+    vue = dict(viewport or VUE_DEFAUT)
+    relayout_data = relayout_data or {}
+    if relayout_data.get('autosize') or relayout_data.get('geo.fitbounds'):
+        return dict(VUE_DEFAUT)
+    correspondances = {
+        'geo.center.lon': 'lon',
+        'geo.projection.rotation.lon': 'lon',
+        'geo.center.lat': 'lat',
+        'geo.projection.scale': 'scale',
+    }
+    for cle, nom in correspondances.items():
+        if relayout_data.get(cle) is not None:
+            vue[nom] = float(relayout_data[cle])
+    vue['scale'] = max(vue['scale'], 1.0)
+    return vue
+
+
+def visible(lat, lon, viewport):
+    """
+    Indique quels points sont dans la zone visible de la carte
+
+    Args:
+        lat : tableau des latitudes
+        lon : tableau des longitudes
+        viewport : dict lon, lat, scale
+
+    Returns:
+        visible(lat, lon, viewport) : masque booléen
+    """
+    demi_lon = 180.0 / viewport['scale']
+    demi_lat = 90.0 / viewport['scale']
+    # Écart de longitude ramené dans [-180, 180) pour gérer l'antiméridien
+    ecart_lon = (np.asarray(lon) - viewport['lon'] + 180.0) % 360.0 - 180.0
+    return (
+        (np.abs(ecart_lon) <= demi_lon)
+        & (np.abs(np.asarray(lat) - viewport['lat']) <= demi_lat)
+    )
+
+
+def cell_size(viewport):
+    """
+    Retourne la taille (en degrés) des cellules de la grille pour une vue
+
+    Args:
+        viewport : dict lon, lat, scale
+
+    Returns:
+        cell_size(viewport) : float, de la forme 360 / 2**niveau
+    """
+    niveau = int(np.ceil(np.log2(CELLULES_PAR_VUE * viewport['scale'])))
+    return 360.0 / 2 ** niveau
+
+
+def bin_points(lat, lon, mass, taille):
+    """
+    Regroupe des points dans les cellules d'une grille
+
+    Args:
+        lat : tableau des latitudes
+        lon : tableau des longitudes
+        mass : tableau des masses (NaN si inconnue)
+        taille : taille des cellules en degrés
+
+    Returns:
+        bin_points(lat, lon, mass, taille) : pd.DataFrame (lat, lon, count, mass),
+        une ligne par cellule non vide, placée au barycentre de ses points
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    ligne = np.floor((lat + 90.0) / taille).astype(np.int64)
+    colonne = np.floor((lon + 180.0) / taille).astype(np.int64)
+    cles, cellule = np.unique(ligne * (int(360.0 / taille) + 1) + colonne, return_inverse=True)
+    nombre = np.bincount(cellule, minlength=len(cles))
+    return pd.DataFrame({
+        # Le millième de degré (~100 m) suffit pour placer un marqueur de cellule
+        'lat': (np.bincount(cellule, lat, minlength=len(cles)) / nombre).round(3),
+        'lon': (np.bincount(cellule, lon, minlength=len(cles)) / nombre).round(3),
+        'count': nombre,
+        'mass': np.bincount(cellule, np.nan_to_num(np.asarray(mass, dtype=np.float64)),
+                            minlength=len(cles)),
+    })
+
+
+def density(df, viewport):
+    """
+    Prépare les météorites d'une catégorie pour la vue courante de la carte
+
+    Args:
+        df : météorites (colonnes reclat, reclong, mass)
+        viewport : dict lon, lat, scale
+
+    Returns:
+        density(df, viewport) : (None, météorites visibles) si elles sont peu
+        nombreuses, sinon (cellules de bin_points, None)
+    """
+    dans_vue = visible(df['reclat'], df['reclong'], viewport)
+    if dans_vue.sum() <= MAX_MARQUEURS:
+        return None, df[dans_vue]
+    vus = df[dans_vue]
+    return bin_points(vus['reclat'], vus['reclong'], vus['mass'], cell_size(viewport)), None
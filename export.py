@@ -0,0 +1,176 @@
+"""
+Export des météorites filtrées (intervalle d'années, masse maximale), en .csv
+ou en Parquet, envoyé par morceaux au fur et à mesure de sa production.
+
+Les lignes à exporter viennent des index de filtrage (aggregates.FilterIndex) :
+le premier morceau part dès que les positions sont connues, et le fichier
+n'est jamais construit entièrement en mémoire. Le nombre d'exports simultanés
+de chaque processus est borné, afin qu'ils n'occupent pas tous les threads
+qui servent les callbacks ; au-delà, la route répond 503.
+
+    /api/export?dataset=stony&format=parquet&year_min=1900&year_max=1950&max_mass_g=1e6
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import os
+import threading
+
+import flask
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from spatial import json_response, query_parameter
+
+# Lignes envoyées par morceau (et par row group Parquet)
+TAILLE_BLOC_EXPORT = 50000
+
+# Exports simultanés par processus, à garder sous le nombre de threads
+# d'un worker (DASHBOARD_THREADS de serve.py)
+EXPORTS_SIMULTANES = int(os.environ.get('DASHBOARD_EXPORTS', 2))
+
+# Type MIME de chaque format
+FORMATS = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+
+def iter_csv(df, positions, taille_bloc=TAILLE_BLOC_EXPORT):
+    """
+    Produit morceau par morceau le .csv des lignes choisies d'une dataframe
+
+    Args:
+        df : dataframe à exporter
+        positions : positions des lignes (df.iloc), dans l'ordre voulu
+        taille_bloc : nombre de lignes par morceau
+
+    Returns:
+        iter_csv(df, positions, taille_bloc) : générateur de bytes
+    """
+    yield df.iloc[:0].to_csv(index=False).encode('utf8')
+    for debut in range(0, len(positions), taille_bloc):
+        morceau = df.iloc[positions[debut:debut + taille_bloc]]
+        yield morceau.to_csv(index=False, header=False).encode('utf8')
+
+
+class _Tampon:
+    """
+    Fichier en écriture seule dont on retire le contenu au fur et à mesure,
+    pour envoyer un fichier Parquet pendant son écriture
+    """
+
+    def __init__(self):
+        self._morceaux = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, donnees):
+        donnees = bytes(donnees)
+        self._morceaux.append(donnees)
+        self._position += len(donnees)
+        return len(donnees)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        """
+        Retire et retourne ce qui a été écrit depuis l'appel précédent
+
+        Returns:
+            take() : bytes
+        """
+        contenu = b''.join(self._morceaux)
+        self._morceaux = []
+        return contenu
+
+
+def iter_parquet(df, positions, taille_bloc=TAILLE_BLOC_EXPORT):
+    """
+    Produit morceau par morceau le fichier Parquet des lignes choisies d'une
+    dataframe (un row group par morceau)
+
+    Args:
+        df : dataframe à exporter
+        positions : positions des lignes (df.iloc), dans l'ordre voulu
+        taille_bloc : nombre de lignes par morceau
+
+    Returns:
+        iter_parquet(df, positions, taille_bloc) : générateur de bytes
+    """
+    tampon = _Tampon()
+    # Les colonnes catégorielles gardent les mêmes catégories dans chaque morceau :
+    # le schéma du premier vaut pour tous. Une colonne de texte vide dans ce
+    # morceau y aurait le type null : c'est du texte
+    schema = pa.Schema.from_pandas(df.iloc[positions[:taille_bloc]], preserve_index=False)
+    for i, champ in enumerate(schema):
+        if pa.types.is_null(champ.type):
+            schema = schema.set(i, champ.with_type(pa.string()))
+    with pq.ParquetWriter(tampon, schema) as writer:
+        for debut in range(0, len(positions), taille_bloc):
+            morceau = df.iloc[positions[debut:debut + taille_bloc]]
+            writer.write_table(pa.Table.from_pandas(morceau, schema=schema, preserve_index=False))
+            yield tampon.take()
+    yield tampon.take()
+
+
+def add_export_routes(server, source, jeux):
+    """
+    Ajoute au serveur Flask la route d'export /api/export
+
+    Paramètres de la route : dataset (un des jeux, le premier par défaut),
+    format (csv par défaut, ou parquet), year_min et year_max (inclus) et
+    max_mass_g (masse maximale exclue, en g), tous facultatifs.
+
+    Args:
+        server : flask.Flask
+        source : fonction (nom du jeu) -> (dataframe, FilterIndex de cette dataframe)
+        jeux : noms des jeux de données exportables
+    """
+    exports = threading.BoundedSemaphore(EXPORTS_SIMULTANES)
+
+    @server.route('/api/export')
+    def export_meteorites():
+        arguments = flask.request.args
+        jeu = arguments.get('dataset', jeux[0])
+        format_export = arguments.get('format', 'csv')
+        try:
+            if jeu not in jeux:
+                raise ValueError('dataset inconnu : %r (%s)' % (jeu, ', '.join(jeux)))
+            if format_export not in FORMATS:
+                raise ValueError('format inconnu : %r (%s)' % (format_export, ', '.join(FORMATS)))
+            annees = (query_parameter('year_min', defaut=-np.inf),
+                      query_parameter('year_max', defaut=np.inf))
+            seuil = query_parameter('max_mass_g', 0, defaut=np.inf)
+        except ValueError as erreur:
+            return json_response({'error': str(erreur)}, 400)
+
+        if not exports.acquire(blocking=False):
+            reponse = json_response({'error': 'trop d\'exports en cours, réessayez'}, 503)
+            reponse.headers['Retry-After'] = '5'
+            return reponse
+        try:
+            df, index = source(jeu)
+            positions = index.rows(
+                None if annees == (-np.inf, np.inf) else annees,
+                None if seuil == np.inf else seuil
+            )
+            # Les lignes sont exportées dans l'ordre de la dataframe
+            positions = np.sort(positions)
+            producteur = iter_csv if format_export == 'csv' else iter_parquet
+            reponse = flask.Response(producteur(df, positions), mimetype=FORMATS[format_export])
+        except Exception:
+            exports.release()
+            raise
+        # La place est rendue quand la réponse est terminée ou abandonnée par le client
+        reponse.call_on_close(exports.release)
+        reponse.headers['Content-Disposition'] = 'attachment; filename="meteorites-%s.%s"' % (
+            jeu, format_export
+        )
+        reponse.headers['X-Rows'] = str(len(positions))
+        return reponse
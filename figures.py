@@ -0,0 +1,267 @@
+"""
+Création des figures du dashboard.
+
+Les figures ne sont plus construites à l'import : chacune est enregistrée
+dans un FigureRegistry sous la forme d'une fonction, appelée la première fois
+que la figure est demandée. Le résultat est gardé dans un cache LRU de taille
+bornée, indexé par le nom de la figure et ses paramètres (filtres, vue de la
+carte...).
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import threading
+from collections import OrderedDict
+
+import plotly.express as px
+import plotly.graph_objs as go
+
+from instrumentation import metrics
+
+# On créé notre palette de couleur qu'on utilisera pour l'esthétique de notre dashboard
+colors = {
+    'background': '#111111',
+    'text': '#27BBE8',
+    'legend': '#BD99D2',
+    'title': '#864BFD'
+}
+
+# Nombre maximal de figures gardées en cache
+TAILLE_CACHE_FIGURES = 128
+
+
+def apply_theme(fig):
+    """
+    Applique les réglages graphiques communs à toutes les figures
+
+    Args:
+        fig : go.Figure
+
+    Returns:
+        apply_theme(fig) : la même figure
+    """
+    fig.update_layout(
+        plot_bgcolor=colors['background'],paper_bgcolor=colors['background'],font_color=colors['title']
+        )
+    return fig
+
+
+def mean_mass_figure(mass_moy):
+    """
+    Retourne la courbe de la masse moyenne des météorites par année
+
+    Args:
+        mass_moy : pd.DataFrame indexée par year, colonne mass
+
+    Returns:
+        mean_mass_figure(mass_moy) : go.Figure
+    """
+    return apply_theme(px.line(mass_moy,x= mass_moy.index, y= "mass"))
+
+
+def bar_figure(totals):
+    """
+    Retourne l'histogramme des masses totales par année et par continent
+
+    Args:
+        totals : pd.DataFrame (year, continent, mass), une ligne par barre
+
+    Returns:
+        bar_figure(totals) : go.Figure
+    """
+    # px range les barres d'une colonne catégorielle dans l'ordre de ses catégories :
+    # en texte, les continents gardent leur ordre d'apparition (et leurs couleurs)
+    totals = totals.astype({'continent': str})
+    return apply_theme(px.bar(totals, x="year", y="mass", color='continent'))
+
+
+def pie_figure(df):
+    """
+    Retourne le diagramme circulaire de la composition (recclass) de météorites
+
+    Args:
+        df : météorites d'une catégorie
+
+    Returns:
+        pie_figure(df) : go.Figure
+    """
+    fig = px.pie(df, names='recclass')
+    fig.update_traces(textinfo='percent+label',textposition='inside')
+    return apply_theme(fig)
+
+
+# Symbole et couleur des marqueurs de chaque catégorie de la carte
+GEO_MARKERS = {
+    'stony': {'symbol': 'octagon', 'color': 'brown'},
+    'iron': {'symbol': 'triangle-down', 'color': 'goldenrod'},
+    'stony-iron': {'symbol': 'star-diamond-dot', 'color': 'violet'},
+}
+
+
+def geo_layout():
+    """
+    Retourne la mise en page commune des cartes, que le navigateur complète
+    avec les données de geo_data (voir assets/map.js)
+
+    Returns:
+        geo_layout() : dict (layout plotly)
+    """
+    fig = apply_theme(go.Figure())
+    # On conserve le zoom de l'utilisateur lorsque la carte est mise à jour
+    fig.update_layout(uirevision='graph7')
+    return fig.to_plotly_json()['layout']
+
+
+def geo_data(df, cells=None):
+    """
+    Encode en colonnes compactes les données d'une carte, pour un dcc.Store :
+    la figure elle-même est construite dans le navigateur (assets/map.js)
+
+    Args:
+        df : météorites à placer sur la carte (ignoré si cells est donné)
+        cells : cellules de density.bin_points, pour la carte agrégée
+
+    Returns:
+        geo_data(df, cells) : dict sérialisable en JSON
+    """
+    if cells is not None:
+        # Une cellule de la grille par marqueur
+        return {
+            'mode': 'cells',
+            'lat': cells['lat'].tolist(),
+            'lon': cells['lon'].tolist(),
+            'count': cells['count'].tolist(),
+            'mass': cells['mass'].round().tolist(),
+        }
+    # Les étiquettes "Ville[code]" se répètent : on envoie chacune une seule fois,
+    # et pour chaque météorite le numéro de son étiquette
+    etiquettes = (df['City'].astype(str) + "[" + df['code_2'].astype(str) + "]").astype('category')
+    masse = df['mass'].astype(object).where(df['mass'].notna(), None)
+    return {
+        'mode': 'points',
+        # Coordonnées stockées en float32 : on arrondit leur valeur en float64
+        'lat': df['reclat'].astype('float64').round(4).tolist(),
+        'lon': df['reclong'].astype('float64').round(4).tolist(),
+        'labels': etiquettes.cat.categories.tolist(),
+        'label': etiquettes.cat.codes.tolist(),
+        'year': df['year'].tolist(),
+        'mass': masse.tolist(),
+    }
+
+
+def _freeze(valeur):
+    """
+    Rend un paramètre de figure utilisable dans une clé de cache
+    (les listes et dict venant des callbacks ne sont pas hashables)
+
+    Args:
+        valeur : paramètre
+
+    Returns:
+        _freeze(valeur) : équivalent hashable
+    """
+    if isinstance(valeur, dict):
+        return tuple(sorted((cle, _freeze(v)) for cle, v in valeur.items()))
+    if isinstance(valeur, (list, tuple)):
+        return tuple(_freeze(v) for v in valeur)
+    return valeur
+
+
+class FigureRegistry:
+    """
+    Registre des figures : chaque figure est construite à la demande puis
+    gardée dans un cache LRU
+
+    Attributs :
+        hits : nombre de figures servies depuis le cache
+        misses : nombre de figures construites
+        evictions : nombre de figures sorties du cache faute de place
+    """
+
+    def __init__(self, taille_max=TAILLE_CACHE_FIGURES):
+        self.taille_max = taille_max
+        self._fabriques = {}
+        self._cache = OrderedDict()
+        self._verrou = threading.Lock()
+        # Incrémenté par clear() : une figure commencée avant ne sera pas gardée
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def register(self, nom):
+        """
+        Décorateur enregistrant la fonction qui construit une figure
+
+        Args:
+            nom : nom de la figure
+
+        Returns:
+            register(nom) : décorateur (la fonction est retournée inchangée)
+        """
+        def decorateur(fabrique):
+            self._fabriques[nom] = fabrique
+            return fabrique
+        return decorateur
+
+    def get(self, nom, **params):
+        """
+        Retourne une figure, construite seulement si elle n'est pas en cache
+
+        La figure retournée est partagée : elle ne doit pas être modifiée.
+
+        Args:
+            nom : nom de la figure
+            params : paramètres passés à sa fonction de construction
+
+        Returns:
+            get(nom, **params) : go.Figure
+        """
+        cle = (nom, _freeze(params))
+        with self._verrou:
+            if cle in self._cache:
+                self._cache.move_to_end(cle)
+                self.hits += 1
+                return self._cache[cle]
+            self.misses += 1
+            generation = self._generation
+        # La construction se fait hors du verrou : deux requêtes simultanées
+        # peuvent construire la même figure, la seconde écrase la première
+        with metrics.stage('figure:' + nom):
+            figure = self._fabriques[nom](**params)
+        with self._verrou:
+            if generation != self._generation:
+                # Le cache a été vidé pendant la construction (nouvelles données) :
+                # la figure est retournée mais pas gardée
+                return figure
+            self._cache[cle] = figure
+            self._cache.move_to_end(cle)
+            while len(self._cache) > self.taille_max:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+        return figure
+
+    def clear(self):
+        """
+        Vide le cache (les compteurs sont conservés), par exemple lorsque les
+        données changent
+        """
+        with self._verrou:
+            self._cache.clear()
+            self._generation += 1
+
+    def stats(self):
+        """
+        Retourne les compteurs du cache
+
+        Returns:
+            stats() : dict (size, max_size, hits, misses, evictions)
+        """
+        with self._verrou:
+            return {
+                'size': len(self._cache),
+                'max_size': self.taille_max,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
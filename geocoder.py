@@ -0,0 +1,213 @@
+"""
+Géocodage inverse des météorites : on associe à chaque lieu d'impact
+(reclat, reclong) la ville la plus proche de worldcitiespop.csv,
+et donc son pays.
+
+Les villes sont placées sur la sphère unité (coordonnées x, y, z) dans un
+KD-tree : la ville la plus proche à la surface de la Terre est aussi la plus
+proche en distance euclidienne dans l'espace. L'index est construit une seule
+fois puis enregistré sur le disque.
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import logging
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from instrumentation import timed_stage
+
+logger = logging.getLogger(__name__)
+
+# Rayon moyen de la Terre en kilomètres
+RAYON_TERRE_KM = 6371.0088
+
+# Au-delà de cette distance, la ville la plus proche n'est pas retenue :
+# le pays reste inconnu (météorites de l'Antarctique, coordonnées (0, 0)...)
+DISTANCE_MAX_KM = 300.0
+
+# Version du format du fichier de l'index
+VERSION_INDEX = 1
+
+
+def to_unit_sphere(lat, lon):
+    """
+    Convertit des latitudes / longitudes (en degrés) en points de la sphère unité
+
+    Args:
+        lat : tableau des latitudes
+        lon : tableau des longitudes
+
+    Returns:
+        to_unit_sphere(lat, lon) : np.ndarray de forme (n, 3)
+    """
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+def chord_to_km(corde):
+    """
+    Convertit une distance euclidienne sur la sphère unité (corde)
+    en distance orthodromique en kilomètres
+
+    Args:
+        corde : tableau des longueurs de corde
+
+    Returns:
+        chord_to_km(corde) : np.ndarray
+    """
+    corde = np.minimum(np.asarray(corde, dtype=np.float64), 2.0)
+    return 2.0 * np.arcsin(corde / 2.0) * RAYON_TERRE_KM
+
+
+class ReverseGeocoder:
+    """
+    Index spatial des villes de worldcitiespop.csv
+
+    Attributs :
+        tree : cKDTree des villes sur la sphère unité
+        city : nom (AccentCity) de chaque ville
+        country : code pays de chaque ville, en majuscules (pd.Categorical)
+    """
+
+    def __init__(self, tree, city, country):
+        self.tree = tree
+        self.city = city
+        self.country = country
+
+    @classmethod
+    def from_csv(cls, chemin, taille_bloc=500000):
+        """
+        Construit l'index à partir de worldcitiespop.csv, lu par blocs
+        et seulement pour les colonnes utiles
+
+        Args:
+            chemin : chemin de worldcitiespop.csv
+            taille_bloc : nombre de lignes lues à la fois
+
+        Returns:
+            from_csv(chemin, taille_bloc) : ReverseGeocoder
+        """
+        blocs = []
+        lecteur = pd.read_csv(
+            chemin,
+            usecols=['Country', 'AccentCity', 'Latitude', 'Longitude'],
+            dtype={'Country': 'category', 'AccentCity': object,
+                   'Latitude': np.float32, 'Longitude': np.float32},
+            chunksize=taille_bloc,
+        )
+        for bloc in lecteur:
+            blocs.append(bloc.dropna(subset=['Latitude', 'Longitude']))
+        cities = pd.concat(blocs, ignore_index=True)
+        tree = cKDTree(to_unit_sphere(cities['Latitude'], cities['Longitude']))
+        country = pd.Categorical(cities['Country'].astype(str).str.upper())
+        return cls(tree, cities['AccentCity'].to_numpy(dtype=object), country)
+
+    def save(self, chemin):
+        """
+        Enregistre l'index sur le disque (écriture atomique)
+
+        Args:
+            chemin : chemin du fichier
+        """
+        temporaire = '%s.%d.tmp' % (chemin, os.getpid())
+        with open(temporaire, 'wb') as fichier:
+            pickle.dump(
+                (VERSION_INDEX, self.tree, self.city, self.country),
+                fichier, protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(temporaire, chemin)
+
+    @classmethod
+    def load(cls, chemin):
+        """
+        Relit un index enregistré par save
+
+        Args:
+            chemin : chemin du fichier
+
+        Returns:
+            load(chemin) : ReverseGeocoder, ou None si le fichier est absent
+            ou d'une autre version
+        """
+        try:
+            with open(chemin, 'rb') as fichier:
+                version, tree, city, country = pickle.load(fichier)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return None
+        if version != VERSION_INDEX:
+            return None
+        return cls(tree, city, country)
+
+    def query(self, lat, lon, distance_max_km=DISTANCE_MAX_KM):
+        """
+        Cherche en une seule requête vectorisée la ville la plus proche
+        de chaque point
+
+        Args:
+            lat : tableau des latitudes
+            lon : tableau des longitudes
+            distance_max_km : distance au-delà de laquelle le point reste sans ville
+
+        Returns:
+            query(lat, lon, distance_max_km) : pd.DataFrame (City, code_2, distance_km)
+            alignée sur les points ; City et code_2 valent NaN si aucune ville
+            n'est assez proche ou si le point n'a pas de coordonnées
+        """
+        points = to_unit_sphere(lat, lon)
+        valides = np.isfinite(points).all(axis=1)
+        distance = np.full(len(points), np.nan)
+        indices = np.full(len(points), -1)
+        if valides.any():
+            corde, trouves = self.tree.query(points[valides], k=1)
+            distance[valides] = chord_to_km(corde)
+            indices[valides] = trouves
+        retenus = valides & (distance <= distance_max_km)
+
+        city = np.full(len(points), np.nan, dtype=object)
+        city[retenus] = self.city[indices[retenus]]
+        code = np.full(len(points), np.nan, dtype=object)
+        code[retenus] = np.asarray(self.country)[indices[retenus]]
+        return pd.DataFrame({'City': city, 'code_2': code, 'distance_km': distance})
+
+
+@timed_stage('load_geocoder')
+def load_geocoder(chemin_villes, dossier_cache):
+    """
+    Retourne l'index des villes, en le relisant depuis le cache s'il a été
+    construit à partir de la même version de worldcitiespop.csv
+
+    Args:
+        chemin_villes : chemin de worldcitiespop.csv
+        dossier_cache : dossier où enregistrer l'index
+
+    Returns:
+        load_geocoder(chemin_villes, dossier_cache) : ReverseGeocoder
+    """
+    infos = os.stat(chemin_villes)
+    nom = 'geocoder-%d-%d.pkl' % (infos.st_size, infos.st_mtime_ns)
+    chemin = os.path.join(dossier_cache, nom)
+    geocoder = ReverseGeocoder.load(chemin)
+    if geocoder is None:
+        logger.info('Construction de l\'index des villes (%s)', chemin_villes)
+        geocoder = ReverseGeocoder.from_csv(chemin_villes)
+        os.makedirs(dossier_cache, exist_ok=True)
+        geocoder.save(chemin)
+        # Les anciennes versions ne sont retirées qu'une fois la nouvelle
+        # publiée, par le processus qui l'a écrite. Un processus qui a déjà
+        # ouvert un ancien fichier le lit jusqu'au bout ; les fichiers
+        # temporaires d'un autre processus en cours d'écriture sont laissés
+        for ancien in os.listdir(dossier_cache):
+            if ancien.startswith('geocoder-') and ancien != nom and not ancien.endswith('.tmp'):
+                try:
+                    os.remove(os.path.join(dossier_cache, ancien))
+                except FileNotFoundError:
+                    # Déjà retiré par un autre processus
+                    pass
+    return geocoder
@@ -0,0 +1,377 @@
+"""
+Cache des réponses JSON de Dash, compressées une seule fois.
+
+La réponse de _dash-layout contient toutes les figures de la page, et celle
+d'un callback ne dépend que de ses entrées : pour une même version des
+données, elles sont toujours identiques. On garde donc en mémoire leurs
+octets, et leurs versions compressées (brotli, gzip) calculées au premier
+client qui les demande. Les réponses en GET portent un ETag fort, formé de la
+version des données et d'une empreinte du contenu, et un client qui le
+renvoie (If-None-Match) reçoit un 304 sans corps.
+
+Une requête de callback est identifiée par ce dont dépend sa réponse (sortie,
+valeurs des entrées et des états), et non par les octets envoyés : les
+réponses préparées au démarrage (warmup.py) servent ainsi aux navigateurs.
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import brotli
+import flask
+
+# Routes de Dash dont les réponses sont gardées
+ROUTES_CACHE = ('_dash-layout', '_dash-dependencies', '_dash-update-component')
+
+# Nombre maximal de réponses gardées (tous paramètres de callbacks confondus)
+TAILLE_CACHE_REPONSES = 256
+
+# En dessous de cette taille (en octets), une réponse n'est pas compressée
+TAILLE_MIN_COMPRESSION = 1024
+
+# Niveaux de compression : chaque réponse n'est compressée qu'une fois,
+# on peut donc privilégier la taille
+NIVEAU_GZIP = 9
+QUALITE_BROTLI = 9
+
+# Encodages proposés, par ordre de préférence à qualité égale
+ENCODAGES = ('br', 'gzip')
+
+# Suffixe de l'ETag de chaque encodage : un ETag fort désigne un contenu exact
+SUFFIXES_ETAG = {'br': '-br', 'gzip': '-gz', 'identity': ''}
+
+
+def _compresser(contenu, encodage):
+    """
+    Compresse un contenu
+
+    Args:
+        contenu : bytes
+        encodage : 'br' ou 'gzip'
+
+    Returns:
+        _compresser(contenu, encodage) : bytes
+    """
+    if encodage == 'br':
+        return brotli.compress(contenu, quality=QUALITE_BROTLI)
+    # mtime=0 : les mêmes octets pour le même contenu, d'un processus à l'autre
+    return gzip.compress(contenu, compresslevel=NIVEAU_GZIP, mtime=0)
+
+
+class CachedResponse:
+    """
+    Réponse gardée en cache : contenu, ETag et versions compressées
+
+    Attributs :
+        etag : ETag de la version non compressée (sans guillemets)
+        mimetype : type de la réponse
+        contenu : bytes non compressés
+    """
+
+    def __init__(self, version, contenu, mimetype):
+        self.etag = '%s-%s' % (version, hashlib.sha256(contenu).hexdigest()[:16])
+        self.mimetype = mimetype
+        self.contenu = contenu
+        self._compresses = {}
+        self._verrou = threading.Lock()
+
+    # Une réponse préparée dans un processus de warmup.py est renvoyée au
+    # processus principal : le verrou n'est pas transmis
+    def __getstate__(self):
+        etat = dict(self.__dict__)
+        del etat['_verrou']
+        return etat
+
+    def __setstate__(self, etat):
+        self.__dict__.update(etat)
+        self._verrou = threading.Lock()
+
+    def encoded(self, encodage):
+        """
+        Retourne le contenu dans un encodage, compressé au premier appel
+
+        Args:
+            encodage : 'br', 'gzip' ou 'identity'
+
+        Returns:
+            encoded(encodage) : bytes
+        """
+        if encodage == 'identity':
+            return self.contenu
+        with self._verrou:
+            if encodage not in self._compresses:
+                self._compresses[encodage] = _compresser(self.contenu, encodage)
+            return self._compresses[encodage]
+
+    def encode_all(self):
+        """
+        Calcule dès maintenant les versions compressées du contenu
+        """
+        if len(self.contenu) >= TAILLE_MIN_COMPRESSION:
+            for encodage in ENCODAGES:
+                self.encoded(encodage)
+
+    def to_response(self, requete):
+        """
+        Construit la réponse Flask adaptée à une requête (encodage accepté, 304)
+
+        Args:
+            requete : flask.Request
+
+        Returns:
+            to_response(requete) : flask.Response
+        """
+        if len(self.contenu) < TAILLE_MIN_COMPRESSION:
+            encodage = 'identity'
+        else:
+            encodage = requete.accept_encodings.best_match(ENCODAGES, default='identity')
+        etag = self.etag + SUFFIXES_ETAG[encodage]
+
+        if requete.method in ('GET', 'HEAD') and etag in requete.if_none_match:
+            reponse = flask.Response(status=304)
+        else:
+            reponse = flask.Response(self.encoded(encodage), mimetype=self.mimetype)
+            if encodage != 'identity':
+                reponse.headers['Content-Encoding'] = encodage
+        reponse.set_etag(etag)
+        reponse.vary.add('Accept-Encoding')
+        # Le navigateur garde la réponse mais la revalide (ETag) à chaque visite
+        reponse.cache_control.no_cache = True
+        return reponse
+
+
+class ResponseCache:
+    """
+    Cache LRU de réponses, indexé par la version des données, la route et
+    le corps de la requête
+
+    Attributs :
+        hits : nombre de réponses servies depuis le cache
+        misses : nombre de réponses produites par Dash
+    """
+
+    def __init__(self, version, taille_max=TAILLE_CACHE_REPONSES):
+        """
+        Args:
+            version : fonction sans argument retournant la version des données
+            taille_max : nombre maximal de réponses gardées
+        """
+        self.version = version
+        self.taille_max = taille_max
+        self._cache = OrderedDict()
+        self._verrou = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, requete):
+        """
+        Retourne la clé d'une requête
+
+        Args:
+            requete : flask.Request
+
+        Returns:
+            key(requete) : tuple (version, méthode, chemin, empreinte du corps)
+        """
+        methode = 'GET' if requete.method == 'HEAD' else requete.method
+        corps = hashlib.sha256(_corps_canonique(requete.path, requete.get_data())).hexdigest()
+        return (self.version(), methode, requete.path, corps)
+
+    def get(self, cle):
+        """
+        Retourne une réponse gardée
+
+        Args:
+            cle : clé de la requête (key)
+
+        Returns:
+            get(cle) : CachedResponse, ou None
+        """
+        with self._verrou:
+            if cle not in self._cache:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(cle)
+            self.hits += 1
+            return self._cache[cle]
+
+    def put(self, cle, reponse):
+        """
+        Garde le contenu d'une réponse de Dash
+
+        Args:
+            cle : clé de la requête (key)
+            reponse : flask.Response (status 200, non compressée)
+
+        Returns:
+            put(cle, reponse) : CachedResponse
+        """
+        return self.insert(cle, CachedResponse(cle[0], reponse.get_data(), reponse.mimetype))
+
+    def insert(self, cle, entree):
+        """
+        Garde une réponse déjà construite (par exemple dans un autre processus)
+
+        Args:
+            cle : clé de la requête (key)
+            entree : CachedResponse
+
+        Returns:
+            insert(cle, entree) : CachedResponse
+        """
+        with self._verrou:
+            self._cache[cle] = entree
+            self._cache.move_to_end(cle)
+            while len(self._cache) > self.taille_max:
+                self._cache.popitem(last=False)
+        return entree
+
+    def clear(self):
+        """
+        Vide le cache (les compteurs sont conservés)
+        """
+        with self._verrou:
+            self._cache.clear()
+
+    def stats(self):
+        """
+        Retourne les compteurs du cache
+
+        Returns:
+            stats() : dict (size, bytes, hits, misses)
+        """
+        with self._verrou:
+            return {
+                'size': len(self._cache),
+                'bytes': sum(len(e.contenu) for e in self._cache.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+def _normaliser(valeur):
+    """
+    Normalise une valeur JSON : un nombre entier s'écrit sans décimale, comme
+    dans le navigateur (0.0 y devient 0), et une valeur nulle est retirée des
+    dict, comme une valeur undefined
+
+    Args:
+        valeur : valeur décodée du JSON
+
+    Returns:
+        _normaliser(valeur) : valeur normalisée
+    """
+    if isinstance(valeur, float) and valeur.is_integer():
+        return int(valeur)
+    if isinstance(valeur, list):
+        return [_normaliser(v) for v in valeur]
+    if isinstance(valeur, dict):
+        return {k: _normaliser(v) for k, v in valeur.items() if v is not None}
+    return valeur
+
+
+def _corps_canonique(chemin, corps):
+    """
+    Retourne la forme canonique du corps d'une requête
+
+    Pour un callback, seuls comptent la sortie et les valeurs des entrées et
+    des états : changedPropIds (entrée qui a changé, qu'aucun callback du
+    dashboard ne lit) et l'ordre des clés sont ignorés.
+
+    Args:
+        chemin : chemin de la requête
+        corps : bytes du corps
+
+    Returns:
+        _corps_canonique(chemin, corps) : bytes
+    """
+    if not chemin.rstrip('/').endswith('_dash-update-component'):
+        return corps
+    try:
+        contenu = json.loads(corps)
+    except ValueError:
+        return corps
+    if not isinstance(contenu, dict):
+        return corps
+    # Sans état, le navigateur n'envoie pas la clé state
+    contenu = {cle: contenu.get(cle) or None for cle in ('output', 'inputs', 'state')}
+    return json.dumps(_normaliser(contenu), sort_keys=True, separators=(',', ':')).encode('utf8')
+
+
+def _route_cachee(chemin):
+    """
+    Indique si les réponses d'un chemin sont gardées en cache
+
+    Args:
+        chemin : chemin de la requête
+
+    Returns:
+        _route_cachee(chemin) : bool
+    """
+    return chemin.rstrip('/').endswith(ROUTES_CACHE)
+
+
+def cache_responses(app, version, taille_max=TAILLE_CACHE_REPONSES):
+    """
+    Garde en cache, compressées, les réponses JSON de Dash (layout,
+    dépendances et callbacks) d'une application
+
+    Args:
+        app : dash.Dash
+        version : fonction sans argument retournant la version des données
+        taille_max : nombre maximal de réponses gardées
+
+    Returns:
+        cache_responses(app, version, taille_max) : ResponseCache, à vider
+        lorsque les données changent
+    """
+    cache = ResponseCache(version, taille_max)
+    server = app.server
+
+    @server.before_request
+    def reponse_en_cache():
+        requete = flask.request
+        if requete.method not in ('GET', 'HEAD', 'POST') or not _route_cachee(requete.path):
+            return None
+        cle = cache.key(requete)
+        entree = cache.get(cle)
+        if entree is not None:
+            return entree.to_response(requete)
+        flask.g.cle_reponse = cle
+        return None
+
+    @server.after_request
+    def garder_reponse(reponse):
+        cle = flask.g.pop('cle_reponse', None)
+        # Les 204 (PreventUpdate) et les erreurs ne sont pas gardés
+        if cle is None or reponse.status_code != 200 or reponse.direct_passthrough \
+                or 'Content-Encoding' in reponse.headers:
+            return reponse
+        return cache.put(cle, reponse).to_response(flask.request)
+
+    return cache
+
+
+def preload(app, cache, chemin):
+    """
+    Produit et garde la réponse d'une route en GET, avec ses versions
+    compressées, sans passer par les fonctions before/after_request du serveur
+
+    Utilisé avant le fork des workers de serve.py, qui héritent ainsi des
+    octets déjà compressés.
+
+    Args:
+        app : dash.Dash
+        cache : ResponseCache de cache_responses
+        chemin : chemin de la route (par exemple '/_dash-layout')
+    """
+    server = app.server
+    with server.test_request_context(chemin):
+        reponse = server.make_response(server.dispatch_request())
+        entree = cache.put(cache.key(flask.request), reponse)
+    entree.encode_all()
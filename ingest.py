@@ -0,0 +1,305 @@
+"""
+Ajout de nouvelles météorites sans refaire tout le traitement des données.
+
+Les nouvelles météorites arrivent par lots : des fichiers .csv au format de
+meteorite-landings.csv, déposés (sans jamais être modifiés ensuite) dans le
+dossier des lots. Seules les lignes d'un lot passent par le nettoyage, le
+géocodage et la classification de pipeline.py, avec les continents et l'index
+des villes chargés une fois par processus ; le résultat est gardé dans
+l'instantané courant (snapshot.py), puis ajouté aux dataframes, aux agrégats
+et aux index existants (update_frames, puis main.update_data).
+
+Aucun traitement ne repasse sur les données existantes : pas de nouveau tri,
+regroupement ou KD-tree. Il reste des copies linéaires : maindf et les
+tableaux des index sont recopiés dans leur nouvelle version, l'ancienne
+servant encore les requêtes en cours.
+
+Ajout d'un lot, pris en compte par le serveur sans redémarrage :
+
+    $ python ingest.py nouvelles-meteorites.csv
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+
+import pipeline
+import snapshot
+from aggregates import DIMENSIONS_CUBE, mean_mass_by_year, roll_up
+from classification import group_bounds, sort_by_group, subset
+from instrumentation import timed_stage
+
+logger = logging.getLogger(__name__)
+
+# Dossier des lots de nouvelles météorites
+DOSSIER_LOTS = os.environ.get(
+    'DASHBOARD_LOTS', os.path.join(pipeline.DOSSIER_DONNEES, 'lots')
+)
+
+# Colonnes attendues dans un lot (celles de meteorite-landings.csv)
+COLONNES_LOT = [
+    'name', 'id', 'nametype', 'recclass', 'mass', 'fall',
+    'year', 'reclat', 'reclong', 'GeoLocation',
+]
+
+# Continents et index des villes servant à traiter les lots, chargés au
+# premier lot traité par le processus puis réutilisés (dossier -> tuple)
+_references = {}
+
+
+def reference_data(dossier=None):
+    """
+    Retourne les continents et l'index des villes utilisés pour traiter
+    les lots, chargés une seule fois par processus
+
+    Args:
+        dossier : dossier des données (pipeline.DOSSIER_DONNEES par défaut)
+
+    Returns:
+        reference_data(dossier) : (résultat de pipeline.read_continents,
+        index de pipeline.load_city_index)
+    """
+    cle = dossier or pipeline.DOSSIER_DONNEES
+    if cle not in _references:
+        _references[cle] = (pipeline.read_continents(dossier), pipeline.load_city_index(dossier))
+    return _references[cle]
+
+
+class Insertion:
+    """
+    Place des lignes d'un lot dans une dataframe complétée par update_frames
+
+    Attributs :
+        lignes : lignes ajoutées, dans l'ordre de positions
+        positions : position de chacune dans la dataframe complétée
+    """
+
+    def __init__(self, lignes, positions, bornes=None, decalages=None):
+        self.lignes = lignes
+        self.positions = positions
+        # Tranches de la dataframe d'origine (group_bounds) et nombre de
+        # lignes ajoutées devant chacune ; None si les lignes existantes
+        # n'ont pas bougé
+        self._bornes = bornes
+        self._decalages = decalages
+
+    def renumber(self, positions):
+        """
+        Retourne la position, dans la dataframe complétée, de lignes de
+        la dataframe d'origine
+
+        Args:
+            positions : positions dans la dataframe d'origine
+
+        Returns:
+            renumber(positions) : np.ndarray
+        """
+        if self._bornes is None:
+            return positions
+        tranche = np.searchsorted(self._bornes, positions, side='right') - 1
+        return positions + self._decalages[tranche]
+
+
+def add_batch(chemin, dossier_lots=None):
+    """
+    Enregistre un lot de nouvelles météorites dans le dossier des lots
+
+    Le lot est copié sous un nom temporaire puis renommé : le serveur ne voit
+    jamais de lot incomplet. Les noms suivent l'ordre d'arrivée des lots.
+
+    Args:
+        chemin : fichier .csv au format de meteorite-landings.csv
+        dossier_lots : dossier des lots (DOSSIER_LOTS par défaut)
+
+    Returns:
+        add_batch(chemin, dossier_lots) : nom du lot
+    """
+    colonnes = pd.read_csv(chemin, nrows=0).columns
+    manquantes = [c for c in COLONNES_LOT if c not in colonnes]
+    if manquantes:
+        raise ValueError('Colonnes absentes du lot %s : %s' % (chemin, ', '.join(manquantes)))
+    dossier_lots = dossier_lots or DOSSIER_LOTS
+    os.makedirs(dossier_lots, exist_ok=True)
+    nom = 'lot-%020d' % time.time_ns()
+    cible = os.path.join(dossier_lots, nom + '.csv')
+    temporaire = '%s.%d.tmp' % (cible, os.getpid())
+    shutil.copyfile(chemin, temporaire)
+    os.replace(temporaire, cible)
+    return nom
+
+
+def pending_batches(deja=(), dossier_lots=None):
+    """
+    Retourne les lots pas encore appliqués, dans l'ordre d'arrivée
+
+    Args:
+        deja : noms des lots déjà appliqués
+        dossier_lots : dossier des lots (DOSSIER_LOTS par défaut)
+
+    Returns:
+        pending_batches(deja, dossier_lots) : liste de noms de lots
+    """
+    dossier_lots = dossier_lots or DOSSIER_LOTS
+    if not os.path.isdir(dossier_lots):
+        return []
+    noms = [os.path.splitext(f)[0] for f in os.listdir(dossier_lots) if f.endswith('.csv')]
+    return sorted(nom for nom in noms if nom not in deja)
+
+
+@timed_stage('read_batch')
+def read_batch(nom, version, dossier=None, dossier_lots=None):
+    """
+    Retourne les lignes d'un lot, traitées comme celles de maindf
+
+    Le résultat est gardé dans le dossier de l'instantané : un lot n'est
+    traité qu'une fois, quel que soit le nombre de processus du serveur.
+
+    Args:
+        nom : nom du lot
+        version : version de l'instantané (snapshot.source_version)
+        dossier : dossier des données (pipeline.DOSSIER_DONNEES par défaut)
+        dossier_lots : dossier des lots (DOSSIER_LOTS par défaut)
+
+    Returns:
+        read_batch(nom, version, dossier, dossier_lots) : pd.DataFrame au format de maindf
+    """
+    dossier_traites = os.path.join(snapshot.snapshot_dir(version), 'lots')
+    chemin_traite = os.path.join(dossier_traites, nom + '.feather')
+    if os.path.exists(chemin_traite):
+        return feather.read_table(chemin_traite, memory_map=True).to_pandas()
+
+    brut = pd.read_csv(os.path.join(dossier_lots or DOSSIER_LOTS, nom + '.csv'))
+    continents, villes = reference_data(dossier)
+    lignes = pipeline.compact_dtypes(pipeline.process_meteorites(
+        brut[COLONNES_LOT], continents, dossier, geocoder=villes
+    ))
+    os.makedirs(dossier_traites, exist_ok=True)
+    temporaire = '%s.%d.tmp' % (chemin_traite, os.getpid())
+    feather.write_feather(lignes, temporaire, compression='uncompressed')
+    os.replace(temporaire, chemin_traite)
+    return lignes
+
+
+@timed_stage('update_frames')
+def update_frames(frames, lignes):
+    """
+    Ajoute de nouvelles météorites aux dataframes du dashboard
+
+    Seules les nouvelles lignes sont classées et agrégées ; les agrégats
+    existants sont complétés (le cube ne compte qu'une ligne par année,
+    continent et groupe). Les nouvelles lignes sont placées à la fin de la
+    tranche de leur groupe : maindf reste rangée par groupe, et ses
+    sous-dataframes sont toujours des tranches sans copie. Les dataframes
+    d'origine ne sont pas modifiées.
+
+    Args:
+        frames : dict de snapshot.load_frames (maindf rangée par groupe)
+        lignes : lignes au format de maindf (read_batch)
+
+    Returns:
+        update_frames(frames, lignes) : (nouveau dict, mêmes clés ; dict
+        nom -> Insertion pour maindf, stony, iron et stony_iron)
+    """
+    maindf = frames['maindf']
+    lignes = sort_by_group(lignes)
+    bornes, bornes_lot = group_bounds(maindf), group_bounds(lignes)
+    nouvelles = pipeline.derived_frames(lignes)
+
+    resultat = dict(frames)
+    morceaux = []
+    for groupe in range(len(bornes) - 1):
+        morceaux.append(maindf.iloc[bornes[groupe]:bornes[groupe + 1]])
+        morceaux.append(lignes.iloc[bornes_lot[groupe]:bornes_lot[groupe + 1]])
+    resultat['maindf'] = pipeline.concat_rows(morceaux, ignore_index=True)
+    # La ligne i du lot (rangé par groupe) suit toutes les lignes existantes
+    # de son groupe et des groupes précédents, et les i lignes du lot avant elle
+    rang = np.arange(len(lignes))
+    groupe_lot = np.searchsorted(bornes_lot, rang, side='right') - 1
+    insertions = {
+        'maindf': Insertion(lignes, bornes[groupe_lot + 1] + rang, bornes, bornes_lot),
+    }
+
+    categories = maindf['group'].cat.categories
+    for nom in ('stony', 'iron', 'stony_iron'):
+        resultat[nom] = subset(resultat['maindf'], nom)
+        code = categories.get_loc(nom)
+        ajout = lignes.iloc[bornes_lot[code]:bornes_lot[code + 1]]
+        insertions[nom] = Insertion(ajout, len(frames[nom]) + np.arange(len(ajout)))
+
+    for nom in ('cube', 'cube_min'):
+        resultat[nom] = roll_up(
+            pipeline.append_rows(frames[nom], nouvelles[nom]), DIMENSIONS_CUBE
+        )
+    resultat['mass_moy'] = mean_mass_by_year(resultat['cube'])
+    return resultat, insertions
+
+
+def data_version(lots=(), dossier=None):
+    """
+    Retourne la version des données servies : celle de l'instantané,
+    combinée aux noms des lots appliqués
+
+    Args:
+        lots : noms des lots appliqués
+        dossier : dossier des données (pipeline.DOSSIER_DONNEES par défaut)
+
+    Returns:
+        data_version(lots, dossier) : str (16 caractères hexadécimaux)
+    """
+    version = snapshot.source_version(dossier)
+    if not lots:
+        return version
+    sha = hashlib.sha256(version.encode())
+    for nom in sorted(lots):
+        sha.update(nom.encode())
+    return sha.hexdigest()[:16]
+
+
+def apply_batches(frames, deja=(), dossier=None, dossier_lots=None):
+    """
+    Applique aux dataframes les lots arrivés depuis le dernier appel
+
+    Args:
+        frames : dict de snapshot.load_frames (ou d'un appel précédent)
+        deja : noms des lots déjà appliqués
+        dossier : dossier des données (pipeline.DOSSIER_DONNEES par défaut)
+        dossier_lots : dossier des lots (DOSSIER_LOTS par défaut)
+
+    Returns:
+        apply_batches(frames, deja, dossier, dossier_lots) : (dict des dataframes
+        à jour, liste des lots appliqués, vide si frames est inchangé, dict
+        d'Insertion de update_frames ou None si aucune ligne n'a été ajoutée)
+    """
+    noms = pending_batches(deja, dossier_lots)
+    if not noms:
+        return frames, [], None
+    version = snapshot.source_version(dossier)
+    lignes = pd.concat(
+        [read_batch(nom, version, dossier, dossier_lots) for nom in noms], ignore_index=True
+    )
+    logger.info('%d nouvelles météorites (%d lots)', len(lignes), len(noms))
+    if len(lignes) == 0:
+        return frames, noms, None
+    resultat, insertions = update_frames(frames, lignes)
+    return resultat, noms, insertions
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    # Le lot est traité tout de suite, dans l'instantané à jour : les processus
+    # du serveur n'auront plus qu'à lire son résultat
+    snapshot.load_frames()
+    version_courante = snapshot.source_version()
+    for chemin_lot in sys.argv[1:]:
+        nom_lot = add_batch(chemin_lot)
+        lignes_lot = read_batch(nom_lot, version_courante)
+        print('%s : %d météorites retenues (%s)' % (chemin_lot, len(lignes_lot), nom_lot))
@@ -0,0 +1,322 @@
+"""
+Mesures du dashboard : durée des étapes du traitement des données et
+latence des callbacks, exposées au format texte de Prometheus sur /metrics.
+
+Chaque étape (lecture d'un fichier, géocodage, merge, agrégats, construction
+d'une figure...) enregistre sa durée, ses nombres de lignes en entrée et en
+sortie et la variation de mémoire du processus. Chaque appel de callback
+enregistre sa latence et la taille de sa réponse dans des histogrammes.
+
+Les mesures sont propres à chaque processus : avec plusieurs workers
+(serve.py), /metrics décrit le worker qui a reçu la requête.
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import flask
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Bornes des histogrammes de latence (en s) et de taille de réponse (en octets)
+BORNES_LATENCE = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BORNES_TAILLE = (1e3, 1e4, 1e5, 1e6, 1e7)
+
+# Route de Dash appelée par le navigateur pour chaque callback
+ROUTE_CALLBACKS = '_dash-update-component'
+
+
+def _memoire():
+    """
+    Retourne la mémoire résidente du processus
+
+    Returns:
+        _memoire() : int (octets), ou None hors Linux
+    """
+    try:
+        with open('/proc/self/statm') as fichier:
+            return int(fichier.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _nb_lignes(valeur):
+    """
+    Retourne le nombre de lignes d'une entrée ou d'une sortie d'étape
+
+    Args:
+        valeur : pd.DataFrame, pd.Series, dict contenant maindf, ou autre
+
+    Returns:
+        _nb_lignes(valeur) : int, ou None si la valeur n'a pas de lignes
+    """
+    if isinstance(valeur, (pd.DataFrame, pd.Series)):
+        return len(valeur)
+    if isinstance(valeur, dict) and isinstance(valeur.get('maindf'), pd.DataFrame):
+        return len(valeur['maindf'])
+    return None
+
+
+class Histogram:
+    """
+    Histogramme cumulatif au sens de Prometheus (compte des valeurs <= chaque borne)
+    """
+
+    def __init__(self, bornes):
+        self.bornes = bornes
+        self.comptes = [0] * len(bornes)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, valeur):
+        """
+        Ajoute une valeur à l'histogramme
+
+        Args:
+            valeur : valeur observée
+        """
+        for i, borne in enumerate(self.bornes):
+            if valeur <= borne:
+                self.comptes[i] += 1
+        self.count += 1
+        self.sum += valeur
+
+
+class Metrics:
+    """
+    Registre des mesures d'un processus
+    """
+
+    def __init__(self):
+        self._verrou = threading.Lock()
+        # nom de l'étape -> dernière exécution et cumul
+        self._etapes = {}
+        # nom du callback -> (histogramme des latences, histogramme des tailles)
+        self._callbacks = {}
+        # nom -> (aide, type, fonction retournant la valeur)
+        self._jauges = {}
+
+    @contextmanager
+    def stage(self, nom, rows_in=None):
+        """
+        Mesure une étape, dans un bloc with
+
+        Le dict retourné par le with peut recevoir le nombre de lignes
+        produites (clé rows_out).
+
+        Args:
+            nom : nom de l'étape
+            rows_in : nombre de lignes en entrée
+        """
+        etape = {'rows_in': rows_in, 'rows_out': None}
+        memoire = _memoire()
+        debut = time.perf_counter()
+        try:
+            yield etape
+        finally:
+            duree = time.perf_counter() - debut
+            apres = _memoire()
+            variation = apres - memoire if memoire is not None and apres is not None else None
+            with self._verrou:
+                cumul = self._etapes.get(nom, {'runs': 0, 'seconds_total': 0.0})
+                self._etapes[nom] = {
+                    'seconds': duree,
+                    'rows_in': etape['rows_in'],
+                    'rows_out': etape['rows_out'],
+                    # Variation de toute la mémoire du processus : elle inclut
+                    # celle des étapes exécutées en même temps dans d'autres threads
+                    'memory_delta_bytes': variation,
+                    'runs': cumul['runs'] + 1,
+                    'seconds_total': cumul['seconds_total'] + duree,
+                }
+
+    def observe_callback(self, nom, secondes, octets):
+        """
+        Enregistre un appel de callback
+
+        Args:
+            nom : nom du callback
+            secondes : latence
+            octets : taille de la réponse
+        """
+        with self._verrou:
+            if nom not in self._callbacks:
+                self._callbacks[nom] = (Histogram(BORNES_LATENCE), Histogram(BORNES_TAILLE))
+            latence, taille = self._callbacks[nom]
+            latence.observe(secondes)
+            taille.observe(octets)
+
+    def register_gauge(self, nom, aide, fonction, type_metrique='gauge'):
+        """
+        Ajoute une valeur lue au moment de chaque export (taille d'un cache...)
+
+        Args:
+            nom : nom Prometheus de la mesure
+            aide : description
+            fonction : fonction sans argument retournant la valeur
+            type_metrique : 'gauge' ou 'counter'
+        """
+        self._jauges[nom] = (aide, type_metrique, fonction)
+
+    def stages(self):
+        """
+        Retourne les mesures des étapes
+
+        Returns:
+            stages() : dict nom -> dict (seconds, rows_in, rows_out,
+            memory_delta_bytes, runs, seconds_total)
+        """
+        with self._verrou:
+            return {nom: dict(etape) for nom, etape in self._etapes.items()}
+
+    def log_stages(self):
+        """
+        Écrit les mesures des étapes dans le journal, en JSON
+        """
+        logger.info('Étapes : %s', json.dumps(self.stages(), sort_keys=True))
+
+    def render(self):
+        """
+        Retourne toutes les mesures au format texte de Prometheus
+
+        Returns:
+            render() : str
+        """
+        lignes = []
+
+        def entete(nom, aide, type_metrique):
+            lignes.append('# HELP %s %s' % (nom, aide))
+            lignes.append('# TYPE %s %s' % (nom, type_metrique))
+
+        etapes = self.stages()
+        champs = [
+            ('dashboard_stage_seconds', 'seconds', 'gauge',
+             'Durée de la dernière exécution de l\'étape'),
+            ('dashboard_stage_rows_in', 'rows_in', 'gauge',
+             'Lignes en entrée de la dernière exécution'),
+            ('dashboard_stage_rows_out', 'rows_out', 'gauge',
+             'Lignes en sortie de la dernière exécution'),
+            ('dashboard_stage_memory_delta_bytes', 'memory_delta_bytes', 'gauge',
+             'Variation de la mémoire résidente pendant la dernière exécution'),
+            ('dashboard_stage_runs_total', 'runs', 'counter',
+             'Nombre d\'exécutions de l\'étape'),
+            ('dashboard_stage_seconds_total', 'seconds_total', 'counter',
+             'Durée cumulée des exécutions de l\'étape'),
+        ]
+        for nom, cle, type_metrique, aide in champs:
+            entete(nom, aide, type_metrique)
+            for etape, valeurs in sorted(etapes.items()):
+                if valeurs[cle] is not None:
+                    lignes.append('%s{stage="%s"} %s' % (nom, etape, _nombre(valeurs[cle])))
+
+        with self._verrou:
+            callbacks = {
+                nom: [(h.bornes, list(h.comptes), h.count, h.sum) for h in histogrammes]
+                for nom, histogrammes in self._callbacks.items()
+            }
+        for i, (nom, aide) in enumerate([
+            ('dashboard_callback_latency_seconds', 'Latence des callbacks'),
+            ('dashboard_callback_response_bytes', 'Taille des réponses des callbacks'),
+        ]):
+            entete(nom, aide, 'histogram')
+            for callback, histogrammes in sorted(callbacks.items()):
+                bornes, comptes, count, somme = histogrammes[i]
+                for borne, compte in zip(bornes, comptes):
+                    lignes.append('%s_bucket{callback="%s",le="%s"} %d'
+                                  % (nom, callback, _nombre(borne), compte))
+                lignes.append('%s_bucket{callback="%s",le="+Inf"} %d' % (nom, callback, count))
+                lignes.append('%s_sum{callback="%s"} %s' % (nom, callback, _nombre(somme)))
+                lignes.append('%s_count{callback="%s"} %d' % (nom, callback, count))
+
+        for nom, (aide, type_metrique, fonction) in sorted(self._jauges.items()):
+            entete(nom, aide, type_metrique)
+            lignes.append('%s %s' % (nom, _nombre(fonction())))
+        return '\n'.join(lignes) + '\n'
+
+
+def _nombre(valeur):
+    """
+    Écrit un nombre comme l'attend Prometheus (1e3 -> 1000, 0.25 -> 0.25)
+
+    Args:
+        valeur : int ou float
+
+    Returns:
+        _nombre(valeur) : str
+    """
+    return repr(float(valeur)) if not float(valeur).is_integer() else str(int(valeur))
+
+
+# Registre des mesures de ce processus
+metrics = Metrics()
+
+
+def timed_stage(nom):
+    """
+    Décorateur mesurant chaque appel d'une fonction comme une étape
+
+    Les nombres de lignes sont ceux du premier argument et du résultat,
+    lorsque ce sont des dataframes.
+
+    Args:
+        nom : nom de l'étape
+
+    Returns:
+        timed_stage(nom) : décorateur
+    """
+    def decorateur(fonction):
+        @functools.wraps(fonction)
+        def enveloppe(*args, **kwargs):
+            with metrics.stage(nom, rows_in=_nb_lignes(args[0]) if args else None) as etape:
+                resultat = fonction(*args, **kwargs)
+                etape['rows_out'] = _nb_lignes(resultat)
+            return resultat
+        return enveloppe
+    return decorateur
+
+
+def instrument_dash(app, registre=None):
+    """
+    Mesure les callbacks d'une application Dash et ajoute la route /metrics
+    à son serveur Flask
+
+    La latence est mesurée autour de toute la requête du callback
+    (sérialisation de la réponse comprise).
+
+    Args:
+        app : dash.Dash
+        registre : Metrics (metrics par défaut)
+    """
+    registre = registre or metrics
+    server = app.server
+
+    def nom_callback():
+        # Le corps de la requête indique les sorties du callback appelé
+        sortie = (flask.request.get_json(silent=True) or {}).get('output', '')
+        callback = app.callback_map.get(sortie, {}).get('callback')
+        return getattr(callback, '__name__', sortie)
+
+    @server.before_request
+    def debut_requete():
+        flask.g.debut_requete = time.perf_counter()
+
+    @server.after_request
+    def fin_requete(reponse):
+        debut = getattr(flask.g, 'debut_requete', None)
+        if debut is not None and flask.request.path.endswith(ROUTE_CALLBACKS):
+            registre.observe_callback(
+                nom_callback(), time.perf_counter() - debut, reponse.calculate_content_length() or 0
+            )
+        return reponse
+
+    @server.route('/metrics')
+    def exporter_metriques():
+        return flask.Response(registre.render(), mimetype='text/plain; version=0.0.4')
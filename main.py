@@ -9,135 +9,163 @@ Auteurs : Henriques Hugo & Leroux Gabriel
 Date : 02/01/2022
 """
 ### Imports ###
-import pandas as pd
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlencode
 
-import plotly.express as px
-import plotly.graph_objs as go
+import flask
+import numpy as np
 
 import dash
 from dash import dcc
 from dash import html
-from dash.dependencies import Input, Output
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 
+from aggregates import FilterIndex, build_cube, roll_up
+from density import VUE_DEFAUT, density, parse_viewport
+from export import add_export_routes
+from figures import (
+    GEO_MARKERS, FigureRegistry, bar_figure, colors, geo_data, geo_layout,
+    mean_mass_figure, pie_figure
+)
+from http_cache import cache_responses, preload
+from ingest import apply_batches, data_version
+from instrumentation import instrument_dash, metrics, timed_stage
+from snapshot import load_frames
+from spatial import ImpactIndex, add_query_routes, to_records
+from warmup import callback_request, warm_callbacks
+from waves import FENETRE_DEFAUT, DiscoveryMatrix, analyse, waves_figure
+
+logger = logging.getLogger(__name__)
+
+# DASHBOARD_METRICS_LOG=1 : la durée, les lignes et la mémoire de chaque étape
+# du chargement des données sont écrites en JSON dans le journal au démarrage
+JOURNAL_METRIQUES = os.environ.get('DASHBOARD_METRICS_LOG') == '1'
+if JOURNAL_METRIQUES:
+    logging.basicConfig(level=logging.INFO)
+
 ###========================== TRAITEMENT DES DONNEES ===================================###
 
-# On transforme les datasets originales téléchargés sur kaggle.com en des dataframes
-# Notre dataframe de base :
-meteorites=pd.read_csv('meteorite-landings.csv')
-# lien : https://www.kaggle.com/nasa/meteorite-landings
-# Pour ajouter les pays à notre dataframe :
-cities=pd.read_csv('worldcitiespop.csv')
-# lien : https://www.kaggle.com/max-mind/world-cities-database?select=worldcitiespop.csv
-# Pour ajouter les continents :
-continents=pd.read_csv('countryContinent.csv',encoding='utf8')
-# lien : https://www.kaggle.com/statchaitya/country-to-continent
-
-# 1. Traitons les météorites
-# On supprime les colonnes qui ne nous serviront pas
-meteorites = meteorites.drop(['id'],1)
-meteorites = meteorites.drop(['nametype'],1)
-# On supprime les valeurs d'années aberrantes
-meteorites = meteorites[meteorites['year']<2021]
-# Ainsi que les années précédent 1800 car trop peu de données avant cette date
-meteorites = meteorites[meteorites['year']>1800]
-# On supprime les météorites observées non retrouvées
-meteorites = meteorites[meteorites['fall']=='Found']
-meteorites = meteorites.drop(['fall'],1)
-
-# 2. Traitons les villes
-# On supprime les colonnes qui ne nous serviront pas
-cities = cities.drop(['Population'],1)
-cities = cities.drop(['Region'],1)
-cities = cities.drop(['City'],1) # Parce qu'on ne s'interesse seulement à AccentCity
-# Ici ce qui nous interresse ce sont les coordonnées des meteorites, pas celles des villes
-cities = cities.drop(['Latitude'],1)
-cities = cities.drop(['Longitude'],1)
-
-# 3. Traitons les continents
-# On supprime les colonnes qui ne nous serviront pas
-# Ici ce que l'on veux récupérer ce sont les continents
-continents = continents.drop(['code_3'],1)
-continents = continents.drop(['country_code'],1)
-continents = continents.drop(['iso_3166_2'],1)
-continents = continents.drop(['sub_region'],1)
-continents = continents.drop(['region_code'],1)
-continents = continents.drop(['sub_region_code'],1)
-
-###################################
-##### 4. Merge des dataframes #####
-###################################
-
-# On renomme la colonne name afin de merger
-rename = {'name': 'AccentCity'}
-meteorites.rename(columns=rename, inplace=True)
-
-# On élimine les valeurs dupliquées qui ne sont pas bonnes pour un merge
-cities = cities.drop_duplicates(subset='AccentCity')
-
-# On peut enfin merger notre df de météorites et celle des villes en fonction de City
-newDf=pd.merge(meteorites,cities, on=['AccentCity'],how='left')
-
-# On supprime les lignes ne possédant pas de Geolocalisation
-newDf = newDf[newDf['GeoLocation'].notna()]
-
-# On renomme la colonne name pour un soucis de compréhension après avoir mergé les bonnes colonnes
-# ainsi que la colonne Country en country code afin d'avoir par la suite le country et le continent
-rename = {'AccentCity': 'City'}
-newDf.rename(columns={'AccentCity': 'City', 'Country': 'code_2'}, inplace=True)
-
-# On met toute la colonne code de newDf en majuscule comme dans continents afin de merger
-newDf['code_2'] = newDf['code_2'].astype(str).str.upper()
-
-# On peut enfin merger notre df principal avec celle des continents en fonction de code_2
-maindf=pd.merge(newDf,continents, on=['code_2'],how='left')
-
-# On remplace les Nans qui sont apparus
-maindf['code_2'].fillna('XX', inplace=True)
-maindf['country'].fillna('Unknown', inplace=True)
-maindf['continent'].fillna('Unknown', inplace=True)
-
-####################################################
-##### 5. Création de données dataframes utiles #####
-####################################################
-
-# On créé les différentes sous-dataframe avec la classification des types de météorite :
-# source : https://en.wikipedia.org/wiki/Meteorite_classification
-# On créé un ensemble de données pour chaque type de météorite
-
-# stony materials
-ToutesLesL =    maindf[maindf['recclass'].str.contains('^L.*')]
-ToutesLesH =    maindf[maindf['recclass'].str.contains('^H.*')]
-ToutesLesE =    maindf[maindf['recclass'].str.contains('^E.*')]
-ToutesLesC =    maindf[maindf['recclass'].str.contains('^C.*')]
-Ureilite =      maindf[maindf['recclass'].str.contains('Ureilite')]
-Diogenite =     maindf[maindf['recclass'].str.contains('^Diogenite.*')]
-Eucrite =       maindf[maindf['recclass'].str.contains('^Eucrite.*')]
-Angrite =       maindf[maindf['recclass'].str.contains('^Angrite.*')]
-Aubrite =       maindf[maindf['recclass'].str.contains('^Aubrite.*')]
-Howardite =     maindf[maindf['recclass'].str.contains('^Howardite.*')]
-Stone =         maindf[maindf['recclass'].str.contains('^Stone.*')]
-Martian =       maindf[maindf['recclass'].str.contains('^Martian.*')]
-
-stony = pd.concat(
-    [ToutesLesL,ToutesLesH, ToutesLesE, ToutesLesC,
-    Ureilite, Diogenite, Angrite, Aubrite, Howardite, Stone, Martian]
-)
+# Le traitement des fichiers .csv (nettoyage, merges, sous-dataframes) est fait
+# dans pipeline.py ; on charge ici son résultat depuis l'instantané de snapshot.py,
+# reconstruit uniquement lorsqu'un des fichiers sources a changé
+frames = load_frames()
+# On y ajoute les lots de nouvelles météorites déjà déposés (ingest.py)
+frames, lots_appliques, _ = apply_batches(frames)
+lots_appliques = set(lots_appliques)
+
+# Index de filtrage (aggregates.py) : nom de l'index -> dataframe indexée
+INDEX_FILTRAGE = {'all': 'maindf', 'stony': 'stony', 'iron': 'iron', 'stony-iron': 'stony_iron'}
 
-# iron materials
-iron = maindf[maindf['recclass'].str.contains('^Iron.*')]
+@timed_stage('prepare_data')
+def prepare_data(frames, version):
+    """
+    Prépare tout ce qu'utilisent les figures à partir des dataframes
 
-# stony-iron materials
-Mesosiderite = maindf[maindf['recclass'].str.contains('^Mesosiderite.*')]
-Pallasite = maindf[maindf['recclass'].str.contains('^Pallasite.*')]
+    Args:
+        frames : dict de snapshot.load_frames
+        version : version des données (ingest.data_version)
 
-stony_iron = pd.concat([Pallasite,Mesosiderite])
+    Returns:
+        prepare_data(frames, version) : dict contenant les dataframes (maindf, stony,
+        iron, stony_iron, mass_moy, cube, cube_min...), les index de filtrage
+        (filter_indexes), les météorites de chaque carte (geo_frames), l'index
+        spatial des lieux d'impact (impact_index), la matrice des découvertes
+        par continent et par année (discovery), les bornes du filtre
+        d'années (years) et la version (version)
+    """
+    donnees = dict(frames)
+    # Version des données, qui identifie aussi les réponses en cache (http_cache.py)
+    donnees['version'] = version
+    # Index de filtrage par intervalle d'années et seuil de masse (aggregates.py),
+    # construits une seule fois : les callbacks n'ont plus à reparcourir maindf
+    donnees['filter_indexes'] = {
+        cle: FilterIndex(frames[nom]) for cle, nom in INDEX_FILTRAGE.items()
+    }
+    # Index spatial des lieux d'impact, pour les recherches autour d'un lieu (spatial.py)
+    donnees['impact_index'] = ImpactIndex(frames['maindf'])
+    # Découvertes par continent et par année, pour l'analyse des vagues (waves.py)
+    donnees['discovery'] = DiscoveryMatrix.from_cube(frames['cube'])
+    # Météorites de chaque catégorie de la carte
+    donnees['geo_frames'] = {
+        'stony': frames['stony'], 'iron': frames['iron'], 'stony-iron': frames['stony_iron']
+    }
+    # Bornes du filtre d'années, qui sont aussi sa valeur initiale
+    donnees['years'] = [int(frames['maindf']['year'].min()), int(frames['maindf']['year'].max())]
+    return donnees
 
-# Moyenne de la masse totale pour chaque année
-mass_moy = maindf[['year','mass']].groupby('year').mean()
+@timed_stage('update_data')
+def update_data(donnees, frames, insertions, version):
+    """
+    Complète les données préparées par prepare_data avec un lot de nouvelles
+    météorites, sans reconstruire les index : chacun ne reçoit que les
+    nouvelles lignes (voir ingest.py)
 
-# Création d'une sous dataframe sans les énormes météorites (>1T)
-withoutBiggest = maindf[maindf['mass']<1000000]
+    Args:
+        donnees : résultat de prepare_data (ou d'un appel précédent)
+        frames : dataframes complétées par ingest.apply_batches
+        insertions : dict nom -> ingest.Insertion, ou None si le lot
+        n'a ajouté aucune ligne
+        version : version des données (ingest.data_version)
+
+    Returns:
+        update_data(donnees, frames, insertions, version) : dict au format de prepare_data
+    """
+    resultat = dict(frames)
+    resultat['version'] = version
+    if insertions is None:
+        return resultat
+    resultat['filter_indexes'] = {
+        cle: donnees['filter_indexes'][cle].insert(
+            insertions[nom].lignes, insertions[nom].positions, insertions[nom].renumber
+        )
+        for cle, nom in INDEX_FILTRAGE.items()
+    }
+    ajout = insertions['maindf']
+    resultat['impact_index'] = donnees['impact_index'].insert(
+        frames['maindf'], ajout.lignes, ajout.positions, ajout.renumber
+    )
+    resultat['discovery'] = donnees['discovery'].add_cube(build_cube(ajout.lignes))
+    resultat['geo_frames'] = {
+        'stony': frames['stony'], 'iron': frames['iron'], 'stony-iron': frames['stony_iron']
+    }
+    resultat['years'] = [
+        min(donnees['years'][0], int(ajout.lignes['year'].min())),
+        max(donnees['years'][1], int(ajout.lignes['year'].max())),
+    ]
+    return resultat
+
+# Données courantes du dashboard. À l'arrivée d'un lot de nouvelles météorites,
+# elles sont remplacées d'un bloc, par une seule affectation (refresh_data) :
+# chaque fonction ne lit `donnees` qu'une fois et travaille donc toujours
+# sur une version cohérente des données
+donnees = prepare_data(frames, data_version(lots_appliques))
+
+if JOURNAL_METRIQUES:
+    metrics.log_stages()
+
+# Le filtre de masse est réglé en puissance de 10 de grammes,
+# la dernière graduation correspondant à l'absence de limite
+SEUIL_SANS_LIMITE = 8
+SEUIL_DEFAUT = 6 # 1 tonne
+
+def mass_threshold(mass_value):
+    """
+    Convertit la valeur du filtre de masse en seuil (en g)
+
+    Args:
+        mass_value : puissance de 10 choisie sur le Slider
+
+    Returns:
+        mass_threshold(mass_value) : float, ou None pour aucune limite
+    """
+    if mass_value is None or mass_value >= SEUIL_SANS_LIMITE:
+        return None
+    return 10 ** mass_value
 
 ###========================== TRAITEMENT DES DONNEES ===================================###
 
@@ -147,133 +175,133 @@ withoutBiggest = maindf[maindf['mass']<1000000]
 ##### 1. Création des figures du dashboard #####
 ################################################
 
+# Les figures ne sont construites que lorsqu'on les demande (figures.get),
+# puis gardées en cache : le démarrage ne trace plus rien
+figures = FigureRegistry()
+# Compteurs du cache de figures, exportés sur /metrics
+metrics.register_gauge(
+    'dashboard_figure_cache_hits_total', 'Figures servies depuis le cache',
+    lambda: figures.stats()['hits'], 'counter'
+)
+metrics.register_gauge(
+    'dashboard_figure_cache_misses_total', 'Figures construites',
+    lambda: figures.stats()['misses'], 'counter'
+)
+metrics.register_gauge(
+    'dashboard_figure_cache_evictions_total', 'Figures sorties du cache faute de place',
+    lambda: figures.stats()['evictions'], 'counter'
+)
+metrics.register_gauge(
+    'dashboard_figure_cache_size', 'Figures en cache', lambda: figures.stats()['size']
+)
+
 # On créé une courbe, px.line permet d'avoir des courbes, ici on veut
 # la masse moyenne des météorites retrouvées en fonction de l'année de 1800 à 2013
-massMoy = px.line(mass_moy,x= mass_moy.index, y= "mass")
+@figures.register('massMoy')
+def build_mass_moy():
+    return mean_mass_figure(donnees['mass_moy'])
+
+def histogram_totals(years_value, threshold):
+    """
+    Retourne les masses totales par année et par continent d'un histogramme
+
+    Sans filtre d'années, les cubes d'agrégats précalculés suffisent ;
+    sinon on interroge l'index de filtrage.
+
+    Args:
+        years_value : [première année, dernière année] ou None
+        threshold : masse maximale exclue (en g) ou None
+
+    Returns:
+        histogram_totals(years_value, threshold) : pd.DataFrame (year, continent, mass)
+    """
+    d = donnees
+    toutes_annees = years_value is None or (
+        years_value[0] <= d['years'][0] and years_value[1] >= d['years'][1]
+    )
+    if toutes_annees and threshold is None:
+        return roll_up(d['cube'], ['year', 'continent'])
+    if toutes_annees and threshold == 10 ** SEUIL_DEFAUT:
+        return roll_up(d['cube_min'], ['year', 'continent'])
+    return d['filter_indexes']['all'].totals(years_value, threshold)
 
 # On créé un histogramm afin d'observer en détails les années où
 # il y a des augmentation de masse de météorites retrouvés
-barChart = px.bar(maindf, x="year", y="mass", color='continent')
+@figures.register('barChart')
+def build_bar_chart(years=None):
+    return bar_figure(histogram_totals(years, None))
 
 # On créé le même histogramm mais cette fois ci sans les grosses météorites
-barChartMin = px.bar(withoutBiggest, x="year", y="mass", color='continent')
+@figures.register('barChartMin')
+def build_bar_chart_min(years=None, mass=SEUIL_DEFAUT):
+    return bar_figure(histogram_totals(years, mass_threshold(mass)))
 
 # On créé 3 diagramme qui permettront de montrer la composition des météorites
 # en fonction des trois catégories : rocheuse, ferreuse et mixte
-stonyPie = px.pie(stony, names='recclass')
-stonyPie.update_traces(textinfo='percent+label',textposition='inside')
+@figures.register('stonyPie')
+def build_stony_pie():
+    return pie_figure(donnees['stony'])
 
-ironPie = px.pie(iron, names='recclass')
-ironPie.update_traces(textinfo='percent+label',textposition='inside')
+@figures.register('ironPie')
+def build_iron_pie():
+    return pie_figure(donnees['iron'])
 
-stonyIronPie = px.pie(stony_iron, names='recclass')
-stonyIronPie.update_traces(textinfo='percent+label',textposition='inside')
+@figures.register('stonyIronPie')
+def build_stony_iron_pie():
+    return pie_figure(donnees['stony_iron'])
 
 # On créé 3 Map qui permettront de placer les météorites
 # selon 3 catégories : rocheuse , ferreuse et mixte
-stonyGeo = go.Figure(
-    data=go.Scattergeo(
-        lat = stony['reclat'],
-        lon = stony['reclong'],
-        text =
-        "Ville : "+ stony['City'] + "[" + stony['code_2'] +
-        "]." + '\n' + " Année de crash : " + stony['year'].astype(str) +
-        '\n' + "Masse : " + stony['mass'].astype(str) + "g.",
-        marker = dict(
-            size = 8,
-            opacity = 0.8,
-            reversescale = True,
-            autocolorscale = True,
-            symbol =  'octagon',
-            line = dict(
-                width=1,
-                color='brown'
-            ),
-        )
-    )
-)
-ironGeo = go.Figure(
-    data=go.Scattergeo(
-        lat = iron['reclat'],
-        lon = iron['reclong'],
-        text =
-        "Ville : "+ iron['City'] + "[" + iron['code_2'] +
-        "]." + '\n' + " Année de crash : " + iron['year'].astype(str) +
-        '\n' + "Masse : " + iron['mass'].astype(str) + "g.",
-        marker = dict(
-            size = 8,
-            opacity = 0.8,
-            reversescale = True,
-            autocolorscale = True,
-            symbol = 'triangle-down',
-            line = dict(
-                width=1,
-                color='goldenrod'
-            ),
-        )
-    )
-)
-stonyIronGeo = go.Figure(
-    data=go.Scattergeo(
-        lat = stony_iron['reclat'],
-        lon = stony_iron['reclong'],
-        text =
-        "Ville : "+ stony_iron['City'] + "[" + stony_iron['code_2'] +
-        "]." +'\n' + " Année de crash : " + stony_iron['year'].astype(str) +
-        '\n' + "Masse : " + stony_iron['mass'].astype(str) + "g.",
-        marker = dict(
-            size = 8,
-            opacity = 0.8,
-            reversescale = True,
-            autocolorscale = True,
-            symbol = 'star-diamond-dot',
-            line = dict(
-                width=1,
-                color='violet'
-            ),
-        )
-    )
-)
-
-######################################################
-##### 2. Création de aspects visuels des figures #####
-######################################################
+# Les météorites visibles sont regroupées sur une grille (density.py)
+# lorsqu'elles sont trop nombreuses pour être envoyées une par une.
+# Seules les données sont préparées ici : la figure est construite
+# dans le navigateur (assets/map.js)
+@figures.register('geoData')
+def build_geo_data(input_value, years=None, mass=SEUIL_SANS_LIMITE, viewport=None):
+    d = donnees
+    rows = d['filter_indexes'][input_value].rows(years, mass_threshold(mass))
+    df = d['geo_frames'][input_value].iloc[rows]
+    cells, points = density(df, viewport or VUE_DEFAUT)
+    return geo_data(points, cells)
 
-# On créé notre palette de couleur qu'on utilisera pour l'esthétique de notre dashboard
-colors = {
-    'background': '#111111',
-    'text': '#27BBE8',
-    'legend': '#BD99D2',
-    'title': '#864BFD'
+# Titre de la carte pour chaque catégorie
+GEO_TITLES = {
+    'stony': '''Carte des lieux d'impacte de météorites de type rocheuse''',
+    'iron': '''Carte des lieux d'impacte de météorites de type ferreuse''',
+    'stony-iron': '''Carte des lieux d'impacte de météorites de type mixte''',
 }
 
-# Réglages graphiques qu'on reproduit avec toutes les figures
-massMoy.update_layout(
-    plot_bgcolor=colors['background'],paper_bgcolor=colors['background'],font_color=colors['title']
-    )
-barChart.update_layout(
-    plot_bgcolor=colors['background'],paper_bgcolor=colors['background'],font_color=colors['title']
-    )
-barChartMin.update_layout(
-    plot_bgcolor=colors['background'],paper_bgcolor=colors['background'],font_color=colors['title'
-    ])
-stonyPie.update_layout(
-    plot_bgcolor=colors['background'],paper_bgcolor=colors['background'],font_color=colors['title']
-    )
-ironPie.update_layout(
-    plot_bgcolor=colors['background'],paper_bgcolor=colors['background'],font_color=colors['title']
-    )
-stonyIronPie.update_layout(
-    plot_bgcolor=colors['background'],paper_bgcolor=colors['background'],font_color=colors['title']
-    )
-stonyGeo.update_layout(
-    plot_bgcolor=colors['background'],paper_bgcolor=colors['background'],font_color=colors['title']
-    )
-ironGeo.update_layout(
-    plot_bgcolor=colors['background'],paper_bgcolor=colors['background'],font_color=colors['title']
-    )
-stonyIronGeo.update_layout(
-    plot_bgcolor=colors['background'],paper_bgcolor=colors['background'],font_color=colors['title']
+# Nombre de météorites listées sous la carte autour du point cliqué
+NB_VOISINS = 10
+
+# Nom de chaque groupe (classification.py) dans la liste des météorites proches
+NOMS_GROUPES = {'stony': 'Rocheuse', 'iron': 'Ferreuse', 'stony_iron': 'Mixte', 'other': 'Autre'}
+
+def nearby_table(resultats):
+    """
+    Retourne le tableau des météorites proches d'un lieu
+
+    Args:
+        resultats : pd.DataFrame de spatial.ImpactIndex.nearest
+
+    Returns:
+        nearby_table(resultats) : html.Table
+    """
+    entetes = ['Nom', 'Type', 'Classe', 'Masse (g)', 'Année', 'Distance (km)']
+    lignes = [
+        html.Tr([
+            html.Td(m['name']),
+            html.Td(NOMS_GROUPES.get(m['group'], m['group'])),
+            html.Td(m['recclass']),
+            html.Td('' if m['mass'] is None else '%g' % m['mass']),
+            html.Td('' if m['year'] is None else str(m['year'])),
+            html.Td('%.1f' % m['distance_km']),
+        ])
+        for m in to_records(resultats)
+    ]
+    return html.Table(
+        [html.Thead(html.Tr([html.Th(e) for e in entetes])), html.Tbody(lignes)],
+        style={'width': '100%', 'color': colors['text']}
     )
 
 ###=========================== CREATION DU CONTENUE ====================================###
@@ -283,284 +311,823 @@ stonyIronGeo.update_layout(
 # On créé une instance de la classe dash
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.DARKLY])
 
+# Application WSGI (Flask) sous-jacente, servie en production par serve.py
+server = app.server
+
+# Latence et taille de réponse de chaque callback, et route /metrics (Prometheus)
+instrument_dash(app)
+
+# Les réponses JSON de Dash (layout et callbacks) sont gardées compressées,
+# avec un ETag tiré de la version des données (http_cache.py)
+reponses = cache_responses(app, lambda: donnees['version'])
+metrics.register_gauge(
+    'dashboard_response_cache_hits_total', 'Réponses servies depuis le cache',
+    lambda: reponses.stats()['hits'], 'counter'
+)
+metrics.register_gauge(
+    'dashboard_response_cache_misses_total', 'Réponses produites par Dash',
+    lambda: reponses.stats()['misses'], 'counter'
+)
+metrics.register_gauge(
+    'dashboard_response_cache_bytes', 'Taille non compressée des réponses en cache',
+    lambda: reponses.stats()['bytes']
+)
+
+# Recherche des météorites autour d'un lieu : /api/impacts/nearest, radius et bbox
+add_query_routes(server, lambda: donnees['impact_index'])
+
+# Jeux de données exportables : nom -> (dataframe, index de filtrage)
+JEUX_EXPORT = {
+    'maindf': ('maindf', 'all'),
+    'stony': ('stony', 'stony'),
+    'iron': ('iron', 'iron'),
+    'stony_iron': ('stony_iron', 'stony-iron'),
+}
+
+def export_source(jeu):
+    """
+    Retourne la dataframe d'un jeu exportable et son index de filtrage
+
+    Args:
+        jeu : nom du jeu (clé de JEUX_EXPORT)
+
+    Returns:
+        export_source(jeu) : (pd.DataFrame, FilterIndex)
+    """
+    d = donnees
+    frame, index = JEUX_EXPORT[jeu]
+    return d[frame], d['filter_indexes'][index]
+
+# Export des météorites filtrées en .csv ou Parquet : /api/export
+add_export_routes(server, export_source, list(JEUX_EXPORT))
+
 # On créé le titre du dashboard
 app.title = 'Dashbord Météorites'
 
 # La mise en page en dash se déroule grâce app.layout c'est à l'interieur du layout
 # que l'on va insérer le texte et l'odre d'appartion des graphiques
 # Pour pouvoir afficher les figures de notre dashboard l'ordre compte !
-app.layout = html.Div([
-    ### Titre ###
-    html.Br(),
-    html.H1(children=
-        'Dashboard sur les météorites pénétrant l\'atmosphère terrestre',
-        style={'textAlign': 'center', 'color': colors['title']}
-        ),
-    ### Intro + Courbe ###
-    html.Div(
-        children=[
-            html.Br(),
-            html.Div(
-                '''Les météorites ont toujours existées et aujourd'hui encore
-                il en tombe tous les jours sur Terre. On va chercher a développer
-                un raisonnement scientifique en observant les différents affichages
-                de données que nous allons effectuer. L'entièreté des météorites dont
-                nous allons parler ont été retrouvées tout autour de notre planète.''',
-                style={'textAlign': 'justify', 'color': colors['text']}
-            ),
-            html.Br(),
-            html.Div(
-                '''Pour commencer, voici la définition d'une météorite d'après Futura
-                Sciences :"Corps rocheux d'origine extraterrestre qui a survécu à la
-                traversée de l'atmosphère et qu'on retrouve donc sur le sol terrestre."''',
-                style={'textAlign': 'justify', 'color': colors['text']}
-            ),
-            html.Br(),
-            html.H2(children=
-                '''Masse moyenne(en g) des météorites retrouvées de l'année 1800 à 2013''',
-                style={'textAlign': 'center', 'color': colors['title']}
-            ),
-            dcc.Graph(
-                id='graph0',
-                figure=massMoy,
-                style={'textAlign': 'center','width' : '750'}
-            ),
-            html.Div(
-                '''On observe que la moyenne de la masse de météorites retrouvées
-                par an subit de nombreuses variations mais elles ne dur qu'un an.
-                Nous allons donc créer un histogramme afin d'en savoir plus sur
-                les météorites découvertes lors de ces années.''',
-                style={'textAlign': 'justify', 'color': colors['text']}
-            ),
-        ],
-        style={'color':colors['background'], 'display':'inline-block', 'width': '2100'}
-    ),
-    ### Histogrammes ###
-    html.Div(
-        children=[
-            html.Br(),
-            html.H2(children=
-                '''Histogramme représentant les masses totales des météorites
-                retrouvées de l'année 1800 à 2013 dans le monde (en gramme)''',
-                style={'textAlign': 'center', 'color': colors['title']}
-            ),
-            dcc.Graph(
-                id='graph1',
-                figure=barChart,
-                style={'textAlign': 'center'}
-            ),
-            html.Div(
-                ''' On comprend d'après cette histogramme et d'après ses variations
-                irrégulières et conséquentes que d'énormes météorites ont été trouvées
-                certaines années. Elles brisent donc l'uniformité de la moyenne globale,
-                que nous n'afficherons donc pas. Affichons maintenant le même histogramme
-                mais en excluant les météorites de plus d'une tonne.''',
-                style={'textAlign': 'justify', 'color':colors['text']}
-            ),
-            html.Br(),
-            html.H2(children=
-                '''Histogramme représentant les masses totales des météorites retrouvées
-                inférieures à 1 Tonne de l'année 1800 à 2013 dans le monde (en gramme)''',
-                style={'textAlign': 'center', 'color': colors['title']}
-            ),
-            dcc.Graph(
-                id='graph2',
-                figure=barChartMin,
-                style={'textAlign': 'center'}
-            ),
-            html.Div(
-                '''Cet histogramme nous permet de comprendre que le poids des météorites
-                varie énormément. Nous allons donc nous intéresser a chacun des types de
-                météorites ainsi qu'à leur composition.''',
-                style={'textAlign': 'justify', 'color':colors['text']}
-            ),
-            html.Br()
-        ],
-        style={'color':colors['background'], 'display':'inline-block', 'width': '2100'}
-    ),
-    ### Pie ###
-    html.Div(
-        children=[
-            html.Br(),
-            html.Div(
-                '''D'après la classification scientifique de Wikipedia
-                (https://en.wikipedia.org/wiki/Meteorite_classification), il existe trois
-                types de météorites : les météorites ferreuses, les météorites rocheuses,
-                et les météorites mixtes. On les classe selon les éléments qui les constitut.
-                La suite est simple, si ces éléments sont d'origine rocheuses, la météorites
-                sera classée rocheuses. Si ces éléments sont ferreux, la météorites sera
-                ferreuse et si la météorite est composée d'éléments hybrides (ferreux et
-                rocheux), elle sera classée comme mixte. Parmi ces trois types, il existe un
-                tas de cas différents selon les éléments qui constituent la météorite.''',
-                style={'textAlign': 'justify', 'color':colors['text']}
-            ),
-            html.Br(),
-            html.H2(children=
-            '''Diagrammes circulaires de la moyenne des compositions de
-            chaque type de météorites''',
+# Le layout est une fonction, appelée à chaque chargement de la page :
+# ses figures viennent du cache de figures.get
+def layout_figure(nom, **params):
+    """
+    Retourne une figure du layout depuis le registre
+
+    Dash appelle une première fois serve_layout dès app.layout = ..., hors de
+    toute requête, pour valider les identifiants des composants : on ne
+    construit alors aucune figure.
+
+    Args:
+        nom : nom de la figure
+        params : paramètres de la figure
+
+    Returns:
+        layout_figure(nom, **params) : go.Figure, ou None hors requête
+    """
+    if not flask.has_request_context():
+        return None
+    return figures.get(nom, **params)
+
+# Seule la première section (courbe de la masse moyenne) est envoyée avec la page.
+# Les figures des suivantes sont demandées par leurs callbacks la première fois
+# que la section approche de la partie visible de la page (assets/sections.js)
+def section_trigger(nom):
+    """
+    Retourne le bouton caché d'une section chargée à la demande, sur lequel
+    assets/sections.js clique lorsque la section devient visible
+
+    Args:
+        nom : nom de la section
+
+    Returns:
+        section_trigger(nom) : html.Button (id section-<nom>)
+    """
+    return html.Button(
+        id='section-' + nom, className='declencheur-section', style={'display': 'none'}
+    )
+
+def default_regions(regions):
+    """
+    Retourne les continents cochés au chargement de la page
+
+    Args:
+        regions : continents des données
+
+    Returns:
+        default_regions(regions) : liste des continents, sans Unknown
+    """
+    return [r for r in regions if r != 'Unknown']
+
+def serve_layout():
+    """
+    Retourne la mise en page du dashboard
+
+    Returns:
+        serve_layout() : html.Div
+    """
+    # Bornes du filtre d'années et continents des données courantes
+    annees = donnees['years']
+    regions = donnees['discovery'].regions
+    return html.Div([
+        ### Titre ###
+        html.Br(),
+        html.H1(children=
+            'Dashboard sur les météorites pénétrant l\'atmosphère terrestre',
             style={'textAlign': 'center', 'color': colors['title']}
             ),
-            html.Div(
-                children=[
-                    html.H3(children=
-                        '''-----------------Rocheuse------------------|''',
-                        style={'textAlign': 'center', 'color': colors['title']}
-                    ),
-                    dcc.Graph(
-                        id='graph4',
-                        figure=stonyPie
-                    )
-                ],
-                className="pie1",
-                style={
-                    'display':'inline-block',
-                    'position' : 'relative',
-                    'height' : '800', 'width' : '700'
-                }
-            ),
-            html.Div(
-                children=[
-                    html.H3(children=
-                        '''----------------Ferreuse-----------------''',
-                        style={'textAlign': 'center', 'color': colors['title']}
-                    ),
-                    dcc.Graph(
-                        id='graph5',
-                        figure=ironPie,
-                        style={'textAlign': 'center'}
-                    )
-                ],
-                className="pie2",
-                style={
-                    'display':'inline-block',
-                    'position' : 'relative',
-                    'height' : '800', 'width' : '700'
-                }
-            ),
-            html.Div(
-                children=[
-                    html.H3(children=
-                        '''|-----------------Mixte-------------------''',
-                        style={'textAlign': 'center', 'color': colors['title']}
-                    ),
-                    dcc.Graph(
-                        id='graph6',
-                        figure=stonyIronPie
-                    ),
-                ],className="pie3",
-                style={
-                    'display':'inline-block',
-                    'position' : 'relative',
-                    'height' : '800', 'width' : '700'
-                }
-            ),
-        ],
-        style={
-                'position' : 'relative',
-                'display':'inline',
-                'height' : 'auto',
-                'width' : 'auto',
-                'background-color' : colors['background']
-        }
-    ),
-    ### Map
-    html.Div(
-        children=[
-            html.H2(children=
-                '''Carte des lieux d'impacte de météorites de type ...''',
-                id="title-geo",
+        ### Intro + Courbe ###
+        html.Div(
+            children=[
+                html.Br(),
+                html.Div(
+                    '''Les météorites ont toujours existées et aujourd'hui encore
+                    il en tombe tous les jours sur Terre. On va chercher a développer
+                    un raisonnement scientifique en observant les différents affichages
+                    de données que nous allons effectuer. L'entièreté des météorites dont
+                    nous allons parler ont été retrouvées tout autour de notre planète.''',
+                    style={'textAlign': 'justify', 'color': colors['text']}
+                ),
+                html.Br(),
+                html.Div(
+                    '''Pour commencer, voici la définition d'une météorite d'après Futura
+                    Sciences :"Corps rocheux d'origine extraterrestre qui a survécu à la
+                    traversée de l'atmosphère et qu'on retrouve donc sur le sol terrestre."''',
+                    style={'textAlign': 'justify', 'color': colors['text']}
+                ),
+                html.Br(),
+                html.H2(children=
+                    '''Masse moyenne(en g) des météorites retrouvées de l'année 1800 à 2013''',
+                    style={'textAlign': 'center', 'color': colors['title']}
+                ),
+                dcc.Graph(
+                    id='graph0',
+                    figure=layout_figure('massMoy'),
+                    style={'textAlign': 'center','width' : '750'}
+                ),
+                html.Div(
+                    '''On observe que la moyenne de la masse de météorites retrouvées
+                    par an subit de nombreuses variations mais elles ne dur qu'un an.
+                    Nous allons donc créer un histogramme afin d'en savoir plus sur
+                    les météorites découvertes lors de ces années.''',
+                    style={'textAlign': 'justify', 'color': colors['text']}
+                ),
+            ],
+            style={'color':colors['background'], 'display':'inline-block', 'width': '2100'}
+        ),
+        ### Histogrammes ###
+        html.Div(
+            children=[
+                section_trigger('histogrammes'),
+                html.Br(),
+                ### Filtres ###
+                html.Div(
+                    '''Les deux filtres ci-dessous permettent de choisir les années
+                    et la masse maximale des météorites affichées dans les histogrammes
+                    et sur la carte.''',
+                    style={'textAlign': 'justify', 'color': colors['text']}
+                ),
+                html.Label(
+                    'Années : ',
+                    style={'color': colors['title']}
+                ),
+                dcc.RangeSlider(
+                    id='years-slider',
+                    min=annees[0],
+                    max=annees[1],
+                    step=1,
+                    value=annees,
+                    marks={annee: str(annee) for annee in range(1820, annees[1] + 1, 20)},
+                    tooltip={'placement': 'bottom'}
+                ),
+                html.Label(
+                    'Masse maximale : ',
+                    style={'color': colors['title']}
+                ),
+                dcc.Slider(
+                    id='mass-slider',
+                    min=0,
+                    max=SEUIL_SANS_LIMITE,
+                    step=0.5,
+                    value=SEUIL_DEFAUT,
+                    marks={
+                        0: '1 g', 1: '10 g', 2: '100 g', 3: '1 kg', 4: '10 kg',
+                        5: '100 kg', 6: '1 t', 7: '10 t', SEUIL_SANS_LIMITE: 'sans limite'
+                    }
+                ),
+                html.Br(),
+                html.H2(children=
+                    '''Histogramme représentant les masses totales des météorites
+                    retrouvées de l'année 1800 à 2013 dans le monde (en gramme)''',
+                    style={'textAlign': 'center', 'color': colors['title']}
+                ),
+                dcc.Graph(
+                    id='graph1',
+                    style={'textAlign': 'center'}
+                ),
+                html.Div(
+                    ''' On comprend d'après cette histogramme et d'après ses variations
+                    irrégulières et conséquentes que d'énormes météorites ont été trouvées
+                    certaines années. Elles brisent donc l'uniformité de la moyenne globale,
+                    que nous n'afficherons donc pas. Affichons maintenant le même histogramme
+                    mais en excluant les météorites de plus d'une tonne.''',
+                    style={'textAlign': 'justify', 'color':colors['text']}
+                ),
+                html.Br(),
+                html.H2(children=
+                    '''Histogramme représentant les masses totales des météorites retrouvées
+                    inférieures à la masse maximale choisie (1 Tonne par défaut)
+                    de l'année 1800 à 2013 dans le monde (en gramme)''',
+                    style={'textAlign': 'center', 'color': colors['title']}
+                ),
+                dcc.Graph(
+                    id='graph2',
+                    style={'textAlign': 'center'}
+                ),
+                html.Div(
+                    '''Cet histogramme nous permet de comprendre que le poids des météorites
+                    varie énormément. Nous allons donc nous intéresser a chacun des types de
+                    météorites ainsi qu'à leur composition.''',
+                    style={'textAlign': 'justify', 'color':colors['text']}
+                ),
+                html.Br()
+            ],
+            className='section-differee',
+            style={'color':colors['background'], 'display':'inline-block', 'width': '2100'}
+        ),
+        ### Pie ###
+        html.Div(
+            children=[
+                section_trigger('pies'),
+                html.Br(),
+                html.Div(
+                    '''D'après la classification scientifique de Wikipedia
+                    (https://en.wikipedia.org/wiki/Meteorite_classification), il existe trois
+                    types de météorites : les météorites ferreuses, les météorites rocheuses,
+                    et les météorites mixtes. On les classe selon les éléments qui les constitut.
+                    La suite est simple, si ces éléments sont d'origine rocheuses, la météorites
+                    sera classée rocheuses. Si ces éléments sont ferreux, la météorites sera
+                    ferreuse et si la météorite est composée d'éléments hybrides (ferreux et
+                    rocheux), elle sera classée comme mixte. Parmi ces trois types, il existe un
+                    tas de cas différents selon les éléments qui constituent la météorite.''',
+                    style={'textAlign': 'justify', 'color':colors['text']}
+                ),
+                html.Br(),
+                html.H2(children=
+                '''Diagrammes circulaires de la moyenne des compositions de
+                chaque type de météorites''',
                 style={'textAlign': 'center', 'color': colors['title']}
-            ),
-            html.Div(
-                '''Choisissez le type de météorite que vous voulez afficher
-                sur la carte ci-dessous.''',
-                style={'textAlign': 'justify', 'color':colors['text']}
-            ),
-            html.Br(),
-            html.Label(
-                'Météorites de type : ',
-                style={'color': colors['title']}
-            ),
-            dcc.RadioItems(
-                id='meteorites-type-radio',
-                options=[
-                    {'label': 'Rocheuse', 'value': 'stony'},
-                    {'label': 'Ferreuse', 'value': 'iron'},
-                    {'label': 'Mixte', 'value': 'stony-iron'}
-                ],
-                style={'color':colors['text']},
-                value='stony-iron'
-            ),
-            dcc.Graph(
-                id='graph7',
-                figure=stonyIronGeo
-            )
-        ],
-    ),
-    html.Div(
-        children=[
-            html.Br(),
-            html.Div(children=
-                '''Copyrights : Ce dashbord a été entièrement réalisé par
-                Henriques Hugo & Leroux Gabriel''',
-                style={'textAlign': 'center', 'color': colors['legend']}
-            ),
-            html.Div(children=
-                '''Sources : Wikipédia, Futura Sciences''',
-                style={'textAlign': 'center', 'color': colors['legend']}
-            ),
-            html.Div(children=
-                '''Jeu de données utilisés (Kaggle.com) :
-                meteorite-landings.csv, worldcitiespop.csv, countryContinent.csv''',
-                style={'textAlign': 'center', 'color': colors['legend']}
-            )
-        ],
-    )
-], style={'backgroundColor': colors['background'], 'margin' : '0', 'width': '2300'})
+                ),
+                html.Div(
+                    children=[
+                        html.H3(children=
+                            '''-----------------Rocheuse------------------|''',
+                            style={'textAlign': 'center', 'color': colors['title']}
+                        ),
+                        dcc.Graph(
+                            id='graph4'
+                        )
+                    ],
+                    className="pie1",
+                    style={
+                        'display':'inline-block',
+                        'position' : 'relative',
+                        'height' : '800', 'width' : '700'
+                    }
+                ),
+                html.Div(
+                    children=[
+                        html.H3(children=
+                            '''----------------Ferreuse-----------------''',
+                            style={'textAlign': 'center', 'color': colors['title']}
+                        ),
+                        dcc.Graph(
+                            id='graph5',
+                            style={'textAlign': 'center'}
+                        )
+                    ],
+                    className="pie2",
+                    style={
+                        'display':'inline-block',
+                        'position' : 'relative',
+                        'height' : '800', 'width' : '700'
+                    }
+                ),
+                html.Div(
+                    children=[
+                        html.H3(children=
+                            '''|-----------------Mixte-------------------''',
+                            style={'textAlign': 'center', 'color': colors['title']}
+                        ),
+                        dcc.Graph(
+                            id='graph6'
+                        ),
+                    ],className="pie3",
+                    style={
+                        'display':'inline-block',
+                        'position' : 'relative',
+                        'height' : '800', 'width' : '700'
+                    }
+                ),
+            ],
+            className='section-differee',
+            style={
+                    'position' : 'relative',
+                    'display':'inline',
+                    'height' : 'auto',
+                    'width' : 'auto',
+                    'background-color' : colors['background']
+            }
+        ),
+        ### Map
+        html.Div(
+            children=[
+                section_trigger('carte'),
+                html.H2(children=
+                    '''Carte des lieux d'impacte de météorites de type ...''',
+                    id="title-geo",
+                    style={'textAlign': 'center', 'color': colors['title']}
+                ),
+                html.Div(
+                    '''Choisissez le type de météorite que vous voulez afficher
+                    sur la carte ci-dessous.''',
+                    style={'textAlign': 'justify', 'color':colors['text']}
+                ),
+                html.Br(),
+                html.Label(
+                    'Météorites de type : ',
+                    style={'color': colors['title']}
+                ),
+                dcc.RadioItems(
+                    id='meteorites-type-radio',
+                    options=[
+                        {'label': 'Rocheuse', 'value': 'stony'},
+                        {'label': 'Ferreuse', 'value': 'iron'},
+                        {'label': 'Mixte', 'value': 'stony-iron'}
+                    ],
+                    style={'color':colors['text']},
+                    value='stony-iron'
+                ),
+                # Téléchargement des météorites de la carte, avec les filtres courants
+                html.Div(
+                    children=[
+                        'Télécharger les météorites affichées : ',
+                        html.A('CSV', id='export-csv', download=''),
+                        ' | ',
+                        html.A('Parquet', id='export-parquet', download=''),
+                    ],
+                    style={'color': colors['text']}
+                ),
+                dcc.Graph(
+                    id='graph7'
+                ),
+                # Météorites les plus proches du point cliqué sur la carte
+                html.Div(
+                    'Cliquez sur un point de la carte pour lister les météorites les plus proches.',
+                    id='nearby-impacts',
+                    style={'color': colors['text']}
+                ),
+                # Dernière vue connue de la carte (centre et zoom)
+                dcc.Store(id='geo-viewport', data=VUE_DEFAUT),
+                # Masse maximale appliquée à la carte : sans limite tant que le
+                # filtre de masse n'a pas été déplacé, la carte montrant d'abord
+                # toutes les météorites (même de masse inconnue)
+                dcc.Store(id='geo-mass', data=SEUIL_SANS_LIMITE),
+                # Données des trois cartes pour les filtres et la vue courante,
+                # et ce qui ne change jamais (mise en page, marqueurs, titres) :
+                # changer de type de météorite se fait sans appel au serveur
+                dcc.Store(id='geo-data'),
+                dcc.Store(
+                    id='geo-style',
+                    data={'layout': geo_layout(), 'markers': GEO_MARKERS, 'titles': GEO_TITLES}
+                )
+            ],
+            className='section-differee',
+        ),
+        ### Vagues de découvertes
+        html.Div(
+            children=[
+                section_trigger('vagues'),
+                html.Br(),
+                html.H2(children=
+                    '''Vagues de découvertes de météorites par continent''',
+                    style={'textAlign': 'center', 'color': colors['title']}
+                ),
+                html.Div(
+                    '''À partir de 1850, les découvertes ne sont plus ponctuelles : chaque
+                    continent connaît des périodes de 10 à 20 ans de découvertes intenses,
+                    suivies de périodes creuses. Les courbes montrent le nombre moyen de
+                    découvertes par an sur une fenêtre glissante ; les vagues (taux supérieur
+                    de moitié à la moyenne du continent depuis 1850, pendant au moins 5 ans)
+                    sont tracées en trait épais.''',
+                    style={'textAlign': 'justify', 'color': colors['text']}
+                ),
+                html.Label(
+                    'Continents : ',
+                    style={'color': colors['title']}
+                ),
+                dcc.Checklist(
+                    id='waves-regions',
+                    options=[{'label': r, 'value': r} for r in regions],
+                    value=default_regions(regions),
+                    inputStyle={'margin-left': '10px', 'margin-right': '4px'},
+                    style={'color': colors['text']}
+                ),
+                html.Label(
+                    'Fenêtre glissante (années) : ',
+                    style={'color': colors['title']}
+                ),
+                dcc.Slider(
+                    id='waves-window',
+                    min=1,
+                    max=25,
+                    step=1,
+                    value=FENETRE_DEFAUT,
+                    marks={f: str(f) for f in (1, 5, 10, 15, 20, 25)}
+                ),
+                dcc.Graph(
+                    id='graph8'
+                ),
+                # Comparaison des continents
+                html.Div(id='waves-table')
+            ],
+            className='section-differee',
+        ),
+        html.Div(
+            children=[
+                html.Br(),
+                html.Div(children=
+                    '''Copyrights : Ce dashbord a été entièrement réalisé par
+                    Henriques Hugo & Leroux Gabriel''',
+                    style={'textAlign': 'center', 'color': colors['legend']}
+                ),
+                html.Div(children=
+                    '''Sources : Wikipédia, Futura Sciences''',
+                    style={'textAlign': 'center', 'color': colors['legend']}
+                ),
+                html.Div(children=
+                    '''Jeu de données utilisés (Kaggle.com) :
+                    meteorite-landings.csv, worldcitiespop.csv, countryContinent.csv''',
+                    style={'textAlign': 'center', 'color': colors['legend']}
+                )
+            ],
+        )
+    ], style={'backgroundColor': colors['background'], 'margin' : '0', 'width': '2300'})
+
+app.layout = serve_layout
 
 ### callbacks
 
 @app.callback(
-    Output(component_id='graph7', component_property='figure'),
-    Input(component_id='meteorites-type-radio', component_property='value')
+    Output(component_id='graph1', component_property='figure'),
+    Output(component_id='graph2', component_property='figure'),
+    Input(component_id='years-slider', component_property='value'),
+    Input(component_id='mass-slider', component_property='value'),
+    Input(component_id='section-histogrammes', component_property='n_clicks')
 )
-def update_scattergeo(input_value):
+def update_histograms(years_value, mass_value, ouverture):
     """
-    Retourne la figure géographique en fonction de la valeur du RadioItems
+    Retourne les deux histogrammes pour l'intervalle d'années et la masse maximale choisis
 
     Args:
-        input_value
+        years_value : [première année, dernière année]
+        mass_value : puissance de 10 de la masse maximale
+        ouverture : n_clicks du bouton de la section (None tant qu'elle n'a pas été vue)
 
     Returns:
-        update_scattergeo(input_value) : go.Figure( data=go.Scattergeo(...) )
+        update_histograms(years_value, mass_value, ouverture) : (go.Figure, go.Figure)
     """
-    if input_value == "stony"       :
-        return stonyGeo
-    if input_value == "iron"        :
-        return ironGeo
-    #if input_value == "stony-iron"  :
-    return stonyIronGeo
+    if ouverture is None:
+        raise PreventUpdate
+    return (
+        figures.get('barChart', years=years_value),
+        figures.get('barChartMin', years=years_value, mass=mass_value)
+    )
 
 @app.callback(
-    Output(component_id='title-geo', component_property='children'),
-    Input(component_id='meteorites-type-radio', component_property='value')
+    Output(component_id='graph4', component_property='figure'),
+    Output(component_id='graph5', component_property='figure'),
+    Output(component_id='graph6', component_property='figure'),
+    Input(component_id='section-pies', component_property='n_clicks'),
+    prevent_initial_call=True
+)
+def update_pies(ouverture):
+    """
+    Retourne les trois diagrammes circulaires, à l'ouverture de leur section
+
+    Args:
+        ouverture : n_clicks du bouton de la section
+
+    Returns:
+        update_pies(ouverture) : (go.Figure, go.Figure, go.Figure)
+    """
+    return (
+        figures.get('stonyPie'),
+        figures.get('ironPie'),
+        figures.get('stonyIronPie')
+    )
+
+@app.callback(
+    Output(component_id='geo-mass', component_property='data'),
+    Input(component_id='mass-slider', component_property='value'),
+    prevent_initial_call=True
+)
+def update_geo_mass(mass_value):
+    """
+    Applique le filtre de masse à la carte dès que l'utilisateur le déplace
+
+    Args:
+        mass_value : puissance de 10 de la masse maximale
+
+    Returns:
+        update_geo_mass(mass_value) : masse maximale de la carte
+    """
+    return mass_value
+
+@app.callback(
+    Output(component_id='geo-data', component_property='data'),
+    Output(component_id='geo-viewport', component_property='data'),
+    Input(component_id='years-slider', component_property='value'),
+    Input(component_id='geo-mass', component_property='data'),
+    Input(component_id='graph7', component_property='relayoutData'),
+    Input(component_id='section-carte', component_property='n_clicks'),
+    State(component_id='geo-viewport', component_property='data')
 )
-def update_title_geo(input_value):
+def update_geo_data(years_value, mass_value, relayout_data, ouverture, viewport):
     """
-    Retourne le nom de la figure géographique en fonction de la valeur du RadioItems
+    Retourne les données des trois cartes pour les filtres d'années et de masse
+    et la vue courante de la carte
 
     Args:
-        input_value
+        years_value : [première année, dernière année]
+        mass_value : puissance de 10 de la masse maximale de la carte (geo-mass)
+        relayout_data : relayoutData de la carte (zoom, déplacement)
+        ouverture : n_clicks du bouton de la section (None tant qu'elle n'a pas été vue)
+        viewport : vue précédente de la carte
 
     Returns:
-        update_title_geo(input_value) : 'title...'
-    """
-    if input_value == "stony"       :
-        return '''Carte des lieux d'impacte de météorites de type rocheuse'''
-    if input_value == "iron"        :
-        return '''Carte des lieux d'impacte de météorites de type ferreuse'''
-    #if input_value == "stony-iron"  :
-    return '''Carte des lieux d'impacte de météorites de type mixte'''
+        update_geo_data(...) : (dict catégorie -> figures.geo_data, vue de la carte)
+    """
+    if ouverture is None:
+        raise PreventUpdate
+    viewport = parse_viewport(relayout_data, viewport)
+    data = {
+        input_value: figures.get(
+            'geoData', input_value=input_value, years=years_value,
+            mass=mass_value, viewport=viewport
+        )
+        for input_value in GEO_TITLES
+    }
+    return data, viewport
+
+def waves_table(comparaison, vagues):
+    """
+    Retourne le tableau comparant les vagues de découvertes des continents
+
+    Args:
+        comparaison : pd.DataFrame de waves.compare_regions, indexée par continent
+        vagues : pd.DataFrame des vagues (region, start, end, peak_year...)
+
+    Returns:
+        waves_table(comparaison, vagues) : html.Table
+    """
+    entetes = [
+        'Continent', 'Découvertes', 'Vagues', 'Part pendant une vague',
+        'Durée moyenne (ans)', 'Écart moyen (ans)', 'Vagues (pic)'
+    ]
+    periodes = {
+        region: ', '.join('%d-%d (%d)' % (v.start, v.end, v.peak_year) for v in groupe.itertuples())
+        for region, groupe in vagues.groupby('region', sort=False)
+    }
+    lignes = [
+        html.Tr([
+            html.Td(region),
+            html.Td(str(c.total)),
+            html.Td(str(c.waves)),
+            html.Td('%.0f %%' % (100 * c.in_waves_share) if c.total else ''),
+            html.Td('' if np.isnan(c.mean_duration) else '%.1f' % c.mean_duration),
+            html.Td('' if np.isnan(c.mean_gap) else '%.1f' % c.mean_gap),
+            html.Td(periodes.get(region, '')),
+        ])
+        for region, c in zip(comparaison.index, comparaison.itertuples())
+    ]
+    return html.Table(
+        [html.Thead(html.Tr([html.Th(e) for e in entetes])), html.Tbody(lignes)],
+        style={'width': '100%', 'color': colors['text']}
+    )
+
+@app.callback(
+    Output(component_id='graph8', component_property='figure'),
+    Output(component_id='waves-table', component_property='children'),
+    Input(component_id='waves-regions', component_property='value'),
+    Input(component_id='waves-window', component_property='value'),
+    Input(component_id='section-vagues', component_property='n_clicks')
+)
+def update_waves(regions_value, window_value, ouverture):
+    """
+    Retourne les courbes et le tableau des vagues de découvertes des continents choisis
+
+    Args:
+        regions_value : continents cochés
+        window_value : largeur de la fenêtre glissante, en années
+        ouverture : n_clicks du bouton de la section (None tant qu'elle n'a pas été vue)
+
+    Returns:
+        update_waves(...) : (go.Figure, html.Table)
+    """
+    if ouverture is None:
+        raise PreventUpdate
+    resultat = analyse(donnees['discovery'], regions_value or [], int(window_value or FENETRE_DEFAUT))
+    return waves_figure(resultat), waves_table(resultat['comparison'], resultat['waves'])
+
+@app.callback(
+    Output(component_id='export-csv', component_property='href'),
+    Output(component_id='export-parquet', component_property='href'),
+    Input(component_id='meteorites-type-radio', component_property='value'),
+    Input(component_id='years-slider', component_property='value'),
+    Input(component_id='geo-mass', component_property='data')
+)
+def update_export_links(input_value, years_value, mass_value):
+    """
+    Retourne les liens d'export (/api/export) des météorites de la carte
+    pour le type et les filtres choisis
+
+    Args:
+        input_value : type de météorite ('stony', 'iron' ou 'stony-iron')
+        years_value : [première année, dernière année]
+        mass_value : puissance de 10 de la masse maximale de la carte (geo-mass)
+
+    Returns:
+        update_export_links(...) : (lien CSV, lien Parquet)
+    """
+    parametres = {'dataset': input_value.replace('-', '_')}
+    if years_value:
+        parametres['year_min'], parametres['year_max'] = years_value
+    seuil = mass_threshold(mass_value)
+    if seuil is not None:
+        parametres['max_mass_g'] = str(float(seuil))
+    return tuple(
+        app.get_relative_path('/api/export') + '?' + urlencode(dict(parametres, format=f))
+        for f in ('csv', 'parquet')
+    )
+
+@app.callback(
+    Output(component_id='nearby-impacts', component_property='children'),
+    Input(component_id='graph7', component_property='clickData'),
+    prevent_initial_call=True
+)
+def update_nearby(click_data):
+    """
+    Retourne les météorites les plus proches du point cliqué sur la carte
+
+    Args:
+        click_data : clickData de la carte (point ou cellule cliqué)
+
+    Returns:
+        update_nearby(click_data) : html.Div
+    """
+    if not click_data or not click_data.get('points'):
+        raise PreventUpdate
+    point = click_data['points'][0]
+    if point.get('lat') is None or point.get('lon') is None:
+        raise PreventUpdate
+    resultats = donnees['impact_index'].nearest(point['lat'], point['lon'], NB_VOISINS)
+    return html.Div([
+        html.H3(
+            'Météorites les plus proches de (%.2f, %.2f)' % (point['lat'], point['lon']),
+            style={'color': colors['title']}
+        ),
+        nearby_table(resultats),
+    ])
+
+# La figure géographique et son titre sont construits dans le navigateur
+# (assets/map.js) à partir de la valeur du RadioItems et des données des cartes
+app.clientside_callback(
+    ClientsideFunction(namespace='carte', function_name='update_scattergeo'),
+    Output(component_id='graph7', component_property='figure'),
+    Output(component_id='title-geo', component_property='children'),
+    Input(component_id='meteorites-type-radio', component_property='value'),
+    Input(component_id='geo-data', component_property='data'),
+    State(component_id='geo-style', component_property='data')
+)
+
+### Nouvelles météorites
+
+# Intervalle (en secondes) entre deux recherches de nouveaux lots (ingest.py),
+# 0 pour ne jamais en chercher
+INTERVALLE_LOTS = float(os.environ.get('DASHBOARD_INTERVALLE_LOTS', 30))
+
+_verrou_lots = threading.Lock()
+
+def refresh_data():
+    """
+    Ajoute aux données courantes les lots de nouvelles météorites arrivés
+    depuis le dernier appel
+
+    Les nouvelles données sont entièrement préparées avant de remplacer les
+    anciennes : une requête en cours termine avec l'ancienne version.
+    Les index sont complétés avec les seules lignes des lots (update_data).
+
+    Returns:
+        refresh_data() : True si les données ont changé
+    """
+    global donnees
+    with _verrou_lots:
+        frames_lots, noms, insertions = apply_batches(donnees, lots_appliques)
+        if not noms:
+            return False
+        lots_appliques.update(noms)
+        donnees = update_data(donnees, frames_lots, insertions, data_version(lots_appliques))
+    # Les figures et les réponses en cache ont été construites avec les anciennes données
+    figures.clear()
+    reponses.clear()
+    return True
+
+def watch_batches():
+    """
+    Cherche les nouveaux lots toutes les INTERVALLE_LOTS secondes
+    (boucle sans fin, lancée dans un thread de chaque processus du serveur)
+    """
+    while True:
+        time.sleep(INTERVALLE_LOTS)
+        try:
+            refresh_data()
+        except Exception:
+            logger.exception('Échec de l\'ajout des nouvelles météorites')
+
+@server.before_first_request
+def start_watching_batches():
+    """
+    Lance la surveillance des lots à la première requête : le thread
+    appartient ainsi à chaque worker, et non au processus maître de serve.py
+    """
+    if INTERVALLE_LOTS > 0:
+        threading.Thread(target=watch_batches, name='lots', daemon=True).start()
+
+# Graduations du filtre de masse dont les réponses sont préparées au démarrage
+# (avec toutes les années, valeur initiale du filtre d'années)
+PRESETS_MASSE = list(range(SEUIL_SANS_LIMITE + 1))
+
+def warm_up_requests():
+    """
+    Retourne les requêtes de callbacks préparées au démarrage, telles que les
+    envoie le navigateur : ouverture de chaque section avec les valeurs
+    initiales de la page, et chaque graduation du filtre de masse
+
+    Les requêtes d'un même groupe partagent leurs figures.
+
+    Returns:
+        warm_up_requests() : liste de listes de corps de requêtes (warmup.callback_request)
+    """
+    annees = donnees['years']
+    groupes = []
+    for masse in PRESETS_MASSE:
+        filtres = [('years-slider', 'value', annees), ('mass-slider', 'value', masse)]
+        groupe = [callback_request(
+            [('graph1', 'figure'), ('graph2', 'figure')],
+            filtres + [('section-histogrammes', 'n_clicks', 1)]
+        )]
+        # La carte et les liens d'export suivent la masse de la carte (geo-mass)
+        filtres = [('years-slider', 'value', annees), ('geo-mass', 'data', masse)]
+        # Données des trois cartes, la vue n'ayant pas encore changé
+        # (relayoutData absent, ou autosize au premier tracé)
+        for relayout in (None, {'autosize': True}):
+            groupe.append(callback_request(
+                [('geo-data', 'data'), ('geo-viewport', 'data')],
+                filtres + [('graph7', 'relayoutData', relayout), ('section-carte', 'n_clicks', 1)],
+                [('geo-viewport', 'data', VUE_DEFAUT)]
+            ))
+        for input_value in GEO_TITLES:
+            groupe.append(callback_request(
+                [('export-csv', 'href'), ('export-parquet', 'href')],
+                [('meteorites-type-radio', 'value', input_value)] + filtres
+            ))
+        groupes.append(groupe)
+    groupes.append([callback_request(
+        [('graph4', 'figure'), ('graph5', 'figure'), ('graph6', 'figure')],
+        [('section-pies', 'n_clicks', 1)]
+    )])
+    groupes.append([callback_request(
+        [('graph8', 'figure'), ('waves-table', 'children')],
+        [
+            ('waves-regions', 'value', default_regions(donnees['discovery'].regions)),
+            ('waves-window', 'value', FENETRE_DEFAUT),
+            ('section-vagues', 'n_clicks', 1),
+        ]
+    )])
+    return groupes
+
+def warm_up():
+    """
+    Construit à l'avance la figure et les réponses compressées du layout,
+    puis, en parallèle (warmup.py), les réponses des callbacks pour les
+    variantes attendues, afin que les workers de serve.py en héritent au
+    lieu de les reconstruire chacun
+    """
+    figures.get('massMoy')
+    # Réponses demandées par chaque nouvelle page, déjà compressées
+    for route in ('_dash-layout', '_dash-dependencies'):
+        preload(app, reponses, app.config.routes_pathname_prefix + route)
+    warm_callbacks(app, reponses, warm_up_requests())
 
 ###======================== MISE EN PLACE DU DASHBOARD =================================###
 
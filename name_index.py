@@ -0,0 +1,504 @@
+"""
+Association des météorites aux villes de worldcitiespop.csv par leur nom
+(mode de géocodage 'nom' de pipeline.py).
+
+Les noms sont comparés sous une forme normalisée : sans accents, en
+minuscules et sans ponctuation. Une météorite sans ville de ce nom est
+ensuite cherchée sans le numéro ou la désignation qui termine le nom de la
+plupart des météorites ("Allan Hills 77005", "Acfer 001", "Bensour (a)"
+deviennent "allan hills", "acfer", "bensour").
+
+Les villes sont rangées par nom normalisé, et une table de hachage
+(pd.Index) donne pour chaque nom la plage de ses villes candidates. Une
+recherche vectorisée associe alors à chaque météorite la candidate la plus
+proche de son lieu d'impact (ou, sans coordonnées, la première du fichier).
+
+Toutes les villes sont rangées une seule fois par nom normalisé dans un
+magasin (CityNameStore) enregistré au format Arrow dans le dossier de cache,
+et relu par projection en mémoire (memory map). Pour un ensemble de
+météorites, seules les villes de leurs noms en sont extraites (semi-jointure) :
+les noms sont cherchés par dichotomie parmi les empreintes triées des noms
+de villes, si bien que le coût d'un lot est proportionnel au nombre de ses
+noms et de leurs villes, et non aux 3 millions de villes du fichier.
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import hashlib
+import logging
+import os
+import shutil
+import string
+import unicodedata
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from geocoder import chord_to_km, to_unit_sphere
+from instrumentation import timed_stage
+
+logger = logging.getLogger(__name__)
+
+# Nombre de lignes de worldcitiespop.csv lues à la fois
+TAILLE_BLOC_VILLES = 200000
+
+# Version du format du magasin des villes
+VERSION_INDEX = 2
+
+# Table remplaçant par une espace tout caractère ASCII autre qu'une lettre
+# minuscule ou un chiffre
+_SEPARATEURS = str.maketrans({
+    chr(c): ' ' for c in range(128) if chr(c) not in string.ascii_lowercase + string.digits
+})
+
+# Nombre maximal de couples (météorite, ville candidate) comparés à la fois
+PAIRES_MAX = 2000000
+
+
+def normalize_name(nom, sans_numero=False):
+    """
+    Retourne la forme normalisée d'un nom de météorite ou de ville : sans
+    accents, en minuscules et sans ponctuation
+
+    Args:
+        nom : str
+        sans_numero : retire aussi les mots qui terminent le nom et contiennent
+        un chiffre (numéro de la météorite) ou sont une lettre seule
+        (désignation "(a)", "(b)"...) ; le premier mot est toujours gardé
+
+    Returns:
+        normalize_name(nom, sans_numero) : str, vide si le nom ne contient
+        ni lettre ni chiffre
+    """
+    if not nom.isascii():
+        # Les accents sont séparés de leur lettre (NFKD) puis retirés
+        nom = unicodedata.normalize('NFKD', nom).encode('ascii', 'ignore').decode('ascii')
+    mots = nom.lower().translate(_SEPARATEURS).split()
+    # Les mots ne contiennent que des lettres et des chiffres
+    while sans_numero and len(mots) > 1 and (len(mots[-1]) == 1 or not mots[-1].isalpha()):
+        mots.pop()
+    return ' '.join(mots)
+
+
+def normalize_names(noms, sans_numero=False):
+    """
+    Retourne la forme normalisée (normalize_name) de noms de météorites ou
+    de villes, chaque nom distinct n'étant normalisé qu'une fois
+
+    Args:
+        noms : pd.Series ou itérable de str (NaN accepté)
+        sans_numero : retire aussi le numéro ou la désignation qui termine le nom
+
+    Returns:
+        normalize_names(noms, sans_numero) : np.ndarray d'objets (str, ou NaN
+        pour un nom absent ou vide une fois normalisé)
+    """
+    codes, uniques = pd.factorize(pd.Series(noms, dtype=object))
+    cles = [normalize_name(str(nom), sans_numero) or np.nan for nom in uniques]
+    # Les noms absents ont le code -1 : le NaN ajouté à la fin
+    return np.array(cles + [np.nan], dtype=object)[codes]
+
+
+class CityNameIndex:
+    """
+    Index des villes portant l'un des noms recherchés (CityNameStore.restrict)
+
+    Les villes sont triées par nom normalisé, puis dans l'ordre du fichier.
+
+    Attributs :
+        keys : pd.Index des noms normalisés
+        starts : position de la première ville de chaque nom (len(keys) + 1 valeurs)
+        city : nom (AccentCity) de chaque ville
+        country : code pays de chaque ville, en majuscules (pd.Categorical)
+        points : coordonnées des villes sur la sphère unité (float32, NaN si inconnues)
+    """
+
+    def __init__(self, keys, starts, city, country, points):
+        self.keys = keys
+        self.starts = starts
+        self.city = city
+        self.country = country
+        self.points = points
+
+    def __len__(self):
+        return len(self.city)
+
+    def _closest(self, meteorites, codes, points):
+        """
+        Choisit, pour chaque météorite, la candidate la plus proche parmi les
+        villes de son nom
+
+        Args:
+            meteorites : positions des météorites
+            codes : position du nom de chaque météorite dans keys
+            points : coordonnées des météorites sur la sphère unité
+
+        Returns:
+            _closest(meteorites, codes, points) : (position de la ville choisie,
+            corde jusqu'à elle, inf si inconnue), alignés sur meteorites
+        """
+        debuts = self.starts[codes]
+        nombres = self.starts[codes + 1] - debuts
+        # Un couple (météorite, ville candidate) par ligne
+        paire_meteorite = np.repeat(np.arange(len(meteorites)), nombres)
+        rang = np.arange(len(paire_meteorite)) - np.repeat(np.cumsum(nombres) - nombres, nombres)
+        paire_ville = np.repeat(debuts, nombres) + rang
+        corde = np.linalg.norm(
+            self.points[paire_ville].astype(np.float64) - points[meteorites[paire_meteorite]],
+            axis=1
+        )
+        corde[np.isnan(corde)] = np.inf
+        # Par météorite, la plus proche d'abord ; à distance égale (ou
+        # inconnue), la première du fichier
+        ordre = np.lexsort((rang, corde, paire_meteorite))
+        premieres = ordre[np.searchsorted(paire_meteorite[ordre], np.arange(len(meteorites)))]
+        return paire_ville[premieres], corde[premieres]
+
+    def match(self, noms, lat, lon, cles=None):
+        """
+        Cherche en une seule passe vectorisée la ville de chaque météorite
+
+        Args:
+            noms : noms des météorites
+            lat : tableau des latitudes des lieux d'impact
+            lon : tableau des longitudes des lieux d'impact
+            cles : noms déjà normalisés (normalize_names), calculés ici si None
+
+        Returns:
+            match(noms, lat, lon) : pd.DataFrame (City, code_2, distance_km, match)
+            alignée sur les météorites ; match vaut 'exact' si le nom de la
+            ville est celui de la météorite, 'normalized' s'il ne lui est égal
+            qu'une fois normalisé, 'designation' s'il a fallu retirer le numéro
+            de la météorite, et NaN (comme City et code_2) sans ville
+        """
+        noms = pd.Series(noms, dtype=object).to_numpy()
+        if cles is None:
+            cles = normalize_names(noms)
+        codes = self.keys.get_indexer(cles)
+        # Sans ville du nom complet, on cherche le nom sans numéro ni désignation
+        sans_ville = np.flatnonzero(codes < 0)
+        codes[sans_ville] = self.keys.get_indexer(normalize_names(cles[sans_ville], True))
+        par_designation = np.zeros(len(noms), dtype=bool)
+        par_designation[sans_ville] = True
+        trouvees = np.flatnonzero(codes >= 0)
+        points = to_unit_sphere(lat, lon)
+
+        ville = np.empty(len(trouvees), dtype=np.int64)
+        corde = np.empty(len(trouvees))
+        # Les couples sont comparés par blocs de météorites, pour borner la mémoire
+        nombres = self.starts[codes[trouvees] + 1] - self.starts[codes[trouvees]]
+        cumul = np.cumsum(nombres)
+        debut = 0
+        while debut < len(trouvees):
+            fin = max(int(np.searchsorted(cumul, cumul[debut] - nombres[debut] + PAIRES_MAX,
+                                          side='right')), debut + 1)
+            ville[debut:fin], corde[debut:fin] = self._closest(
+                trouvees[debut:fin], codes[trouvees[debut:fin]], points
+            )
+            debut = fin
+
+        city = np.full(len(noms), np.nan, dtype=object)
+        city[trouvees] = self.city[ville]
+        code = np.full(len(noms), np.nan, dtype=object)
+        code[trouvees] = np.asarray(self.country)[ville]
+        distance = np.full(len(noms), np.nan)
+        distance[trouvees] = np.where(np.isinf(corde), np.nan, chord_to_km(corde))
+        correspondance = np.full(len(noms), np.nan, dtype=object)
+        correspondance[trouvees] = np.select(
+            [city[trouvees] == noms[trouvees], par_designation[trouvees]],
+            ['exact', 'designation'], 'normalized'
+        )
+        return pd.DataFrame({
+            'City': city, 'code_2': code, 'distance_km': distance, 'match': correspondance
+        })
+
+
+def _empreintes(cles):
+    """
+    Empreintes de noms normalisés, identiques d'un processus à l'autre
+
+    Args:
+        cles : liste de str
+
+    Returns:
+        _empreintes(cles) : np.ndarray de uint64
+    """
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(cle.encode('utf8'), digest_size=8).digest(), 'little')
+         for cle in cles),
+        dtype=np.uint64, count=len(cles),
+    )
+
+
+class CityNameStore:
+    """
+    Magasin de toutes les villes de worldcitiespop.csv, rangées par nom
+    normalisé, dont on extrait l'index des seuls noms recherchés
+
+    Les noms sont triés par empreinte (_empreintes) : un nom est retrouvé par
+    dichotomie, sans table de hachage à construire sur tous les noms. Les
+    villes sont rangées dans l'ordre des noms, puis dans l'ordre du fichier.
+
+    Attributs :
+        hashes : empreinte de chaque nom, croissante (uint64)
+        keys : noms normalisés (pa.StringArray)
+        debut, fin : plage des villes de chaque nom (int64)
+        city : nom (AccentCity) de chaque ville (pa.StringArray)
+        country : code pays de chaque ville, en majuscules (pa.StringArray)
+        points : coordonnées des villes sur la sphère unité (float32, NaN si inconnues)
+    """
+
+    def __init__(self, hashes, keys, debut, fin, city, country, points):
+        self.hashes = hashes
+        self.keys = keys
+        self.debut = debut
+        self.fin = fin
+        self.city = city
+        self.country = country
+        self.points = points
+
+    def __len__(self):
+        return len(self.city)
+
+    @classmethod
+    def from_csv(cls, chemin, taille_bloc=None):
+        """
+        Construit le magasin à partir de worldcitiespop.csv, lu par blocs
+        et seulement pour les colonnes utiles
+
+        Args:
+            chemin : chemin de worldcitiespop.csv
+            taille_bloc : nombre de lignes lues à la fois (TAILLE_BLOC_VILLES par défaut)
+
+        Returns:
+            from_csv(chemin, taille_bloc) : CityNameStore
+        """
+        blocs = []
+        lecteur = pd.read_csv(
+            chemin,
+            usecols=['Country', 'AccentCity', 'Latitude', 'Longitude'],
+            dtype={'Country': 'category', 'AccentCity': object,
+                   'Latitude': np.float32, 'Longitude': np.float32},
+            chunksize=taille_bloc or TAILLE_BLOC_VILLES,
+        )
+        for bloc in lecteur:
+            bloc = bloc.assign(key=normalize_names(bloc['AccentCity']))
+            blocs.append(bloc.dropna(subset=['key']))
+        cities = pd.concat(blocs, ignore_index=True)
+
+        codes, uniques = pd.factorize(cities['key'])
+        empreintes = _empreintes(uniques)
+        # Rang de chaque nom une fois triés par empreinte
+        ordre_cles = np.argsort(empreintes, kind='stable')
+        rang = np.empty(len(uniques), dtype=np.int64)
+        rang[ordre_cles] = np.arange(len(uniques))
+        # Tri stable : les villes d'un même nom restent dans l'ordre du fichier
+        cities = cities.iloc[np.argsort(rang[codes], kind='stable')]
+        nombres = np.bincount(codes, minlength=len(uniques))[ordre_cles]
+        fin = np.cumsum(nombres)
+        points = to_unit_sphere(cities['Latitude'], cities['Longitude']).astype(np.float32)
+        return cls(
+            empreintes[ordre_cles],
+            pa.array(np.asarray(uniques, dtype=object)[ordre_cles], pa.string()),
+            fin - nombres, fin,
+            pa.array(cities['AccentCity'].to_numpy(dtype=object), pa.string()),
+            pa.array(cities['Country'].astype(str).str.upper().to_numpy(dtype=object), pa.string()),
+            points,
+        )
+
+    def save(self, dossier):
+        """
+        Enregistre le magasin dans un dossier, au format Arrow (écriture
+        atomique : le dossier est écrit sous un nom temporaire puis renommé)
+
+        Args:
+            dossier : chemin du dossier
+        """
+        cles = pa.RecordBatch.from_arrays(
+            [pa.array(self.hashes), self.keys, pa.array(self.debut), pa.array(self.fin)],
+            schema=pa.schema(
+                [('hash', pa.uint64()), ('key', pa.string()),
+                 ('debut', pa.int64()), ('fin', pa.int64())],
+                metadata={'version': str(VERSION_INDEX)},
+            ),
+        )
+        villes = pa.RecordBatch.from_arrays(
+            [self.city, self.country,
+             pa.FixedSizeListArray.from_arrays(pa.array(self.points.reshape(-1)), 3)],
+            names=['city', 'country', 'point'],
+        )
+        temporaire = '%s.%d.tmp' % (dossier, os.getpid())
+        os.makedirs(temporaire, exist_ok=True)
+        for nom, lot in (('keys', cles), ('cities', villes)):
+            # Un seul lot par fichier : chaque colonne est relue d'un bloc
+            with pa.ipc.new_file(os.path.join(temporaire, nom + '.arrow'), lot.schema) as sortie:
+                sortie.write_batch(lot)
+        try:
+            os.rename(temporaire, dossier)
+        except OSError:
+            # Un autre processus a publié la même version entre-temps
+            shutil.rmtree(temporaire, ignore_errors=True)
+
+    @classmethod
+    def load(cls, dossier):
+        """
+        Relit un magasin enregistré par save, en projetant ses fichiers en
+        mémoire : les colonnes ne sont lues que pour les noms recherchés
+
+        Args:
+            dossier : chemin du dossier
+
+        Returns:
+            load(dossier) : CityNameStore, ou None si le dossier est absent
+            ou d'une autre version
+        """
+        try:
+            cles, villes = (
+                pa.ipc.open_file(pa.memory_map(os.path.join(dossier, nom + '.arrow'))).get_batch(0)
+                for nom in ('keys', 'cities')
+            )
+        except (OSError, pa.ArrowInvalid):
+            return None
+        if (cles.schema.metadata or {}).get(b'version') != str(VERSION_INDEX).encode():
+            return None
+        return cls(
+            cles.column('hash').to_numpy(), cles.column('key'),
+            cles.column('debut').to_numpy(), cles.column('fin').to_numpy(),
+            villes.column('city'), villes.column('country'),
+            villes.column('point').flatten().to_numpy().reshape(-1, 3),
+        )
+
+    def lookup(self, cles):
+        """
+        Cherche des noms normalisés parmi ceux des villes
+
+        Args:
+            cles : liste de noms normalisés (str)
+
+        Returns:
+            lookup(cles) : np.ndarray, position de chaque nom dans keys (-1 si absent)
+        """
+        empreintes = _empreintes(cles)
+        positions = np.searchsorted(self.hashes, empreintes)
+        trouves = np.flatnonzero(positions < len(self.hashes))
+        trouves = trouves[self.hashes[positions[trouves]] == empreintes[trouves]]
+        resultat = np.full(len(cles), -1, dtype=np.int64)
+        # L'empreinte ne suffit pas : on compare les noms, et en cas de
+        # collision on parcourt les noms de même empreinte
+        noms = self.keys.take(pa.array(positions[trouves], pa.int64())).to_pylist()
+        for i, nom in zip(trouves, noms):
+            position = positions[i]
+            while nom != cles[i]:
+                position += 1
+                if position == len(self.hashes) or self.hashes[position] != empreintes[i]:
+                    break
+                nom = self.keys[position].as_py()
+            else:
+                resultat[i] = position
+        return resultat
+
+    def restrict(self, cles):
+        """
+        Extrait l'index des villes dont le nom normalisé est celui d'une
+        météorite, complet ou sans numéro (semi-jointure)
+
+        Args:
+            cles : noms normalisés des météorites (normalize_names)
+
+        Returns:
+            restrict(cles) : CityNameIndex
+        """
+        # Les clés essayées par match : nom complet, puis sans numéro
+        recherchees = pd.unique(np.concatenate([cles, normalize_names(cles, True)]))
+        recherchees = [cle for cle in recherchees if isinstance(cle, str)]
+        positions = self.lookup(recherchees)
+        gardees = np.flatnonzero(positions >= 0)
+        # Dans l'ordre du magasin, pour lire les fichiers d'un bout à l'autre
+        gardees = gardees[np.argsort(positions[gardees])]
+        positions = positions[gardees]
+
+        debuts = self.debut[positions]
+        nombres = self.fin[positions] - debuts
+        starts = np.zeros(len(positions) + 1, dtype=np.int64)
+        np.cumsum(nombres, out=starts[1:])
+        villes = np.repeat(debuts - starts[:-1], nombres) + np.arange(starts[-1])
+        prises = pa.array(villes, pa.int64())
+        return CityNameIndex(
+            pd.Index(np.asarray(recherchees, dtype=object)[gardees], dtype=object), starts,
+            self.city.take(prises).to_numpy(zero_copy_only=False),
+            pd.Categorical(self.country.take(prises).to_numpy(zero_copy_only=False)),
+            np.asarray(self.points[villes]),
+        )
+
+    def match(self, noms, lat, lon):
+        """
+        Cherche la ville de chaque météorite (CityNameIndex.match) dans
+        l'index extrait pour leurs noms
+
+        Args:
+            noms : noms des météorites
+            lat : tableau des latitudes des lieux d'impact
+            lon : tableau des longitudes des lieux d'impact
+
+        Returns:
+            match(noms, lat, lon) : pd.DataFrame (City, code_2, distance_km, match)
+        """
+        cles = normalize_names(noms)
+        index = self.restrict(cles)
+        logger.info('Index des noms : %d villes candidates sur %d', len(index), len(self))
+        return index.match(noms, lat, lon, cles)
+
+
+def match_rates(correspondances):
+    """
+    Compte les météorites associées à une ville par CityNameIndex.match
+
+    Args:
+        correspondances : résultat de CityNameIndex.match
+
+    Returns:
+        match_rates(correspondances) : dict (meteorites, exact, normalized,
+        designation, unmatched, match_rate)
+    """
+    total = len(correspondances)
+    comptes = correspondances['match'].value_counts()
+    associees = int(comptes.sum())
+    return {
+        'meteorites': total,
+        'exact': int(comptes.get('exact', 0)),
+        'normalized': int(comptes.get('normalized', 0)),
+        'designation': int(comptes.get('designation', 0)),
+        'unmatched': total - associees,
+        'match_rate': associees / total if total else 0.0,
+    }
+
+
+@timed_stage('load_name_store')
+def load_name_store(chemin_villes, dossier_cache):
+    """
+    Retourne le magasin des villes par nom, en le relisant depuis le cache
+    s'il a été construit à partir de la même version de worldcitiespop.csv
+
+    Args:
+        chemin_villes : chemin de worldcitiespop.csv
+        dossier_cache : dossier où enregistrer le magasin
+
+    Returns:
+        load_name_store(chemin_villes, dossier_cache) : CityNameStore
+    """
+    infos = os.stat(chemin_villes)
+    nom = 'names-%d-%d' % (infos.st_size, infos.st_mtime_ns)
+    chemin = os.path.join(dossier_cache, nom)
+    magasin = CityNameStore.load(chemin)
+    if magasin is None:
+        logger.info('Construction du magasin des noms de villes (%s)', chemin_villes)
+        os.makedirs(dossier_cache, exist_ok=True)
+        CityNameStore.from_csv(chemin_villes).save(chemin)
+        # Seul le processus qui a écrit la nouvelle version retire les anciennes
+        # (un processus qui les lit encore garde sa projection en mémoire)
+        for ancien in os.listdir(dossier_cache):
+            if ancien.startswith('names-') and ancien != nom and not ancien.endswith('.tmp'):
+                shutil.rmtree(os.path.join(dossier_cache, ancien), ignore_errors=True)
+        magasin = CityNameStore.load(chemin)
+    return magasin
@@ -0,0 +1,486 @@
+"""
+Traitement des données du dashboard :
+lecture des fichiers .csv, nettoyage, merge des dataframes
+et création des sous-dataframes utilisées par les figures.
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import os
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv as pa_csv
+
+from aggregates import DIMENSIONS_CUBE, build_cube, mean_mass_by_year
+from classification import classify, sort_by_group, subset
+from geocoder import load_geocoder
+from instrumentation import timed_stage
+from name_index import load_name_store, match_rates
+
+logger = logging.getLogger(__name__)
+
+# Dossier contenant les jeux de données (par défaut celui du projet)
+DOSSIER_DONNEES = os.environ.get(
+    'DASHBOARD_DATA', os.path.dirname(os.path.abspath(__file__))
+)
+
+# Dossier des fichiers dérivés des données (instantané, index des villes)
+DOSSIER_CACHE = os.environ.get(
+    'DASHBOARD_SNAPSHOT', os.path.join(DOSSIER_DONNEES, '.snapshot')
+)
+
+# Méthode d'attribution d'une ville / d'un pays à chaque météorite :
+# 'coordonnees' : ville la plus proche du lieu d'impact (geocoder.py)
+# 'nom' : ville portant le même nom que la météorite, la plus proche du lieu
+# d'impact s'il y en a plusieurs (name_index.py)
+MODE_GEOCODAGE = os.environ.get('DASHBOARD_GEOCODAGE', 'coordonnees')
+
+# Jeux de données sources, dans l'ordre de lecture
+SOURCES = {
+    'meteorites': 'meteorite-landings.csv',
+    'cities': 'worldcitiespop.csv',
+    'continents': 'countryContinent.csv',
+}
+
+
+def chemin_source(nom, dossier=None):
+    """
+    Retourne le chemin du fichier .csv d'un jeu de données source
+
+    Args:
+        nom : clé de SOURCES
+        dossier : dossier des données (DOSSIER_DONNEES par défaut)
+
+    Returns:
+        chemin_source(nom, dossier) : str
+    """
+    return os.path.join(dossier or DOSSIER_DONNEES, SOURCES[nom])
+
+
+# Colonnes de meteorite-landings.csv conservées
+COLONNES_METEORITES = ['name', 'recclass', 'mass', 'year', 'reclat', 'reclong', 'GeoLocation']
+
+# Types compacts des colonnes de maindf (voir compact_dtypes) :
+# - les textes qui se répètent deviennent des catégories (un code entier par ligne)
+# - les années (1801 à 2020) tiennent sur 16 bits
+# - les coordonnées en float32 gardent une précision de l'ordre du mètre
+# La masse reste en float64 : elle va jusqu'à 60 tonnes au gramme près, et
+# les histogrammes en font des sommes
+TYPES_COMPACTS = {
+    'recclass': 'category',
+    'year': 'int16',
+    'reclat': 'float32',
+    'reclong': 'float32',
+    'City': 'category',
+    'code_2': 'category',
+    'country': 'category',
+    'continent': 'category',
+}
+
+# Colonnes supprimées de maindf : GeoLocation ("(lat, long)" en texte)
+# répète reclat et reclong
+COLONNES_REDONDANTES = ['GeoLocation']
+
+
+@timed_stage('compact_dtypes')
+def compact_dtypes(df):
+    """
+    Convertit les colonnes de maindf dans les types de TYPES_COMPACTS
+    et supprime les colonnes de COLONNES_REDONDANTES
+
+    Args:
+        df : dataframe principale
+
+    Returns:
+        compact_dtypes(df) : nouvelle pd.DataFrame, mêmes lignes
+    """
+    df = df.drop(columns=[c for c in COLONNES_REDONDANTES if c in df.columns])
+    return df.astype({c: t for c, t in TYPES_COMPACTS.items() if c in df.columns})
+
+
+def memory_report(avant, apres):
+    """
+    Compare la mémoire occupée par chaque colonne de deux dataframes
+
+    Args:
+        avant : dataframe d'origine
+        apres : la même, après compact_dtypes
+
+    Returns:
+        memory_report(avant, apres) : pd.DataFrame indexée par colonne
+        (dtype_before, bytes_before, dtype_after, bytes_after), avec une ligne total
+    """
+    rapport = pd.DataFrame({
+        'dtype_before': avant.dtypes.astype(str),
+        'bytes_before': avant.memory_usage(index=False, deep=True),
+        'dtype_after': apres.dtypes.astype(str),
+        'bytes_after': apres.memory_usage(index=False, deep=True),
+    }, index=avant.columns)
+    rapport['dtype_after'] = rapport['dtype_after'].fillna('-')
+    rapport['bytes_after'] = rapport['bytes_after'].fillna(0).astype('int64')
+    rapport.loc['total'] = ['', rapport['bytes_before'].sum(), '', rapport['bytes_after'].sum()]
+    return rapport
+
+
+@timed_stage('read_continents')
+def read_continents(dossier=None):
+    """
+    Lit countryContinent.csv en ne gardant que le code du pays,
+    son nom et son continent
+
+    Args:
+        dossier : dossier des données (DOSSIER_DONNEES par défaut)
+
+    Returns:
+        read_continents(dossier) : pd.DataFrame (country, code_2, continent)
+    """
+    # Pour ajouter les continents :
+    continents = pd.read_csv(chemin_source('continents', dossier), encoding='utf8')
+    # lien : https://www.kaggle.com/statchaitya/country-to-continent
+
+    # On supprime les colonnes qui ne nous serviront pas
+    # Ici ce que l'on veux récupérer ce sont les continents
+    continents = continents.drop(columns=['code_3'])
+    continents = continents.drop(columns=['country_code'])
+    continents = continents.drop(columns=['iso_3166_2'])
+    continents = continents.drop(columns=['sub_region'])
+    continents = continents.drop(columns=['region_code'])
+    continents = continents.drop(columns=['sub_region_code'])
+    return continents
+
+
+def clean_meteorites(meteorites):
+    """
+    Nettoie des lignes de meteorite-landings.csv déjà lues
+
+    Args:
+        meteorites : lignes au format de meteorite-landings.csv
+
+    Returns:
+        clean_meteorites(meteorites) : pd.DataFrame (colonnes COLONNES_METEORITES)
+    """
+    # 1. Traitons les météorites
+    # On supprime les colonnes qui ne nous serviront pas
+    meteorites = meteorites.drop(columns=['id'])
+    meteorites = meteorites.drop(columns=['nametype'])
+    # On supprime les valeurs d'années aberrantes
+    meteorites = meteorites[meteorites['year'] < 2021]
+    # Ainsi que les années précédent 1800 car trop peu de données avant cette date
+    meteorites = meteorites[meteorites['year'] > 1800]
+    # On supprime les météorites observées non retrouvées
+    meteorites = meteorites[meteorites['fall'] == 'Found']
+    meteorites = meteorites.drop(columns=['fall'])
+    # On supprime les lignes ne possédant pas de Geolocalisation
+    return meteorites[meteorites['GeoLocation'].notna()].reset_index(drop=True)
+
+
+@timed_stage('read_meteorites')
+def read_meteorites(dossier=None):
+    """
+    Lit et nettoie meteorite-landings.csv en une seule passe
+
+    Le fichier est lu par le lecteur .csv d'Arrow (sur plusieurs threads, sans
+    bloquer les autres lectures) : seules les colonnes utiles sont converties,
+    et les filtres de clean_meteorites sont appliqués avant de passer à pandas.
+
+    Args:
+        dossier : dossier des données (DOSSIER_DONNEES par défaut)
+
+    Returns:
+        read_meteorites(dossier) : pd.DataFrame, identique à
+        clean_meteorites(pd.read_csv(...))
+    """
+    types = {nom: pa.string() for nom in ('name', 'recclass', 'GeoLocation', 'fall')}
+    types.update({nom: pa.float64() for nom in ('mass', 'year', 'reclat', 'reclong')})
+    table = pa_csv.read_csv(
+        chemin_source('meteorites', dossier),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=COLONNES_METEORITES + ['fall'],
+            column_types=types,
+            # Comme pandas : une cellule vide est une valeur manquante
+            strings_can_be_null=True,
+        ),
+    )
+    # Les mêmes filtres que clean_meteorites ; une comparaison avec une valeur
+    # manquante donne null, et la ligne est écartée comme avec pandas
+    annee = table['year']
+    garder = pc.and_(
+        pc.and_(pc.less(annee, 2021), pc.greater(annee, 1800)),
+        pc.and_(pc.equal(table['fall'], 'Found'), pc.is_valid(table['GeoLocation'])),
+    )
+    table = table.filter(garder).select(COLONNES_METEORITES)
+    return table.to_pandas()
+
+
+def load_city_index(dossier=None, mode=None):
+    """
+    Charge l'index des villes du mode de géocodage
+
+    Args:
+        dossier : dossier des données (DOSSIER_DONNEES par défaut)
+        mode : méthode de géocodage, 'coordonnees' ou 'nom' (MODE_GEOCODAGE par défaut)
+
+    Returns:
+        load_city_index(dossier, mode) : ReverseGeocoder en mode 'coordonnees',
+        CityNameStore en mode 'nom'
+    """
+    mode = mode or MODE_GEOCODAGE
+    chargement = load_geocoder if mode == 'coordonnees' else load_name_store
+    return chargement(chemin_source('cities', dossier), DOSSIER_CACHE)
+
+
+@timed_stage('geocode')
+def locate_meteorites(meteorites, dossier=None, mode=None, geocoder=None):
+    """
+    Ajoute à chaque météorite sa ville et le code de son pays
+
+    Args:
+        meteorites : résultat de clean_meteorites
+        dossier : dossier des données (DOSSIER_DONNEES par défaut)
+        mode : méthode de géocodage, 'coordonnees' ou 'nom' (MODE_GEOCODAGE par défaut)
+        geocoder : index des villes du mode déjà chargé (ReverseGeocoder en mode
+        'coordonnees', CityNameStore en mode 'nom'), sinon il est chargé ici
+
+    Returns:
+        locate_meteorites(meteorites, dossier, mode, geocoder) : pd.DataFrame
+        (colonnes de meteorites, City, code_2)
+    """
+    mode = mode or MODE_GEOCODAGE
+    if mode not in ('coordonnees', 'nom'):
+        raise ValueError('Mode de géocodage inconnu : %r' % mode)
+
+    # 2. Traitons les villes
+    if mode == 'coordonnees':
+        # Ville la plus proche du lieu d'impact, via l'index spatial des villes
+        if geocoder is None:
+            geocoder = load_city_index(dossier, mode)
+        villes = geocoder.query(meteorites['reclat'], meteorites['reclong'])
+        villes = villes[['City', 'code_2']]
+    else:
+        # Ville portant le nom normalisé de la météorite (sans accents, puis sans
+        # numéro), la plus proche du lieu d'impact, parmi les villes du magasin
+        # portant l'un des noms cherchés
+        if geocoder is None:
+            geocoder = load_city_index(dossier, mode)
+        villes = geocoder.match(meteorites['name'], meteorites['reclat'], meteorites['reclong'])
+        taux = match_rates(villes)
+        logger.info(
+            'Noms : %d exacts, %d normalisés, %d sans numéro, %d sans ville (%.1f %% associés)',
+            taux['exact'], taux['normalized'], taux['designation'], taux['unmatched'],
+            100 * taux['match_rate']
+        )
+        villes = villes[['City', 'code_2']]
+
+    ###################################
+    ##### 4. Merge des dataframes #####
+    ###################################
+
+    # On ajoute à chaque météorite sa ville et le code de son pays
+    newDf = meteorites.join(villes)
+    logger.info(
+        'Géocodage (%s) : %d météorites sur %d associées à une ville',
+        mode, newDf['City'].notna().sum(), len(newDf)
+    )
+
+    # On met toute la colonne code de newDf en majuscule comme dans continents afin de merger
+    newDf['code_2'] = newDf['code_2'].str.upper()
+    return newDf
+
+
+@timed_stage('merge_continents')
+def merge_continents(newDf, continents):
+    """
+    Ajoute à chaque météorite son pays, son continent et sa classification
+
+    Args:
+        newDf : résultat de locate_meteorites
+        continents : résultat de read_continents
+
+    Returns:
+        merge_continents(newDf, continents) : pd.DataFrame au format de maindf,
+        avant compact_dtypes
+    """
+    # On peut enfin merger notre df principal avec celle des continents en fonction de code_2
+    maindf = pd.merge(newDf, continents, on=['code_2'], how='left')
+
+    # On remplace les Nans qui sont apparus
+    maindf['City'] = maindf['City'].fillna('Unknown')
+    maindf['code_2'] = maindf['code_2'].fillna('XX')
+    maindf['country'] = maindf['country'].fillna('Unknown')
+    maindf['continent'] = maindf['continent'].fillna('Unknown')
+
+    ####################################################
+    ##### 5. Création de données dataframes utiles #####
+    ####################################################
+
+    # On ajoute à chaque météorite son groupe (rocheuse, ferreuse, mixte)
+    # et son sous-groupe, d'après la table de classification.py
+    return maindf.join(classify(maindf['recclass']))
+
+
+def process_meteorites(meteorites, continents, dossier=None, mode=None, geocoder=None):
+    """
+    Nettoie des lignes de meteorite-landings.csv et leur ajoute ville, pays,
+    continent et classification
+
+    Les lignes sont traitées indépendamment les unes des autres : on s'en sert
+    pour les lots de nouvelles météorites (ingest.py).
+
+    Args:
+        meteorites : lignes au format de meteorite-landings.csv
+        continents : résultat de read_continents
+        dossier : dossier des données (DOSSIER_DONNEES par défaut)
+        mode : méthode de géocodage, 'coordonnees' ou 'nom' (MODE_GEOCODAGE par défaut)
+        geocoder : index des villes du mode déjà chargé (load_city_index),
+        sinon il est chargé ici
+
+    Returns:
+        process_meteorites(meteorites, continents, dossier, mode, geocoder) :
+        pd.DataFrame au format de maindf, avant compact_dtypes
+    """
+    newDf = locate_meteorites(clean_meteorites(meteorites), dossier, mode, geocoder)
+    return merge_continents(newDf, continents)
+
+
+@timed_stage('build_frames')
+def build_frames(dossier=None, mode=None):
+    """
+    Exécute tout le traitement des données à partir des fichiers .csv
+
+    Les trois fichiers sont indépendants jusqu'aux merges : ils sont lus en
+    même temps, et chaque merge commence dès que ses deux entrées sont prêtes.
+    La durée totale est alors proche de celle de la lecture la plus longue.
+
+    Args:
+        dossier : dossier des données (DOSSIER_DONNEES par défaut)
+        mode : méthode de géocodage, 'coordonnees' ou 'nom' (MODE_GEOCODAGE par défaut)
+
+    Returns:
+        build_frames(dossier, mode) : dict nom -> pd.DataFrame (maindf)
+    """
+    mode = mode or MODE_GEOCODAGE
+    # On transforme les datasets originales téléchargés sur kaggle.com en des dataframes
+    with ThreadPoolExecutor(max_workers=3) as lecteurs:
+        # Notre dataframe de base, déjà nettoyée :
+        lecture_meteorites = lecteurs.submit(read_meteorites, dossier)
+        # lien : https://www.kaggle.com/nasa/meteorite-landings
+        # Pour ajouter les continents :
+        lecture_continents = lecteurs.submit(read_continents, dossier)
+        # lien : https://www.kaggle.com/statchaitya/country-to-continent
+        # Les villes : l'index du mode de géocodage (spatial ou par nom) ne dépend
+        # pas des météorites
+        # lien : https://www.kaggle.com/max-mind/world-cities-database?select=worldcitiespop.csv
+        lecture_villes = lecteurs.submit(load_city_index, dossier, mode)
+
+        newDf = locate_meteorites(
+            lecture_meteorites.result(), dossier, mode, lecture_villes.result()
+        )
+        maindf = merge_continents(newDf, lecture_continents.result())
+
+    # On range les météorites par groupe : les sous-dataframes stony, iron et
+    # stony_iron (derived_frames) sont alors des tranches de maindf, sans copie
+    maindf = sort_by_group(maindf)
+
+    # Types compacts : moins de mémoire par worker
+    compacte = compact_dtypes(maindf)
+    logger.info('Mémoire de maindf (octets) :\n%s', memory_report(maindf, compacte))
+
+    return {
+        'maindf': compacte,
+    }
+
+
+def concat_rows(morceaux, ignore_index=False):
+    """
+    Concatène des dataframes en conservant leurs colonnes catégorielles
+
+    pd.concat convertit en texte (object) une colonne catégorielle dont les
+    catégories diffèrent d'une dataframe à l'autre : on complète donc d'abord
+    les catégories, dans l'ordre où elles apparaissent (celles de la première
+    dataframe restent en tête, et gardent leur code).
+
+    Args:
+        morceaux : liste de dataframes, mêmes colonnes que la première
+        ignore_index : True pour numéroter les lignes du résultat 0..n-1
+
+    Returns:
+        concat_rows(morceaux, ignore_index) : nouvelle pd.DataFrame
+    """
+    colonnes = list(morceaux[0].columns)
+    morceaux = [
+        morceau if list(morceau.columns) == colonnes else morceau[colonnes]
+        for morceau in morceaux
+    ]
+    categorielles = {}
+    for colonne in colonnes:
+        if isinstance(morceaux[0][colonne].dtype, pd.CategoricalDtype):
+            categories = morceaux[0][colonne].cat.categories
+            for morceau in morceaux[1:]:
+                serie = morceau[colonne]
+                if isinstance(serie.dtype, pd.CategoricalDtype):
+                    valeurs = serie.cat.categories
+                else:
+                    valeurs = pd.Index(serie.dropna().astype(object).unique())
+                categories = categories.union(valeurs, sort=False)
+            categorielles[colonne] = pd.CategoricalDtype(categories)
+    # Seules les colonnes dont les catégories changent sont converties
+    return pd.concat(
+        [
+            morceau.astype({
+                colonne: type_colonne for colonne, type_colonne in categorielles.items()
+                if morceau[colonne].dtype != type_colonne
+            }) for morceau in morceaux
+        ],
+        sort=False, ignore_index=ignore_index,
+    )
+
+
+def append_rows(df, lignes):
+    """
+    Ajoute des lignes à une dataframe en conservant ses colonnes catégorielles
+
+    Args:
+        df : dataframe (par exemple maindf)
+        lignes : lignes à ajouter, mêmes colonnes
+
+    Returns:
+        append_rows(df, lignes) : nouvelle pd.DataFrame
+    """
+    return concat_rows([df, lignes])
+
+
+@timed_stage('derived_frames')
+def derived_frames(maindf):
+    """
+    Crée les sous-dataframes et les agrégats utilisés par les figures
+    à partir de maindf
+
+    Args:
+        maindf : dataframe principale (avec sa colonne group)
+
+    Returns:
+        derived_frames(maindf) : dict nom -> pd.DataFrame
+        (stony, iron, stony_iron, cube, cube_min, mass_moy)
+    """
+    frames = {
+        # On créé un ensemble de données pour chaque type de météorite
+        # (des tranches de maindf si elle est rangée par groupe)
+        'stony': subset(maindf, 'stony'),
+        'iron': subset(maindf, 'iron'),
+        'stony_iron': subset(maindf, 'stony_iron'),
+    }
+    # Cubes année x continent x groupe, pour toutes les météorites
+    # et pour celles de moins d'une tonne (sans les énormes météorites) :
+    # seules les colonnes du cube de ces dernières sont recopiées
+    frames['cube'] = build_cube(maindf)
+    frames['cube_min'] = build_cube(
+        maindf.loc[maindf['mass'] < 1000000, DIMENSIONS_CUBE + ['mass']]
+    )
+    # Moyenne de la masse totale pour chaque année
+    frames['mass_moy'] = mean_mass_by_year(frames['cube'])
+    return frames
@@ -0,0 +1,106 @@
+"""
+Lancement du dashboard en production, avec plusieurs processus (workers).
+
+Le serveur de développement de `python main.py` ne traite qu'une requête à la
+fois. Ici, le dashboard est servi par gunicorn : le processus maître importe
+main.py (chargement des données, index, figures par défaut) une seule fois
+AVANT de créer les workers par fork. Les workers partagent alors ces données
+en mémoire (copy-on-write) au lieu d'en refaire chacun une copie.
+
+    $ python serve.py --workers 4 --threads 8
+
+Les réglages peuvent aussi venir des variables d'environnement
+DASHBOARD_BIND, DASHBOARD_WORKERS et DASHBOARD_THREADS. Un autre serveur
+WSGI peut utiliser directement l'application `serve:server`.
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import argparse
+import gc
+import logging
+import multiprocessing
+import os
+
+from gunicorn.app.base import BaseApplication
+
+import main
+
+logger = logging.getLogger(__name__)
+
+# Application WSGI du dashboard
+server = main.server
+
+# Les figures affichées au chargement de la page sont construites dans le maître
+main.warm_up()
+
+# On range tous les objets déjà créés dans une génération que le ramasse-miettes
+# ne parcourt plus : sinon son passage dans chaque worker écrirait dans les pages
+# mémoire partagées et les ferait recopier
+gc.freeze()
+
+
+class DashboardApplication(BaseApplication):
+    """
+    Application gunicorn servant le dashboard, chargée avant le fork des workers
+    """
+
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for cle, valeur in self.options.items():
+            self.cfg.set(cle, valeur)
+
+    def load(self):
+        return server
+
+
+def parse_args(args=None):
+    """
+    Lit les options de la ligne de commande
+
+    Args:
+        args : liste des arguments (sys.argv par défaut)
+
+    Returns:
+        parse_args(args) : argparse.Namespace (bind, workers, threads, timeout)
+    """
+    parser = argparse.ArgumentParser(description='Dashboard météorites en production')
+    parser.add_argument(
+        '--bind', default=os.environ.get('DASHBOARD_BIND', '0.0.0.0:8050'),
+        help='adresse:port d\'écoute (défaut : 0.0.0.0:8050)'
+    )
+    parser.add_argument(
+        '--workers', type=int,
+        default=int(os.environ.get('DASHBOARD_WORKERS', multiprocessing.cpu_count())),
+        help='nombre de processus (défaut : nombre de cœurs)'
+    )
+    parser.add_argument(
+        '--threads', type=int, default=int(os.environ.get('DASHBOARD_THREADS', 4)),
+        help='nombre de threads par processus (défaut : 4)'
+    )
+    parser.add_argument(
+        '--timeout', type=int, default=60,
+        help='délai en secondes avant de relancer un worker bloqué (défaut : 60)'
+    )
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    arguments = parse_args()
+    logger.info(
+        'Dashboard sur %s : %d workers x %d threads',
+        arguments.bind, arguments.workers, arguments.threads
+    )
+    DashboardApplication({
+        'bind': arguments.bind,
+        'workers': arguments.workers,
+        'threads': arguments.threads,
+        'worker_class': 'gthread',
+        'timeout': arguments.timeout,
+        # main.py est déjà importé : les workers sont créés par fork de ce processus
+        'preload_app': True,
+    }).run()
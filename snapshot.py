@@ -0,0 +1,236 @@
+"""
+Instantané colonne (Feather v2 / Arrow IPC) des dataframes du dashboard.
+
+Le traitement de pipeline.py relit environ 170 Mo de .csv : on l'exécute une
+seule fois, on écrit le résultat dans un dossier versionné par l'empreinte des
+fichiers sources, puis chaque démarrage du serveur se contente de relire ces
+fichiers. L'instantané n'est reconstruit que si une source change.
+
+Les fichiers sont lus par projection en mémoire (memory map), mais la
+conversion en dataframes pandas copie les colonnes : les noms deviennent des
+objets Python et les colonnes numériques sont recopiées. À l'échelle 10 du
+banc d'essai (250 000 météorites, fichier de 14 Mo), la lecture ajoute environ
+90 Mo à la mémoire du processus, dont 38 Mo de dataframe.
+
+Construction manuelle de l'instantané :
+
+    $ python snapshot.py
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import pyarrow.feather as feather
+
+import pipeline
+from instrumentation import timed_stage
+
+logger = logging.getLogger(__name__)
+
+# Version du format de l'instantané : à incrémenter dès que le traitement
+# de pipeline.py produit des données différentes pour les mêmes sources
+VERSION_FORMAT = 7
+
+# Dossier où sont rangés les instantanés
+DOSSIER_SNAPSHOT = pipeline.DOSSIER_CACHE
+
+# Mémo des empreintes des sources, indexé par (taille, date de modification)
+# afin de ne pas relire les 170 Mo de .csv à chaque démarrage
+FICHIER_EMPREINTES = 'empreintes.json'
+
+
+def _empreinte_fichier(chemin, memo):
+    """
+    Retourne le sha256 d'un fichier, en réutilisant le mémo si le fichier
+    n'a changé ni de taille ni de date de modification
+
+    Args:
+        chemin : chemin du fichier
+        memo : dict chemin -> {'taille', 'mtime', 'sha256'}, mis à jour
+
+    Returns:
+        _empreinte_fichier(chemin, memo) : str
+    """
+    infos = os.stat(chemin)
+    connu = memo.get(chemin)
+    if connu and connu['taille'] == infos.st_size and connu['mtime'] == infos.st_mtime_ns:
+        return connu['sha256']
+    sha = hashlib.sha256()
+    with open(chemin, 'rb') as fichier:
+        for bloc in iter(lambda: fichier.read(1 << 20), b''):
+            sha.update(bloc)
+    memo[chemin] = {'taille': infos.st_size, 'mtime': infos.st_mtime_ns, 'sha256': sha.hexdigest()}
+    return memo[chemin]['sha256']
+
+
+def _ecrire_atomique(chemin, contenu):
+    """
+    Écrit un fichier via un fichier temporaire renommé, afin qu'un lecteur
+    ne voie jamais un fichier à moitié écrit
+
+    Args:
+        chemin : chemin de destination
+        contenu : bytes
+    """
+    temporaire = '%s.%d.tmp' % (chemin, os.getpid())
+    with open(temporaire, 'wb') as fichier:
+        fichier.write(contenu)
+    os.replace(temporaire, chemin)
+
+
+def source_version(dossier=None):
+    """
+    Retourne la version des données : empreinte combinée des .csv sources,
+    de VERSION_FORMAT et du mode de géocodage
+
+    Args:
+        dossier : dossier des données (pipeline.DOSSIER_DONNEES par défaut)
+
+    Returns:
+        source_version(dossier) : str (16 caractères hexadécimaux)
+    """
+    os.makedirs(DOSSIER_SNAPSHOT, exist_ok=True)
+    chemin_memo = os.path.join(DOSSIER_SNAPSHOT, FICHIER_EMPREINTES)
+    try:
+        with open(chemin_memo, encoding='utf8') as fichier:
+            memo = json.load(fichier)
+    except (OSError, ValueError):
+        memo = {}
+    avant = dict(memo)
+
+    sha = hashlib.sha256(('format-%d-%s' % (VERSION_FORMAT, pipeline.MODE_GEOCODAGE)).encode())
+    for nom in pipeline.SOURCES:
+        chemin = os.path.abspath(pipeline.chemin_source(nom, dossier))
+        sha.update(nom.encode())
+        sha.update(_empreinte_fichier(chemin, memo).encode())
+
+    if memo != avant:
+        _ecrire_atomique(chemin_memo, json.dumps(memo, indent=1).encode('utf8'))
+    return sha.hexdigest()[:16]
+
+
+def snapshot_dir(version):
+    """
+    Retourne le dossier de l'instantané d'une version
+
+    Args:
+        version : version des données (source_version)
+
+    Returns:
+        snapshot_dir(version) : str
+    """
+    return os.path.join(DOSSIER_SNAPSHOT, 'v' + version)
+
+
+@timed_stage('write_snapshot')
+def write_snapshot(frames, version):
+    """
+    Écrit chaque dataframe dans un fichier Feather v2 non compressé (lu sans
+    décompression, par projection en mémoire), dans le dossier de la version
+
+    Le dossier est d'abord écrit sous un nom temporaire puis renommé :
+    un autre processus ne voit donc jamais d'instantané incomplet.
+
+    Args:
+        frames : dict nom -> pd.DataFrame
+        version : version des données (source_version)
+
+    Returns:
+        write_snapshot(frames, version) : chemin du dossier écrit
+    """
+    cible = snapshot_dir(version)
+    temporaire = '%s.%d.tmp' % (cible, os.getpid())
+    os.makedirs(temporaire, exist_ok=True)
+    for nom, df in frames.items():
+        feather.write_feather(
+            df, os.path.join(temporaire, nom + '.feather'), compression='uncompressed'
+        )
+    try:
+        os.rename(temporaire, cible)
+    except OSError:
+        # Un autre processus a publié la même version entre-temps
+        shutil.rmtree(temporaire, ignore_errors=True)
+    return cible
+
+
+@timed_stage('read_snapshot')
+def read_snapshot(version):
+    """
+    Lit les dataframes d'une version
+
+    Chaque colonne Arrow est libérée dès sa conversion (self_destruct) et les
+    colonnes ne sont pas regroupées en blocs (split_blocks) : la table Arrow et
+    la dataframe ne coexistent pas en entier et pandas ne fait pas de copie
+    supplémentaire pour consolider ses blocs.
+
+    Args:
+        version : version des données (source_version)
+
+    Returns:
+        read_snapshot(version) : dict nom -> pd.DataFrame,
+        ou None si cette version n'a pas encore été construite
+    """
+    dossier = snapshot_dir(version)
+    if not os.path.isdir(dossier):
+        return None
+    frames = {}
+    for fichier in sorted(os.listdir(dossier)):
+        nom, extension = os.path.splitext(fichier)
+        if extension == '.feather':
+            table = feather.read_table(os.path.join(dossier, fichier), memory_map=True)
+            frames[nom] = table.to_pandas(split_blocks=True, self_destruct=True)
+            del table
+    return frames
+
+
+def _purger(version):
+    """
+    Supprime les instantanés des versions précédentes
+
+    Args:
+        version : version à conserver
+    """
+    garder = os.path.basename(snapshot_dir(version))
+    for nom in os.listdir(DOSSIER_SNAPSHOT):
+        chemin = os.path.join(DOSSIER_SNAPSHOT, nom)
+        if nom != garder and nom.startswith('v') and os.path.isdir(chemin):
+            shutil.rmtree(chemin, ignore_errors=True)
+
+
+@timed_stage('load_frames')
+def load_frames(dossier=None):
+    """
+    Retourne les dataframes du dashboard depuis l'instantané à jour,
+    en le (re)construisant si une source a changé
+
+    Seule maindf est enregistrée : les sous-dataframes par groupe sont
+    recréées à la lecture par simple comparaison de codes, et les agrégats
+    à partir de maindf.
+
+    Args:
+        dossier : dossier des données (pipeline.DOSSIER_DONNEES par défaut)
+
+    Returns:
+        load_frames(dossier) : dict nom -> pd.DataFrame
+        (maindf et celles de pipeline.derived_frames)
+    """
+    version = source_version(dossier)
+    frames = read_snapshot(version)
+    if frames is None:
+        logger.info('Instantané %s absent : traitement des .csv', version)
+        frames = pipeline.build_frames(dossier)
+        write_snapshot(frames, version)
+        _purger(version)
+    frames.update(pipeline.derived_frames(frames['maindf']))
+    return frames
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    load_frames()
+    print('Instantané à jour :', snapshot_dir(source_version()))
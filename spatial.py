@@ -0,0 +1,381 @@
+"""
+Recherche des météorites autour d'un lieu : les k plus proches, toutes
+celles situées dans un rayon, ou dans un rectangle de latitudes et longitudes.
+
+Les lieux d'impact (reclat, reclong) de maindf sont rangés dans deux KD-trees,
+construits une fois par version des données : l'un sur la sphère unité (comme
+les villes de geocoder.py) pour les distances orthodromiques, l'autre dans le
+plan (latitude, longitude) pour les rectangles. Chaque recherche coûte donc
+un temps logarithmique, plus le nombre de météorites retournées. Les lots de
+nouvelles météorites (ingest.py) ne reconstruisent pas les KD-trees : leurs
+points sont parcourus à part, jusqu'à PART_MAX_AJOUTS des points indexés.
+
+Routes JSON (voir add_query_routes) :
+
+    /api/impacts/nearest?lat=45.76&lon=4.84&k=10
+    /api/impacts/radius?lat=45.76&lon=4.84&radius_km=100
+    /api/impacts/bbox?south=40&west=-5&north=52&east=10
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import json
+import math
+
+import flask
+import numpy as np
+from plotly.utils import PlotlyJSONEncoder
+from scipy.spatial import cKDTree
+
+from geocoder import RAYON_TERRE_KM, chord_to_km, to_unit_sphere
+
+# Nombre maximal de météorites retournées par une recherche
+LIMITE_RESULTATS = 1000
+
+# Nombre de voisins retournés par défaut
+K_DEFAUT = 10
+
+# Rayon maximal d'une recherche : la moitié de la circonférence terrestre
+RAYON_MAX_KM = np.pi * RAYON_TERRE_KM
+
+# Les lieux d'impact ajoutés par lots (ImpactIndex.insert) restent hors des
+# KD-trees et sont comparés un par un à chaque recherche, tant qu'ils ne
+# dépassent pas cette part des points des KD-trees ; au-delà, ceux-ci sont
+# reconstruits avec tous les points
+PART_MAX_AJOUTS = 0.1
+
+# Colonnes de maindf retournées pour chaque météorite (avec distance_km)
+COLONNES_RESULTAT = [
+    'name', 'recclass', 'group', 'mass', 'year', 'reclat', 'reclong', 'City', 'country'
+]
+
+
+def km_to_chord(distance_km):
+    """
+    Convertit une distance orthodromique en kilomètres en distance
+    euclidienne sur la sphère unité (inverse de geocoder.chord_to_km)
+
+    Args:
+        distance_km : distance en kilomètres
+
+    Returns:
+        km_to_chord(distance_km) : float
+    """
+    return 2.0 * np.sin(min(distance_km, RAYON_MAX_KM) / (2.0 * RAYON_TERRE_KM))
+
+
+class ImpactIndex:
+    """
+    Index spatial des lieux d'impact d'une dataframe de météorites
+
+    Les météorites sans coordonnées ne sont pas indexées. Les points ajoutés
+    depuis la construction des KD-trees (insert) sont à la fin de lignes et
+    des tableaux de points, et sont parcourus un par un.
+
+    Attributs :
+        df : météorites indexées
+        lignes : position dans df de chaque point de l'index
+        sphere : cKDTree des lieux d'impact sur la sphère unité
+        plan : cKDTree des lieux d'impact en (latitude, longitude)
+    """
+
+    def __init__(self, df):
+        lat, lon, valides = self._coordonnees(df)
+        self.df = df
+        self.lignes = np.flatnonzero(valides)
+        self._points_sphere = to_unit_sphere(lat[valides], lon[valides])
+        self._points_plan = np.column_stack((lat[valides], lon[valides]))
+        self.sphere = cKDTree(self._points_sphere)
+        self.plan = cKDTree(self._points_plan)
+
+    def __len__(self):
+        return len(self.lignes)
+
+    @staticmethod
+    def _coordonnees(df):
+        """
+        Retourne les coordonnées des météorites d'une dataframe
+
+        Args:
+            df : météorites (reclat, reclong)
+
+        Returns:
+            _coordonnees(df) : (latitudes, longitudes, masque des coordonnées connues)
+        """
+        lat = df['reclat'].to_numpy(dtype=np.float64, na_value=np.nan)
+        lon = df['reclong'].to_numpy(dtype=np.float64, na_value=np.nan)
+        return lat, lon, np.isfinite(lat) & np.isfinite(lon)
+
+    def _ajouts(self):
+        """
+        Retourne les positions (dans l'index) des points hors des KD-trees
+
+        Returns:
+            _ajouts() : np.ndarray
+        """
+        return np.arange(self.sphere.n, len(self), dtype=np.intp)
+
+    def insert(self, df, lignes, positions, renumerotation=None):
+        """
+        Retourne l'index complété par de nouvelles météorites
+
+        Les KD-trees sont partagés avec l'index d'origine (qui n'est pas modifié) :
+        seuls les nouveaux points sont ajoutés à la liste parcourue un par un,
+        sauf s'ils deviennent trop nombreux (PART_MAX_AJOUTS), auquel cas
+        tout l'index est reconstruit.
+
+        Args:
+            df : dataframe complétée
+            lignes : nouvelles météorites (reclat, reclong)
+            positions : position de chacune dans df
+            renumerotation : fonction donnant la nouvelle position des lignes
+            existantes (None si elles n'ont pas bougé)
+
+        Returns:
+            insert(df, lignes, positions, renumerotation) : ImpactIndex
+        """
+        lat, lon, valides = self._coordonnees(lignes)
+        if len(self) + valides.sum() - self.sphere.n > PART_MAX_AJOUTS * self.sphere.n:
+            return ImpactIndex(df)
+        index = ImpactIndex.__new__(ImpactIndex)
+        index.df = df
+        anciennes = self.lignes if renumerotation is None else renumerotation(self.lignes)
+        index.lignes = np.concatenate([anciennes, np.asarray(positions)[valides]])
+        index._points_sphere = np.vstack(
+            [self._points_sphere, to_unit_sphere(lat[valides], lon[valides])]
+        )
+        index._points_plan = np.vstack(
+            [self._points_plan, np.column_stack((lat[valides], lon[valides]))]
+        )
+        index.sphere, index.plan = self.sphere, self.plan
+        return index
+
+    def _results(self, points, lat, lon, limite):
+        """
+        Retourne les météorites de points de l'index, triées par distance
+        à (lat, lon)
+
+        Args:
+            points : positions dans l'index
+            lat : latitude du lieu de référence
+            lon : longitude du lieu de référence
+            limite : nombre maximal de météorites retournées
+
+        Returns:
+            _results(points, lat, lon, limite) : pd.DataFrame (COLONNES_RESULTAT,
+            distance_km)
+        """
+        points = np.asarray(points, dtype=np.intp)
+        corde = np.linalg.norm(self._points_sphere[points] - to_unit_sphere([lat], [lon]), axis=1)
+        ordre = np.argsort(corde, kind='stable')[:limite]
+        resultats = self.df.iloc[self.lignes[points[ordre]]][COLONNES_RESULTAT].copy()
+        resultats['distance_km'] = chord_to_km(corde[ordre])
+        return resultats
+
+    def nearest(self, lat, lon, k=K_DEFAUT):
+        """
+        Retourne les k météorites les plus proches d'un lieu
+
+        Args:
+            lat : latitude du lieu
+            lon : longitude du lieu
+            k : nombre de météorites
+
+        Returns:
+            nearest(lat, lon, k) : pd.DataFrame (COLONNES_RESULTAT, distance_km),
+            de la plus proche à la plus lointaine
+        """
+        k = min(k, len(self))
+        if k == 0:
+            return self._results([], lat, lon, 0)
+        # Les k plus proches des KD-trees, départagés avec les points ajoutés
+        points = self._ajouts()
+        if self.sphere.n:
+            _, arbre = self.sphere.query(to_unit_sphere([lat], [lon])[0], k=min(k, self.sphere.n))
+            points = np.concatenate([np.atleast_1d(arbre), points])
+        return self._results(points, lat, lon, k)
+
+    def within_radius(self, lat, lon, rayon_km, limite=LIMITE_RESULTATS):
+        """
+        Retourne les météorites situées à moins d'une distance d'un lieu
+
+        Args:
+            lat : latitude du lieu
+            lon : longitude du lieu
+            rayon_km : distance orthodromique maximale, en kilomètres
+            limite : nombre maximal de météorites retournées (les plus proches)
+
+        Returns:
+            within_radius(lat, lon, rayon_km, limite) : (pd.DataFrame (COLONNES_RESULTAT,
+            distance_km) de la plus proche à la plus lointaine, nombre total de
+            météorites dans le rayon)
+        """
+        centre, corde = to_unit_sphere([lat], [lon])[0], km_to_chord(rayon_km)
+        ajouts = self._ajouts()
+        points = np.concatenate([
+            np.asarray(self.sphere.query_ball_point(centre, corde), dtype=np.intp),
+            ajouts[np.linalg.norm(self._points_sphere[ajouts] - centre, axis=1) <= corde],
+        ])
+        return self._results(points, lat, lon, limite), len(points)
+
+    def within_bbox(self, sud, ouest, nord, est, limite=LIMITE_RESULTATS):
+        """
+        Retourne les météorites situées dans un rectangle de latitudes et longitudes
+
+        Un rectangle dont l'ouest est plus grand que l'est traverse
+        l'antiméridien (par exemple ouest=170, est=-170).
+
+        Args:
+            sud, nord : latitudes des bords du rectangle
+            ouest, est : longitudes des bords du rectangle
+            limite : nombre maximal de météorites retournées (les plus proches du centre)
+
+        Returns:
+            within_bbox(sud, ouest, nord, est, limite) : (pd.DataFrame (COLONNES_RESULTAT,
+            distance_km au centre du rectangle), nombre total de météorites
+            dans le rectangle)
+        """
+        if ouest <= est:
+            rectangles = [(ouest, est)]
+            centre_lon = (ouest + est) / 2.0
+        else:
+            rectangles = [(ouest, 180.0), (-180.0, est)]
+            centre_lon = (ouest + est + 360.0) / 2.0
+            centre_lon = centre_lon - 360.0 if centre_lon > 180.0 else centre_lon
+        points = []
+        for gauche, droite in rectangles:
+            # Le carré (norme infinie) englobant le rectangle, puis le rectangle exact
+            centre = [(sud + nord) / 2.0, (gauche + droite) / 2.0]
+            demi_cote = max(nord - sud, droite - gauche) / 2.0
+            candidats = np.concatenate([
+                np.asarray(self.plan.query_ball_point(centre, demi_cote, p=np.inf), dtype=np.intp),
+                self._ajouts(),
+            ])
+            lat, lon = self._points_plan[candidats, 0], self._points_plan[candidats, 1]
+            dedans = (lat >= sud) & (lat <= nord) & (lon >= gauche) & (lon <= droite)
+            points.append(candidats[dedans])
+        points = np.unique(np.concatenate(points))
+        return self._results(points, (sud + nord) / 2.0, centre_lon, limite), len(points)
+
+
+def to_records(resultats):
+    """
+    Convertit des résultats de recherche en liste de dict sérialisables
+    (NaN -> None, coordonnées arrondies comme dans figures.geo_data)
+
+    Args:
+        resultats : pd.DataFrame d'une recherche de ImpactIndex
+
+    Returns:
+        to_records(resultats) : liste de dict
+    """
+    colonnes = {}
+    for nom, serie in resultats.items():
+        if nom in ('reclat', 'reclong', 'distance_km'):
+            serie = serie.astype('float64').round(4 if nom != 'distance_km' else 3)
+        colonnes[nom] = serie.astype(object).where(serie.notna(), None).tolist()
+    return [dict(zip(colonnes, valeurs)) for valeurs in zip(*colonnes.values())]
+
+
+def query_parameter(nom, minimum=None, maximum=None, defaut=None, type_valeur=float):
+    """
+    Lit un paramètre numérique de la requête courante
+
+    Args:
+        nom : nom du paramètre
+        minimum, maximum : bornes acceptées
+        defaut : valeur si le paramètre est absent (obligatoire si None)
+        type_valeur : float ou int
+
+    Returns:
+        query_parameter(nom, minimum, maximum, defaut, type_valeur) : valeur
+
+    Raises:
+        ValueError : paramètre absent, invalide ou hors des bornes
+    """
+    brut = flask.request.args.get(nom)
+    if brut is None:
+        if defaut is None:
+            raise ValueError('paramètre %s manquant' % nom)
+        return defaut
+    try:
+        valeur = type_valeur(brut)
+        # Un entier trop grand pour un float (ou pour numpy) lève OverflowError
+        if not math.isfinite(float(valeur)):
+            raise ValueError
+    except (ValueError, TypeError, OverflowError):
+        raise ValueError('paramètre %s invalide : %r' % (nom, brut)) from None
+    if (minimum is not None and valeur < minimum) \
+            or (maximum is not None and valeur > maximum):
+        raise ValueError('paramètre %s hors de [%s, %s] : %r' % (nom, minimum, maximum, brut))
+    return valeur
+
+
+def json_response(contenu, statut=200):
+    """
+    Retourne une réponse JSON (types numpy et NaN acceptés, comme dans Dash)
+
+    Args:
+        contenu : objet sérialisable
+        statut : code HTTP
+
+    Returns:
+        json_response(contenu, statut) : flask.Response
+    """
+    return flask.Response(
+        json.dumps(contenu, cls=PlotlyJSONEncoder), status=statut, mimetype='application/json'
+    )
+
+
+def add_query_routes(server, index):
+    """
+    Ajoute au serveur Flask les routes de recherche /api/impacts/...
+
+    Chaque réponse contient count (météorites retournées), total
+    (météorites trouvées, au plus LIMITE_RESULTATS sont retournées)
+    et meteorites (liste de dict). Un paramètre invalide donne une erreur 400.
+
+    Args:
+        server : flask.Flask
+        index : fonction sans argument retournant l'ImpactIndex courant
+    """
+    def repondre(recherche):
+        try:
+            resultats, total = recherche(index())
+        except ValueError as erreur:
+            return json_response({'error': str(erreur)}, 400)
+        return json_response({
+            'count': len(resultats), 'total': total, 'meteorites': to_records(resultats)
+        })
+
+    def lieu():
+        return query_parameter('lat', -90, 90), query_parameter('lon', -180, 180)
+
+    def limite():
+        return query_parameter('limit', 1, LIMITE_RESULTATS, LIMITE_RESULTATS, int)
+
+    @server.route('/api/impacts/nearest')
+    def impacts_nearest():
+        def recherche(idx):
+            k = query_parameter('k', 1, LIMITE_RESULTATS, K_DEFAUT, int)
+            resultats = idx.nearest(*lieu(), k)
+            return resultats, len(resultats)
+        return repondre(recherche)
+
+    @server.route('/api/impacts/radius')
+    def impacts_radius():
+        return repondre(lambda idx: idx.within_radius(
+            *lieu(), query_parameter('radius_km', 0, RAYON_MAX_KM), limite()
+        ))
+
+    @server.route('/api/impacts/bbox')
+    def impacts_bbox():
+        def recherche(idx):
+            sud, nord = query_parameter('south', -90, 90), query_parameter('north', -90, 90)
+            if sud > nord:
+                raise ValueError('south doit être inférieur à north')
+            return idx.within_bbox(
+                sud, query_parameter('west', -180, 180), nord, query_parameter('east', -180, 180),
+                limite()
+            )
+        return repondre(recherche)
@@ -0,0 +1,10 @@
+"""
+Configuration de pytest : les modules du dashboard sont à la racine du projet
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,148 @@
+"""
+Tests de aggregates.py, comparés à un filtrage naïf de la dataframe avec pandas
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregates import DIMENSIONS_CUBE, FilterIndex, build_cube, roll_up
+
+
+def meteorites(n=3000, graine=0):
+    """
+    Météorites aléatoires : masses répétées ou inconnues, continents
+    catégoriels dont un jamais utilisé
+    """
+    rng = np.random.default_rng(graine)
+    masse = np.round(10 ** rng.uniform(-1, 8, n), 1)
+    masse[:50] = 1000.0
+    masse[50:60] = 10 ** 6
+    masse[rng.random(n) < 0.05] = np.nan
+    return pd.DataFrame({
+        'year': rng.integers(1801, 2021, n).astype(np.int16),
+        'mass': masse,
+        'continent': pd.Categorical(
+            rng.choice(['Africa', 'Americas', 'Asia', 'Unknown'], n),
+            categories=['Africa', 'Americas', 'Antarctica', 'Asia', 'Unknown'],
+        ),
+        'group': pd.Categorical(rng.choice(['stony', 'iron'], n), categories=['stony', 'iron']),
+    })
+
+
+def filtre_naif(df, annees, seuil):
+    """
+    Masque des lignes d'un intervalle d'années et sous un seuil de masse
+    """
+    masque = pd.Series(True, index=df.index)
+    if annees is not None:
+        masque &= df['year'].between(annees[0], annees[1])
+    if seuil is not None:
+        masque &= df['mass'] < seuil
+    return masque
+
+
+FILTRES = [
+    (None, None),
+    (None, 10 ** 6),
+    ((1900, 1950), None),
+    ((1900, 1950), 1000.0),
+    ((1700, 1810), 10 ** 3),
+    ((2019, 2030), 10 ** 8),
+    ((1960, 1950), None),
+    (None, 0),
+]
+
+
+@pytest.mark.parametrize('annees, seuil', FILTRES)
+def test_totals_matches_naive(annees, seuil):
+    df = meteorites()
+    obtenus = FilterIndex(df).totals(annees, seuil)
+
+    lignes = df[filtre_naif(df, annees, seuil)]
+    attendus = lignes.groupby(['year', 'continent'], observed=True).agg(
+        count=('mass', 'size'), mass=('mass', 'sum')
+    ).reset_index()
+    attendus = attendus[attendus['count'] > 0]
+    attendus['continent'] = attendus['continent'].astype(object)
+    attendus = attendus.sort_values(['year', 'continent'], ignore_index=True)
+
+    obtenus = obtenus.sort_values(['year', 'continent'], ignore_index=True)
+    # Les masses sont des différences de sommes cumulées : l'erreur d'arrondi
+    # est relative à la masse totale, pas à celle de chaque case
+    pd.testing.assert_frame_equal(
+        obtenus, attendus, check_dtype=False, check_exact=False,
+        rtol=1e-9, atol=1e-9 * np.nansum(df['mass'])
+    )
+
+
+@pytest.mark.parametrize('annees, seuil', FILTRES)
+def test_rows_matches_naive(annees, seuil):
+    df = meteorites(graine=1)
+    lignes = FilterIndex(df).rows(annees, seuil)
+    assert len(np.unique(lignes)) == len(lignes)
+    np.testing.assert_array_equal(np.sort(lignes), np.flatnonzero(filtre_naif(df, annees, seuil)))
+
+
+def test_rows_sorted_by_year_then_mass():
+    df = meteorites(graine=2)
+    lignes = df.iloc[FilterIndex(df).rows((1850, 1900), 10 ** 5)]
+    cles = list(zip(lignes['year'], lignes['mass']))
+    assert cles == sorted(cles)
+
+
+def test_empty_frame():
+    index = FilterIndex(meteorites().iloc[:0])
+    assert len(index.rows()) == 0
+    assert index.totals().empty
+
+
+def test_roll_up_matches_groupby():
+    df = meteorites(graine=3)
+    cube = build_cube(df)
+    assert cube['count'].sum() == len(df)
+    assert cube['mass_count'].sum() == df['mass'].notna().sum()
+
+    annees = roll_up(cube, ['year'])
+    attendues = df.groupby('year')['mass'].agg(['size', 'count', 'sum'])
+    np.testing.assert_array_equal(annees['year'], attendues.index)
+    np.testing.assert_array_equal(annees['count'], attendues['size'])
+    np.testing.assert_allclose(annees['mass'], attendues['sum'])
+    np.testing.assert_allclose(annees['mass_mean'], attendues['sum'] / attendues['count'])
+    assert list(roll_up(cube, DIMENSIONS_CUBE).columns) == list(cube.columns)
+
+
+@pytest.mark.parametrize('annees, seuil', FILTRES)
+def test_insert_matches_rebuild(annees, seuil):
+    df = meteorites(graine=4)
+    # Le lot apporte des années, des masses et un continent encore absents
+    lot = meteorites(400, graine=5)
+    lot.loc[:20, 'year'] = 1800
+    lot.loc[20:40, 'mass'] = 123456.789
+    lot['continent'] = lot['continent'].cat.add_categories(['Oceania'])
+    lot.loc[40:60, 'continent'] = 'Oceania'
+
+    # Les lignes du lot sont intercalées dans la dataframe complétée :
+    # le lot i est placé après la ligne i * 7 de df
+    complete = pd.concat([df, lot], ignore_index=True)
+    rang = np.concatenate([np.arange(len(df)) * 1.0, np.arange(len(lot)) * 7 + 0.5])
+    permutation = np.argsort(rang, kind='stable')
+    complete = complete.iloc[permutation].reset_index(drop=True)
+    nouvelle_position = np.argsort(permutation)
+
+    index = FilterIndex(df).insert(
+        lot, nouvelle_position[len(df):], lambda p: nouvelle_position[p]
+    )
+    reference = FilterIndex(complete)
+    assert list(index.years) == list(reference.years)
+    np.testing.assert_array_equal(
+        np.sort(index.rows(annees, seuil)), np.sort(reference.rows(annees, seuil))
+    )
+    cles = ['year', 'continent']
+    obtenus = index.totals(annees, seuil).sort_values(cles, ignore_index=True)
+    attendus = reference.totals(annees, seuil).sort_values(cles, ignore_index=True)
+    pd.testing.assert_frame_equal(
+        obtenus, attendus, check_exact=False, rtol=1e-9, atol=1e-9 * np.nansum(complete['mass'])
+    )
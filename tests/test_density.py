@@ -0,0 +1,130 @@
+"""
+Tests de density.py, comparés à un regroupement naïf des points cellule par cellule
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import density
+from density import VUE_DEFAUT, bin_points, cell_size, parse_viewport, visible
+
+
+def points(n=5000, graine=0):
+    """
+    Météorites aléatoires, dont certaines sur les bords de la carte
+    et sans masse connue
+    """
+    rng = np.random.default_rng(graine)
+    lat = rng.uniform(-90, 90, n)
+    lon = rng.uniform(-180, 180, n)
+    lat[:5], lon[:5] = [90, -90, 0, 45, 10], [180, -180, 180, 0, -0.0]
+    masse = 10 ** rng.uniform(0, 6, n)
+    masse[rng.random(n) < 0.1] = np.nan
+    return pd.DataFrame({'reclat': lat, 'reclong': lon, 'mass': masse})
+
+
+def cellules_naives(df, taille):
+    """
+    Dictionnaire (ligne, colonne) -> [somme lat, somme lon, nombre, masse],
+    rempli point par point
+    """
+    cellules = {}
+    for lat, lon, masse in df[['reclat', 'reclong', 'mass']].itertuples(index=False):
+        cle = (math.floor((lat + 90.0) / taille), math.floor((lon + 180.0) / taille))
+        cellule = cellules.setdefault(cle, [0.0, 0.0, 0, 0.0])
+        cellule[0] += lat
+        cellule[1] += lon
+        cellule[2] += 1
+        cellule[3] += 0.0 if np.isnan(masse) else masse
+    return cellules
+
+
+@pytest.mark.parametrize('taille', [45.0, 7.5, 360.0 / 64, 360.0 / 2 ** 10])
+def test_bin_points_matches_naive(taille):
+    df = points()
+    cellules = bin_points(df['reclat'], df['reclong'], df['mass'], taille)
+    attendues = cellules_naives(df, taille)
+
+    # Une ligne par cellule non vide, dans l'ordre des lignes puis des colonnes
+    assert len(cellules) == len(attendues)
+    attendues = [attendues[cle] for cle in sorted(attendues)]
+    np.testing.assert_array_equal(cellules['count'], [c[2] for c in attendues])
+    np.testing.assert_allclose(cellules['mass'], [c[3] for c in attendues], rtol=1e-12)
+    np.testing.assert_allclose(cellules['lat'], [c[0] / c[2] for c in attendues], atol=5e-4)
+    np.testing.assert_allclose(cellules['lon'], [c[1] / c[2] for c in attendues], atol=5e-4)
+    assert cellules['count'].sum() == len(df)
+
+
+def test_bin_points_empty():
+    cellules = bin_points([], [], [], 7.5)
+    assert cellules.empty
+    assert list(cellules.columns) == ['lat', 'lon', 'count', 'mass']
+
+
+@pytest.mark.parametrize('relayout, precedente, attendue', [
+    (None, None, VUE_DEFAUT),
+    ({}, {'lon': 10.0, 'lat': 5.0, 'scale': 4.0}, {'lon': 10.0, 'lat': 5.0, 'scale': 4.0}),
+    ({'geo.projection.scale': 2.5}, None, {'lon': 0.0, 'lat': 0.0, 'scale': 2.5}),
+    ({'geo.center.lon': '12', 'geo.center.lat': -3}, {'lon': 0.0, 'lat': 0.0, 'scale': 3.0},
+     {'lon': 12.0, 'lat': -3.0, 'scale': 3.0}),
+    ({'geo.projection.rotation.lon': 100}, None, {'lon': 100.0, 'lat': 0.0, 'scale': 1.0}),
+    ({'geo.projection.scale': 0.4}, None, {'lon': 0.0, 'lat': 0.0, 'scale': 1.0}),
+    ({'geo.center.lat': None}, {'lon': 1.0, 'lat': 2.0, 'scale': 2.0}, {'lon': 1.0, 'lat': 2.0, 'scale': 2.0}),
+    ({'autosize': True}, {'lon': 1.0, 'lat': 2.0, 'scale': 8.0}, VUE_DEFAUT),
+    ({'geo.fitbounds': 'locations', 'geo.projection.scale': 5},
+     {'lon': 1.0, 'lat': 2.0, 'scale': 8.0}, VUE_DEFAUT),
+])
+def test_parse_viewport(relayout, precedente, attendue):
+    copie = dict(precedente) if precedente else None
+    assert parse_viewport(relayout, precedente) == attendue
+    # La vue précédente n'est pas modifiée
+    assert precedente == copie
+
+
+@pytest.mark.parametrize('vue', [
+    {'lon': 0.0, 'lat': 0.0, 'scale': 1.0},
+    {'lon': 170.0, 'lat': 20.0, 'scale': 4.0},
+    {'lon': -175.0, 'lat': -60.0, 'scale': 3.0},
+    {'lon': 45.0, 'lat': 45.0, 'scale': 16.0},
+])
+def test_visible_matches_naive(vue):
+    df = points(graine=1)
+    demi_lon, demi_lat = 180.0 / vue['scale'], 90.0 / vue['scale']
+    attendu = []
+    for lat, lon in df[['reclat', 'reclong']].itertuples(index=False):
+        # Plus petit écart de longitude, en faisant le tour de la Terre si besoin
+        ecart = min(abs(lon - vue['lon']), 360.0 - abs(lon - vue['lon']))
+        attendu.append(ecart <= demi_lon and abs(lat - vue['lat']) <= demi_lat)
+    np.testing.assert_array_equal(visible(df['reclat'], df['reclong'], vue), attendu)
+
+
+@pytest.mark.parametrize('echelle', [1.0, 1.5, 2.0, 7.0, 100.0])
+def test_cell_size(echelle):
+    taille = cell_size({'lon': 0.0, 'lat': 0.0, 'scale': echelle})
+    # Une puissance de deux de la grille mondiale, la plus grande qui donne
+    # au moins CELLULES_PAR_VUE cellules sur la largeur visible
+    niveau = math.log2(360.0 / taille)
+    assert niveau == int(niveau)
+    assert 360.0 / echelle / taille >= density.CELLULES_PAR_VUE
+    assert 360.0 / echelle / (2 * taille) < density.CELLULES_PAR_VUE
+
+
+def test_density_switches_to_cells(monkeypatch):
+    df = points(graine=2)
+    vue = {'lon': 0.0, 'lat': 0.0, 'scale': 2.0}
+    dans_vue = visible(df['reclat'], df['reclong'], vue)
+
+    monkeypatch.setattr(density, 'MAX_MARQUEURS', int(dans_vue.sum()))
+    cellules, meteorites = density.density(df, vue)
+    assert cellules is None
+    pd.testing.assert_frame_equal(meteorites, df[dans_vue])
+
+    monkeypatch.setattr(density, 'MAX_MARQUEURS', int(dans_vue.sum()) - 1)
+    cellules, meteorites = density.density(df, vue)
+    assert meteorites is None
+    assert cellules['count'].sum() == dans_vue.sum()
@@ -0,0 +1,86 @@
+"""
+Tests de geocoder.py : requêtes comparées à un parcours complet des villes,
+et remplacement de l'index enregistré dans le cache
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import geocoder
+from geocoder import ReverseGeocoder, load_geocoder, to_unit_sphere
+
+
+def villes(n=500, graine=0):
+    """
+    Villes aléatoires au format de worldcitiespop.csv
+    """
+    rng = np.random.default_rng(graine)
+    return pd.DataFrame({
+        'Country': rng.choice(['fr', 'us', 'dz'], n),
+        'City': ['v%d' % i for i in range(n)],
+        'AccentCity': ['V%d' % i for i in range(n)],
+        'Region': 1,
+        'Population': np.nan,
+        'Latitude': rng.uniform(-80, 80, n).round(3),
+        'Longitude': rng.uniform(-180, 180, n).round(3),
+    })
+
+
+@pytest.fixture
+def chemin_villes(tmp_path):
+    chemin = tmp_path / 'worldcitiespop.csv'
+    villes().to_csv(chemin, index=False)
+    return str(chemin)
+
+
+def test_query_matches_brute_force(chemin_villes):
+    df = villes()
+    rng = np.random.default_rng(1)
+    lat, lon = rng.uniform(-80, 80, 200), rng.uniform(-180, 180, 200)
+    lat[:3] = np.nan
+    resultats = ReverseGeocoder.from_csv(chemin_villes, taille_bloc=64).query(lat, lon, 500.0)
+
+    points = to_unit_sphere(df['Latitude'].astype(np.float32), df['Longitude'].astype(np.float32))
+    for i, point in enumerate(to_unit_sphere(lat, lon)):
+        cordes = np.linalg.norm(points - point, axis=1)
+        distance = geocoder.chord_to_km(cordes.min())
+        if np.isnan(lat[i]) or distance > 500.0:
+            assert pd.isna(resultats['City'][i])
+            continue
+        assert resultats['City'][i] == df['AccentCity'][np.argmin(cordes)]
+        assert resultats['code_2'][i] == df['Country'][np.argmin(cordes)].upper()
+        assert resultats['distance_km'][i] == pytest.approx(distance, rel=1e-5)
+
+
+def test_load_geocoder_replaces_old_versions(chemin_villes, tmp_path, monkeypatch):
+    cache = str(tmp_path / 'cache')
+    os.makedirs(cache)
+    # Fichier temporaire d'un autre processus en cours d'écriture
+    temporaire = os.path.join(cache, 'geocoder-1-2.pkl.99999.tmp')
+    open(temporaire, 'wb').close()
+    load_geocoder(chemin_villes, cache)
+    premier = [f for f in os.listdir(cache) if not f.endswith('.tmp')]
+    assert len(premier) == 1
+
+    # Un autre processus retire l'ancienne version pendant le parcours du dossier
+    villes(300).to_csv(chemin_villes, index=False)
+    listdir = os.listdir
+
+    def listdir_concurrent(dossier):
+        noms = listdir(dossier)
+        os.remove(os.path.join(dossier, premier[0]))
+        return noms
+    monkeypatch.setattr(geocoder.os, 'listdir', listdir_concurrent)
+    index = load_geocoder(chemin_villes, cache)
+    monkeypatch.undo()
+
+    assert len(index.city) == 300
+    restants = set(os.listdir(cache))
+    assert premier[0] not in restants and os.path.basename(temporaire) in restants
+    (nouveau,) = restants - {os.path.basename(temporaire)}
+    assert len(ReverseGeocoder.load(os.path.join(cache, nouveau)).city) == 300
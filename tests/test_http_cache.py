@@ -0,0 +1,190 @@
+"""
+Tests de http_cache.py : la forme canonique des corps de callbacks est
+comparée à une sérialisation naïve, écrite comme celle du navigateur
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import gzip
+import json
+import random
+
+import flask
+import pytest
+
+from http_cache import _corps_canonique, _normaliser, cache_responses
+
+CHEMIN_CALLBACK = '/_dash-update-component'
+
+
+def serialisation_naive(valeur):
+    """
+    Écrit une valeur JSON comme JSON.stringify après un passage en
+    JavaScript : nombres entiers sans décimale, clés nulles omises (undefined),
+    clés triées
+    """
+    if isinstance(valeur, bool) or valeur is None:
+        return json.dumps(valeur)
+    if isinstance(valeur, (int, float)):
+        return str(int(valeur)) if float(valeur).is_integer() else repr(valeur)
+    if isinstance(valeur, str):
+        return json.dumps(valeur)
+    if isinstance(valeur, list):
+        return '[' + ','.join(serialisation_naive(v) for v in valeur) + ']'
+    paires = sorted((k, v) for k, v in valeur.items() if v is not None)
+    return '{' + ','.join('%s:%s' % (json.dumps(k), serialisation_naive(v)) for k, v in paires) + '}'
+
+
+def cle_naive(corps):
+    """
+    Ce dont dépend la réponse d'un callback : sortie, entrées et états
+    (une liste vide d'états vaut une absence d'états)
+    """
+    contenu = json.loads(corps)
+    return serialisation_naive({
+        'output': contenu.get('output'),
+        'inputs': contenu.get('inputs') or None,
+        'state': contenu.get('state') or None,
+    })
+
+
+def callback(graine):
+    """
+    Corps d'un callback aléatoire de la forme envoyée par Dash
+    """
+    rng = random.Random(graine)
+    corps = {
+        'output': rng.choice(['map.figure', '..hist.figure...pie.figure..']),
+        'outputs': {'id': 'map', 'property': 'figure'},
+        'inputs': [
+            {'id': 'year-slider', 'property': 'value',
+             'value': [rng.choice([1850, 1850.0]), rng.choice([1900.5, 2000])]},
+            {'id': 'mass-slider', 'property': 'value', 'value': rng.choice([0, 0.0, 3, 6.25])},
+        ],
+        'changedPropIds': rng.choice([[], ['year-slider.value'], ['mass-slider.value']]),
+    }
+    if rng.random() < 0.5:
+        corps['state'] = rng.choice([[], [{'id': 'map', 'property': 'relayoutData',
+                                           'value': rng.choice([None, {'autosize': True}])}]])
+    return corps
+
+
+def variante(corps, graine):
+    """
+    Même requête que corps, écrite autrement : ordre des clés, entiers
+    écrits avec décimale, changedPropIds, valeurs nulles
+    """
+    rng = random.Random(graine)
+
+    def reecrire(valeur):
+        if isinstance(valeur, dict):
+            cles = list(valeur)
+            rng.shuffle(cles)
+            sortie = {k: reecrire(valeur[k]) for k in cles}
+            if rng.random() < 0.3:
+                sortie['absente'] = None
+            return sortie
+        if isinstance(valeur, list):
+            return [reecrire(v) for v in valeur]
+        if isinstance(valeur, int) and not isinstance(valeur, bool) and rng.random() < 0.5:
+            return float(valeur)
+        return valeur
+
+    autre = reecrire(corps)
+    autre['changedPropIds'] = rng.choice([[], ['mass-slider.value']])
+    if 'state' not in autre and rng.random() < 0.5:
+        autre['state'] = []
+    return json.dumps(autre).encode('utf8')
+
+
+@pytest.mark.parametrize('graine', range(20))
+def test_canonical_body_matches_naive(graine):
+    corps = callback(graine)
+    octets = json.dumps(corps).encode('utf8')
+    canonique = _corps_canonique(CHEMIN_CALLBACK, octets)
+    assert canonique.decode('utf8') == cle_naive(octets)
+    # Une même requête écrite autrement a la même forme canonique
+    for autre in range(5):
+        assert _corps_canonique(CHEMIN_CALLBACK, variante(corps, autre)) == canonique
+
+
+def test_canonical_body_distinguishes_requests():
+    corps = [json.dumps(callback(graine)).encode('utf8') for graine in range(60)]
+    canoniques = {_corps_canonique(CHEMIN_CALLBACK + '/', c) for c in corps}
+    assert len(canoniques) == len({cle_naive(c) for c in corps})
+
+
+@pytest.mark.parametrize('chemin, corps', [
+    ('/_dash-layout', b'{"b": 1, "a": 2}'),
+    (CHEMIN_CALLBACK, b'{pas du json'),
+    (CHEMIN_CALLBACK, b'[1, 2]'),
+    (CHEMIN_CALLBACK, b''),
+])
+def test_canonical_body_keeps_other_bodies(chemin, corps):
+    assert _corps_canonique(chemin, corps) == corps
+
+
+@pytest.mark.parametrize('valeur, attendue', [
+    (0.0, 0),
+    (-3.0, -3),
+    (2.5, 2.5),
+    (True, True),
+    ([1.0, None, {'a': None, 'b': 4.0}], [1, None, {'b': 4}]),
+    ({'x': {'y': None}}, {'x': {}}),
+    ('1.0', '1.0'),
+])
+def test_normaliser(valeur, attendue):
+    obtenue = _normaliser(valeur)
+    assert obtenue == attendue
+    assert json.dumps(obtenue) == json.dumps(attendue)
+
+
+class Application:
+    """
+    Application minimale exposant un serveur Flask, comme dash.Dash
+    """
+
+    def __init__(self):
+        self.server = flask.Flask(__name__)
+        self.appels = 0
+
+        @self.server.route('/_dash-layout')
+        def layout():
+            self.appels += 1
+            return flask.Response(json.dumps({'figures': list(range(2000))}),
+                                  mimetype='application/json')
+
+        @self.server.route(CHEMIN_CALLBACK, methods=['POST'])
+        def update_component():
+            self.appels += 1
+            return flask.jsonify({'response': flask.request.get_json()['inputs']})
+
+
+def test_cache_responses_serves_each_response_once():
+    application = Application()
+    version = ['v1']
+    cache = cache_responses(application, lambda: version[0])
+    client = application.server.test_client()
+
+    premiere = client.get('/_dash-layout', headers={'Accept-Encoding': 'gzip'})
+    assert premiere.headers['Content-Encoding'] == 'gzip'
+    contenu = gzip.decompress(premiere.get_data())
+    assert json.loads(contenu) == {'figures': list(range(2000))}
+    etag = premiere.headers['ETag']
+
+    assert client.get('/_dash-layout', headers={'If-None-Match': etag,
+                                                'Accept-Encoding': 'gzip'}).status_code == 304
+    assert client.get('/_dash-layout').get_data() == contenu
+    assert application.appels == 1
+
+    # Deux écritures de la même requête de callback : une seule réponse produite
+    corps = callback(0)
+    client.post(CHEMIN_CALLBACK, data=json.dumps(corps), content_type='application/json')
+    reponse = client.post(CHEMIN_CALLBACK, data=variante(corps, 1), content_type='application/json')
+    assert reponse.status_code == 200 and application.appels == 2
+    assert cache.stats()['hits'] == 3 and cache.stats()['size'] == 2
+
+    # Nouvelle version des données : les réponses sont reproduites
+    version[0] = 'v2'
+    assert client.get('/_dash-layout', headers={'If-None-Match': etag}).status_code == 200
+    assert application.appels == 3
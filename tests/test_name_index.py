@@ -0,0 +1,176 @@
+"""
+Tests de name_index.py, comparés à une recherche naïve parmi toutes les villes
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from geocoder import chord_to_km, to_unit_sphere
+import name_index
+from name_index import (
+    CityNameStore, load_name_store, match_rates, normalize_name, normalize_names
+)
+
+
+@pytest.mark.parametrize('nom, attendu, attendu_sans_numero', [
+    ('Allan Hills 77005', 'allan hills 77005', 'allan hills'),
+    ('Acfer 001', 'acfer 001', 'acfer'),
+    ('Bensour (a)', 'bensour a', 'bensour'),
+    ('Saint-Étienne', 'saint etienne', 'saint etienne'),
+    ('São Paulo', 'sao paulo', 'sao paulo'),
+    ('MÜNCHEN', 'munchen', 'munchen'),
+    ('Queen Alexandra Range 93148 b', 'queen alexandra range 93148 b', 'queen alexandra range'),
+    ('1000', '1000', '1000'),
+    ('A', 'a', 'a'),
+    ('Dhofar 1180/1181', 'dhofar 1180 1181', 'dhofar'),
+    ('  ', '', ''),
+    ('—', '', ''),
+])
+def test_normalize_name(nom, attendu, attendu_sans_numero):
+    assert normalize_name(nom) == attendu
+    assert normalize_name(nom, sans_numero=True) == attendu_sans_numero
+
+
+def test_normalize_names_matches_normalize_name():
+    noms = ['Acfer 001', None, 'Acfer 001', 'Saint-Étienne', '!!', np.nan, 'Lyon']
+    obtenus = normalize_names(noms)
+    attendus = ['acfer 001', np.nan, 'acfer 001', 'saint etienne', np.nan, np.nan, 'lyon']
+    assert [o if isinstance(o, str) else None for o in obtenus] == \
+        [a if isinstance(a, str) else None for a in attendus]
+
+
+VILLES = pd.DataFrame([
+    # Country, City, AccentCity, Region, Population, Latitude, Longitude
+    ('fr', 'lyon', 'Lyon', 1, 500000, 45.76, 4.84),
+    ('us', 'lyon', 'Lyon', 1, 1000, 39.57, -90.11),
+    ('fr', 'saint-etienne', 'Saint-Étienne', 1, 170000, 45.43, 4.39),
+    ('dz', 'acfer', 'Acfer', 1, None, 27.5, 4.0),
+    ('aq', 'allan hills', 'Allan Hills', 1, None, -76.7, 159.7),
+    ('nz', 'allan hills', 'Allan Hills', 1, None, -45.0, 170.0),
+    ('ma', 'bensour', 'Bensour', 1, None, 30.0, -5.0),
+    ('ma', 'bensour', 'Bensour', 1, None, None, None),
+    ('de', 'munchen', 'München', 1, 1200000, 48.14, 11.58),
+    ('xx', 'nulle part', 'Nulle Part', 1, None, 0.0, 0.0),
+], columns=['Country', 'City', 'AccentCity', 'Region', 'Population', 'Latitude', 'Longitude'])
+
+METEORITES = pd.DataFrame([
+    ('Lyon', 45.0, 5.0),
+    ('Lyon', 40.0, -89.0),
+    ('saint etienne', 45.5, 4.5),
+    ('Acfer 001', 27.0, 4.2),
+    ('Allan Hills 77005', -76.5, 159.0),
+    ('Allan Hills 88001', -44.0, 171.0),
+    ('Bensour (a)', np.nan, np.nan),
+    ('MUNCHEN', 48.0, 11.0),
+    ('Inconnue 12', 10.0, 10.0),
+    (None, 0.0, 0.0),
+], columns=['name', 'reclat', 'reclong'])
+
+
+def correspondances_naives(villes, meteorites):
+    """
+    Pour chaque météorite, parcourt toutes les villes : même nom normalisé
+    (sinon sans numéro), la plus proche, la première du fichier à égalité
+    """
+    cles_villes = [normalize_name(v) for v in villes['AccentCity']]
+    points_villes = to_unit_sphere(villes['Latitude'], villes['Longitude'])
+    resultats = []
+    for nom, lat, lon in meteorites.itertuples(index=False):
+        if not isinstance(nom, str):
+            resultats.append((np.nan, np.nan, np.nan))
+            continue
+        cle, designation = normalize_name(nom), False
+        candidates = [i for i, c in enumerate(cles_villes) if c == cle]
+        if not candidates:
+            cle, designation = normalize_name(cle, sans_numero=True), True
+            candidates = [i for i, c in enumerate(cles_villes) if c == cle]
+        if not candidates:
+            resultats.append((np.nan, np.nan, np.nan))
+            continue
+        point = to_unit_sphere([lat], [lon])[0]
+        cordes = [np.linalg.norm(points_villes[i] - point) for i in candidates]
+        cordes = [np.inf if np.isnan(c) else c for c in cordes]
+        choisie = candidates[int(np.argmin(cordes))]
+        ville = villes['AccentCity'][choisie]
+        correspondance = 'exact' if ville == nom else 'designation' if designation else 'normalized'
+        resultats.append((ville, villes['Country'][choisie].upper(), correspondance))
+    return pd.DataFrame(resultats, columns=['City', 'code_2', 'match'])
+
+
+@pytest.fixture
+def chemin_villes(tmp_path):
+    chemin = tmp_path / 'worldcitiespop.csv'
+    VILLES.to_csv(chemin, index=False)
+    return chemin
+
+
+@pytest.mark.parametrize('relu', [False, True])
+def test_match_matches_naive(chemin_villes, tmp_path, relu):
+    magasin = CityNameStore.from_csv(chemin_villes, taille_bloc=3)
+    if relu:
+        magasin.save(str(tmp_path / 'magasin'))
+        magasin = CityNameStore.load(str(tmp_path / 'magasin'))
+    obtenues = magasin.match(METEORITES['name'], METEORITES['reclat'], METEORITES['reclong'])
+    attendues = correspondances_naives(VILLES, METEORITES)
+    pd.testing.assert_frame_equal(
+        obtenues[['City', 'code_2', 'match']], attendues, check_dtype=False
+    )
+
+    lyon = obtenues['distance_km'][0]
+    attendue = chord_to_km(np.linalg.norm(
+        to_unit_sphere([45.76], [4.84])[0] - to_unit_sphere([45.0], [5.0])[0]
+    ))
+    assert lyon == pytest.approx(attendue, rel=1e-5)
+    assert np.isnan(obtenues['distance_km'][6])
+    taux = match_rates(obtenues)
+    assert (taux['exact'], taux['normalized'], taux['designation'], taux['unmatched']) == (2, 2, 4, 2)
+
+
+def test_restrict_keeps_searched_names_only(chemin_villes):
+    magasin = CityNameStore.from_csv(chemin_villes)
+    assert len(magasin) == len(VILLES)
+    index = magasin.restrict(normalize_names(['Lyon', 'Acfer 002']))
+    assert sorted(index.keys) == ['acfer', 'lyon']
+    assert len(index) == 3
+    vide = magasin.restrict(normalize_names(['Nowhere']))
+    assert len(vide) == 0
+    assert vide.match(['Nowhere'], [0.0], [0.0])['City'].isna().all()
+
+
+def test_lookup_with_hash_collisions(chemin_villes, monkeypatch):
+    # Toutes les empreintes égales : les noms sont retrouvés en les comparant
+    monkeypatch.setattr(name_index, '_empreintes', lambda cles: np.zeros(len(cles), np.uint64))
+    magasin = CityNameStore.from_csv(chemin_villes)
+    cles = ['munchen', 'lyon', 'paris', 'nulle part']
+    positions = magasin.lookup(cles)
+    assert positions[2] == -1
+    assert [magasin.keys[p].as_py() for p in positions[[0, 1, 3]]] == ['munchen', 'lyon', 'nulle part']
+    attendues = correspondances_naives(VILLES, METEORITES)
+    obtenues = magasin.match(METEORITES['name'], METEORITES['reclat'], METEORITES['reclong'])
+    pd.testing.assert_frame_equal(
+        obtenues[['City', 'code_2', 'match']], attendues, check_dtype=False
+    )
+
+
+def test_load_name_store_is_built_once(chemin_villes, tmp_path, monkeypatch):
+    cache = str(tmp_path / 'cache')
+    magasin = load_name_store(str(chemin_villes), cache)
+    assert len(magasin) == len(VILLES)
+    anciens = os.listdir(cache)
+
+    def reconstruction(*args, **kwargs):
+        raise AssertionError('magasin reconstruit')
+    with monkeypatch.context() as contexte:
+        contexte.setattr(CityNameStore, 'from_csv', reconstruction)
+        assert len(load_name_store(str(chemin_villes), cache)) == len(VILLES)
+
+    # Un nouveau fichier des villes remplace l'ancienne version du magasin
+    VILLES.iloc[:4].to_csv(chemin_villes, index=False)
+    assert len(load_name_store(str(chemin_villes), cache)) == 4
+    nouveaux = os.listdir(cache)
+    assert len(nouveaux) == 1 and nouveaux != anciens
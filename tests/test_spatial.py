@@ -0,0 +1,139 @@
+"""
+Tests de spatial.py, comparés à un parcours complet des météorites
+(distance de haversine)
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import flask
+import numpy as np
+import pandas as pd
+import pytest
+
+from geocoder import RAYON_TERRE_KM
+from spatial import COLONNES_RESULTAT, ImpactIndex, add_query_routes
+
+
+def impacts(n=2000, graine=0):
+    """
+    Météorites aléatoires, dont quelques-unes sans coordonnées
+    """
+    rng = np.random.default_rng(graine)
+    lat = rng.uniform(-90, 90, n).astype(np.float32)
+    lon = rng.uniform(-180, 180, n).astype(np.float32)
+    lat[rng.random(n) < 0.03] = np.nan
+    df = pd.DataFrame({colonne: np.zeros(n) for colonne in COLONNES_RESULTAT})
+    df['name'] = ['M%d' % i for i in range(n)]
+    df['reclat'], df['reclong'] = lat, lon
+    return df
+
+
+def haversine(df, lat, lon):
+    """
+    Distance orthodromique (km) de chaque météorite à (lat, lon), NaN sans coordonnées
+    """
+    phi1, phi2 = np.radians(lat), np.radians(df['reclat'].to_numpy(np.float64))
+    dphi = phi2 - phi1
+    dlambda = np.radians(df['reclong'].to_numpy(np.float64) - lon)
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * RAYON_TERRE_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+LIEUX = [(45.76, 4.84), (-33.9, 151.2), (89.0, -120.0), (0.0, 179.9)]
+
+
+@pytest.mark.parametrize('lat, lon', LIEUX)
+def test_nearest_matches_brute_force(lat, lon):
+    df = impacts()
+    resultats = ImpactIndex(df).nearest(lat, lon, 15)
+    distances = np.sort(haversine(df, lat, lon)[df['reclat'].notna()])[:15]
+    np.testing.assert_allclose(resultats['distance_km'], distances, rtol=1e-6, atol=1e-6)
+    np.testing.assert_allclose(
+        haversine(resultats, lat, lon), resultats['distance_km'], rtol=1e-6, atol=1e-6
+    )
+
+
+def test_nearest_more_than_indexed():
+    df = impacts(30)
+    assert len(ImpactIndex(df).nearest(0.0, 0.0, 100)) == df['reclat'].notna().sum()
+
+
+@pytest.mark.parametrize('lat, lon', LIEUX)
+@pytest.mark.parametrize('rayon', [10.0, 800.0, 3000.0])
+def test_within_radius_matches_brute_force(lat, lon, rayon):
+    df = impacts(graine=1)
+    resultats, total = ImpactIndex(df).within_radius(lat, lon, rayon, limite=50)
+    distances = haversine(df, lat, lon)
+    dedans = distances <= rayon
+    assert total == dedans.sum()
+    assert len(resultats) == min(total, 50)
+    np.testing.assert_allclose(
+        resultats['distance_km'], np.sort(distances[dedans])[:50], rtol=1e-6, atol=1e-6
+    )
+
+
+@pytest.mark.parametrize('sud, ouest, nord, est', [
+    (40, -5, 52, 10),
+    (-60, 150, 10, -150),
+    (-90, -180, 90, 180),
+    (10, 10, 10.5, 10.5),
+])
+def test_within_bbox_matches_brute_force(sud, ouest, nord, est):
+    df = impacts(graine=2)
+    resultats, total = ImpactIndex(df).within_bbox(sud, ouest, nord, est, limite=5000)
+    lat, lon = df['reclat'], df['reclong']
+    if ouest <= est:
+        dans_lon = (lon >= ouest) & (lon <= est)
+    else:
+        dans_lon = (lon >= ouest) | (lon <= est)
+    dedans = (lat >= sud) & (lat <= nord) & dans_lon
+    assert total == dedans.sum()
+    assert set(resultats['name']) == set(df.loc[dedans, 'name'])
+    assert resultats['distance_km'].is_monotonic_increasing
+
+
+@pytest.mark.parametrize('part_max', [0.0, 0.5])
+def test_insert_matches_rebuild(monkeypatch, part_max):
+    # part_max = 0 : reconstruction des KD-trees ; 0.5 : points ajoutés parcourus à part
+    monkeypatch.setattr('spatial.PART_MAX_AJOUTS', part_max)
+    df, lot = impacts(graine=3), impacts(300, graine=4)
+    lot['name'] = 'N' + lot['name']
+    # Les lignes du lot sont placées devant celles de df
+    complete = pd.concat([lot, df], ignore_index=True)
+    index = ImpactIndex(df).insert(
+        complete, lot, np.arange(len(lot)), lambda positions: positions + len(lot)
+    )
+    assert (index.sphere.n == len(index)) == (part_max == 0.0)
+    reference = ImpactIndex(complete)
+    for lat, lon in LIEUX:
+        pd.testing.assert_frame_equal(
+            index.nearest(lat, lon, 20).reset_index(drop=True),
+            reference.nearest(lat, lon, 20).reset_index(drop=True),
+        )
+        attendus, total = reference.within_radius(lat, lon, 2000.0)
+        obtenus, total_obtenu = index.within_radius(lat, lon, 2000.0)
+        assert total_obtenu == total and set(obtenus['name']) == set(attendus['name'])
+    attendus, total = reference.within_bbox(-60, 150, 10, -150)
+    obtenus, total_obtenu = index.within_bbox(-60, 150, 10, -150)
+    assert total_obtenu == total and set(obtenus['name']) == set(attendus['name'])
+
+
+@pytest.mark.parametrize('requete', [
+    '/api/impacts/nearest?lat=45&lon=5&k=100000000000000000000000',
+    '/api/impacts/nearest?lat=45&lon=5&k=' + '9' * 400,
+    '/api/impacts/nearest?lat=45&lon=5&k=1.5',
+    '/api/impacts/nearest?lat=1e400&lon=5',
+    '/api/impacts/nearest?lat=nan&lon=5',
+    '/api/impacts/radius?lat=45&lon=5&radius_km=inf',
+    '/api/impacts/radius?lat=45&lon=5&radius_km=100&limit=-100000000000000000000000',
+    '/api/impacts/bbox?south=10&west=0&north=20&east=' + '1' * 400,
+    '/api/impacts/bbox?south=30&west=0&north=20&east=10',
+])
+def test_invalid_parameters_give_400(requete):
+    server = flask.Flask(__name__)
+    index = ImpactIndex(impacts(100))
+    add_query_routes(server, lambda: index)
+    reponse = server.test_client().get(requete)
+    assert reponse.status_code == 400
+    assert 'error' in reponse.get_json()
+    assert server.test_client().get('/api/impacts/nearest?lat=45&lon=5&k=3').get_json()['count'] == 3
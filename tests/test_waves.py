@@ -0,0 +1,135 @@
+"""
+Tests de waves.py, comparés à des implémentations naïves (pandas, boucles)
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import numpy as np
+import pandas as pd
+import pytest
+
+from waves import DiscoveryMatrix, compare_regions, detect_waves, rolling_rate
+
+
+def vagues_naives(taux, years, facteur, debut, duree_min):
+    """
+    Détection des vagues année par année, ligne par ligne
+    """
+    vagues = []
+    for ligne, serie in enumerate(taux):
+        suivies = years >= debut
+        moyenne = serie[suivies].mean()
+        en_vague = [bool(t > facteur * moyenne and moyenne > 0 and s)
+                    for t, s in zip(serie, suivies)]
+        i = 0
+        while i < len(en_vague):
+            if not en_vague[i]:
+                i += 1
+                continue
+            j = i
+            while j < len(en_vague) and en_vague[j]:
+                j += 1
+            if j - i >= duree_min:
+                pic = i + int(np.argmax(serie[i:j]))
+                vagues.append((ligne, years[i], years[j - 1], j - i, years[pic], serie[pic]))
+            i = j
+    return vagues
+
+
+@pytest.mark.parametrize('fenetre', [1, 2, 3, 4, 5, 10, 11, 30])
+def test_rolling_rate_matches_pandas(fenetre):
+    rng = np.random.default_rng(fenetre)
+    counts = rng.integers(0, 20, size=(3, 25))
+    attendu = pd.DataFrame(counts.T).rolling(fenetre, center=True, min_periods=1).mean()
+    np.testing.assert_allclose(rolling_rate(counts, fenetre), attendu.to_numpy().T)
+
+
+def test_rolling_rate_edges_are_truncated():
+    counts = np.arange(1, 21)[None, :]
+    taux = rolling_rate(counts, 10)
+    # Première année : moyenne des années 1 à 5 (fenêtre tronquée, non décalée)
+    assert taux[0, 0] == pytest.approx(3.0)
+    # Dernière année : moyenne des années 15 à 20 (fenêtre paire : 5 années
+    # avant l'année courante, 4 après, comme pandas)
+    assert taux[0, -1] == pytest.approx(17.5)
+
+
+def test_detect_waves_matches_naive():
+    rng = np.random.default_rng(0)
+    years = np.arange(1800, 1900)
+    counts = rng.poisson(3, size=(4, len(years)))
+    counts[1, 60:75] += 20
+    counts[2, 10:20] += 30
+    counts[2, 80:84] += 30
+    taux = rolling_rate(counts, 5)
+    masque, vagues = detect_waves(taux, years, facteur=1.5, debut=1850, duree_min=5)
+
+    attendues = vagues_naives(taux, years, 1.5, 1850, 5)
+    obtenues = list(vagues[['row', 'start', 'end', 'duration', 'peak_year']].itertuples(index=False))
+    assert [tuple(v) for v in obtenues] == [v[:5] for v in attendues]
+    np.testing.assert_allclose(vagues['peak_rate'], [v[5] for v in attendues])
+
+    masque_attendu = np.zeros_like(masque)
+    for ligne, debut, fin, *_ in attendues:
+        masque_attendu[ligne, (years >= debut) & (years <= fin)] = True
+    np.testing.assert_array_equal(masque, masque_attendu)
+
+
+def test_compare_regions_matches_naive():
+    rng = np.random.default_rng(1)
+    years = np.arange(1840, 1960)
+    counts = rng.poisson(2, size=(3, len(years)))
+    counts[0, 20:30] += 15
+    counts[0, 70:80] += 15
+    counts[2] = 0
+    taux = rolling_rate(counts, 5)
+    masque, vagues = detect_waves(taux, years)
+    comparaison = compare_regions(counts, masque, vagues, years)
+
+    for ligne in range(len(counts)):
+        propres = vagues[vagues['row'] == ligne]
+        total = counts[ligne].sum()
+        assert comparaison.loc[ligne, 'total'] == total
+        assert comparaison.loc[ligne, 'waves'] == len(propres)
+        if total:
+            assert comparaison.loc[ligne, 'in_waves_share'] == pytest.approx(
+                counts[ligne][masque[ligne]].sum() / total
+            )
+        if len(propres) > 1:
+            ecarts = propres['start'].to_numpy()[1:] - propres['end'].to_numpy()[:-1] - 1
+            assert comparaison.loc[ligne, 'mean_gap'] == pytest.approx(ecarts.mean())
+        else:
+            assert np.isnan(comparaison.loc[ligne, 'mean_gap'])
+        assert comparaison.loc[ligne, 'best_year'] == years[np.argmax(counts[ligne])]
+
+
+def test_discovery_matrix_from_cube():
+    cube = pd.DataFrame({
+        'year': [1790, 1800, 1800, 1850, 2020, 2021],
+        'continent': ['Asia', 'Asia', 'Europe', 'Asia', 'Europe', 'Europe'],
+        'count': [5, 1, 2, 3, 4, 6],
+    })
+    matrice = DiscoveryMatrix.from_cube(cube)
+    assert matrice.regions == ['Asia', 'Europe']
+    ligne_asie = matrice.counts[0]
+    assert ligne_asie.sum() == 4 and ligne_asie[0] == 1 and ligne_asie[50] == 3
+    assert matrice.counts[1, 0] == 2 and matrice.counts[1, -1] == 4
+
+
+def test_add_cube_matches_from_cube():
+    rng = np.random.default_rng(2)
+    cube = pd.DataFrame({
+        'year': rng.integers(1790, 2025, 300),
+        'continent': rng.choice(['Asia', 'Europe', 'Unknown'], 300),
+        'count': rng.integers(1, 5, 300),
+    })
+    lot = pd.DataFrame({
+        'year': [1801, 1900, 2020, 2030],
+        'continent': ['Africa', 'Asia', 'Africa', 'Asia'],
+        'count': [1, 2, 3, 4],
+    })
+    obtenue = DiscoveryMatrix.from_cube(cube).add_cube(lot)
+    attendue = DiscoveryMatrix.from_cube(pd.concat([cube, lot]))
+    assert obtenue.regions == attendue.regions == ['Africa', 'Asia', 'Europe', 'Unknown']
+    np.testing.assert_array_equal(obtenue.years, attendue.years)
+    np.testing.assert_array_equal(obtenue.counts, attendue.counts)
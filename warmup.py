@@ -0,0 +1,148 @@
+"""
+Préparation au démarrage des réponses des callbacks du dashboard.
+
+Le premier visiteur qui ouvre une section, ou qui choisit un filtre, paierait
+la construction et la sérialisation des figures demandées (les données des
+trois cartes surtout). Avant le fork des workers de serve.py, on appelle donc
+les callbacks pour les variantes attendues (valeurs initiales de la page et
+filtres prédéfinis), comme le ferait le navigateur, et on range leurs réponses
+compressées dans le cache de réponses (http_cache.py) dont les workers
+héritent : aucune requête d'un visiteur ne construit alors ces figures.
+
+Les variantes sont réparties entre plusieurs processus créés par fork, qui
+partagent les données déjà chargées et renvoient les réponses au processus
+principal.
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import json
+import logging
+import multiprocessing
+import os
+import time
+
+import flask
+from dash.exceptions import PreventUpdate
+
+from http_cache import CachedResponse
+
+logger = logging.getLogger(__name__)
+
+# Processus de préparation (1 : tout est préparé dans le processus courant)
+PROCESSUS_WARMUP = int(os.environ.get('DASHBOARD_WARMUP_PROCESSES', os.cpu_count() or 1))
+
+# Application et cache du processus principal, hérités par les processus
+# de préparation lors du fork
+_contexte = {}
+
+
+def callback_request(sorties, entrees, etats=()):
+    """
+    Retourne le corps d'une requête _dash-update-component, tel que
+    l'envoie le navigateur
+
+    Args:
+        sorties : liste de (id, propriété) des sorties du callback
+        entrees : liste de (id, propriété, valeur) des entrées
+        etats : liste de (id, propriété, valeur) des états
+
+    Returns:
+        callback_request(sorties, entrees, etats) : bytes (JSON)
+    """
+    def valeurs(composants):
+        # Une valeur undefined n'est pas envoyée par le navigateur
+        return [
+            dict({'id': i, 'property': p}, **({} if v is None else {'value': v}))
+            for i, p, v in composants
+        ]
+
+    outputs = [{'id': i, 'property': p} for i, p in sorties]
+    if len(sorties) == 1:
+        output, outputs = '%s.%s' % sorties[0], outputs[0]
+    else:
+        output = '..%s..' % '...'.join('%s.%s' % s for s in sorties)
+    corps = {
+        'output': output,
+        'outputs': outputs,
+        'inputs': valeurs(entrees),
+        'changedPropIds': ['%s.%s' % e[:2] for e in entrees],
+    }
+    if etats:
+        corps['state'] = valeurs(etats)
+    return json.dumps(corps).encode('utf8')
+
+
+def _render_group(corps_groupe):
+    """
+    Appelle les callbacks d'un groupe de requêtes et retourne leurs réponses
+    compressées
+
+    Les requêtes d'un même groupe partagent des figures : elles sont
+    traitées dans le même processus, qui ne construit chacune qu'une fois.
+
+    Args:
+        corps_groupe : liste de corps de requêtes (callback_request)
+
+    Returns:
+        _render_group(corps_groupe) : liste de (clé, http_cache.CachedResponse)
+    """
+    app, cache = _contexte['app'], _contexte['cache']
+    server = app.server
+    chemin = app.config.routes_pathname_prefix + '_dash-update-component'
+    reponses = []
+    for corps in corps_groupe:
+        with server.test_request_context(
+                chemin, method='POST', data=corps, content_type='application/json'):
+            try:
+                reponse = server.make_response(server.dispatch_request())
+            except PreventUpdate:
+                continue
+            if reponse.status_code != 200:
+                continue
+            cle = cache.key(flask.request)
+        entree = CachedResponse(cle[0], reponse.get_data(), reponse.mimetype)
+        entree.encode_all()
+        reponses.append((cle, entree))
+    return reponses
+
+
+def warm_callbacks(app, cache, groupes, processus=PROCESSUS_WARMUP):
+    """
+    Prépare les réponses de groupes de requêtes de callbacks et les range
+    dans le cache de réponses
+
+    Avec plusieurs processus, les figures sont construites dans les processus
+    de préparation : seules les réponses reviennent dans le processus courant,
+    dont le cache de figures reste vide.
+
+    Args:
+        app : dash.Dash
+        cache : ResponseCache de http_cache.cache_responses
+        groupes : liste de listes de corps de requêtes (callback_request)
+        processus : nombre de processus de préparation
+
+    Returns:
+        warm_callbacks(app, cache, groupes, processus) : nombre de réponses rangées
+    """
+    debut = time.perf_counter()
+    _contexte.update(app=app, cache=cache)
+    processus = min(processus, len(groupes))
+    try:
+        if processus <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+            resultats = [_render_group(groupe) for groupe in groupes]
+        else:
+            with multiprocessing.get_context('fork').Pool(processus) as pool:
+                resultats = pool.map(_render_group, groupes, chunksize=1)
+    finally:
+        _contexte.clear()
+    nombre = 0
+    for reponses in resultats:
+        for cle, entree in reponses:
+            cache.insert(cle, entree)
+            nombre += 1
+    logger.info(
+        '%d réponses de callbacks préparées en %.1f s (%d processus)',
+        nombre, time.perf_counter() - debut, max(processus, 1)
+    )
+    return nombre
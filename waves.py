@@ -0,0 +1,277 @@
+"""
+Analyse des vagues de découvertes de météorites par continent.
+
+Le nombre de découvertes par continent et par année est rangé une fois pour
+toutes dans une matrice NumPy dense (continents x années, de 1800 à 2020).
+Le taux de découvertes sur une fenêtre glissante, la détection des vagues
+(périodes où ce taux dépasse nettement la moyenne du continent) et la
+comparaison des continents sont ensuite des opérations sur des tableaux
+entiers, sans boucle par continent : une interaction ne coûte que quelques
+millisecondes.
+
+Auteurs : Henriques Hugo & Leroux Gabriel
+"""
+### Imports ###
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objs as go
+
+from figures import apply_theme
+
+# Années couvertes par la matrice (incluses)
+ANNEES_VAGUES = (1800, 2020)
+
+# Fenêtre glissante par défaut, en années
+FENETRE_DEFAUT = 10
+
+# Une année fait partie d'une vague lorsque le taux glissant du continent
+# dépasse FACTEUR_VAGUE fois son taux moyen depuis DEBUT_VAGUES...
+FACTEUR_VAGUE = 1.5
+DEBUT_VAGUES = 1850
+
+# ... pendant au moins DUREE_MIN_VAGUE années consécutives
+DUREE_MIN_VAGUE = 5
+
+
+class DiscoveryMatrix:
+    """
+    Nombre de découvertes par continent et par année
+
+    Attributs :
+        regions : noms des continents (lignes de counts)
+        years : années (colonnes de counts)
+        counts : np.ndarray d'entiers de forme (len(regions), len(years))
+    """
+
+    def __init__(self, regions, years, counts):
+        self.regions = regions
+        self.years = years
+        self.counts = counts
+
+    @classmethod
+    def from_cube(cls, cube, annees=ANNEES_VAGUES):
+        """
+        Construit la matrice à partir du cube d'agrégats
+
+        Args:
+            cube : résultat de aggregates.build_cube (year, continent, count...)
+            annees : (première, dernière) année de la matrice
+
+        Returns:
+            from_cube(cube, annees) : DiscoveryMatrix
+        """
+        years = np.arange(annees[0], annees[1] + 1)
+        gardees = cube[(cube['year'] >= annees[0]) & (cube['year'] <= annees[1])]
+        continents = pd.Categorical(gardees['continent'].astype(str))
+        counts = np.zeros((len(continents.categories), len(years)), dtype=np.int64)
+        np.add.at(
+            counts,
+            (continents.codes, gardees['year'].to_numpy(dtype=np.int64) - annees[0]),
+            gardees['count'].to_numpy(dtype=np.int64),
+        )
+        return cls(list(continents.categories), years, counts)
+
+    def add_cube(self, cube):
+        """
+        Retourne la matrice complétée par le cube d'agrégats de nouvelles
+        météorites (un continent nouveau prend sa place dans l'ordre alphabétique)
+
+        Args:
+            cube : résultat de aggregates.build_cube pour les nouvelles météorites
+
+        Returns:
+            add_cube(cube) : DiscoveryMatrix
+        """
+        ajout = DiscoveryMatrix.from_cube(cube, (self.years[0], self.years[-1]))
+        regions = sorted(set(self.regions) | set(ajout.regions))
+        counts = np.zeros((len(regions), len(self.years)), dtype=np.int64)
+        counts[[regions.index(r) for r in self.regions]] += self.counts
+        counts[[regions.index(r) for r in ajout.regions]] += ajout.counts
+        return DiscoveryMatrix(regions, self.years, counts)
+
+    def rows(self, regions):
+        """
+        Retourne les lignes de la matrice de plusieurs continents
+
+        Args:
+            regions : noms des continents (les inconnus sont ignorés)
+
+        Returns:
+            rows(regions) : (noms retenus, np.ndarray de forme (n, len(years)))
+        """
+        retenues = [r for r in self.regions if r in set(regions)]
+        positions = [self.regions.index(r) for r in retenues]
+        return retenues, self.counts[positions]
+
+
+def rolling_rate(counts, fenetre):
+    """
+    Retourne le nombre moyen de découvertes par an sur une fenêtre glissante
+    centrée, pour chaque ligne (la fenêtre est tronquée aux bords)
+
+    Args:
+        counts : np.ndarray de forme (n, années)
+        fenetre : largeur de la fenêtre, en années
+
+    Returns:
+        rolling_rate(counts, fenetre) : np.ndarray de forme (n, années)
+    """
+    nb_annees = counts.shape[1]
+    cumul = np.zeros((counts.shape[0], nb_annees + 1))
+    np.cumsum(counts, axis=1, out=cumul[:, 1:])
+    # Bornes de la fenêtre avant troncature : la fin se déduit du début non tronqué,
+    # sinon la fenêtre serait décalée, et non tronquée, près des bords
+    debut_fenetre = np.arange(nb_annees) - fenetre // 2
+    debut = np.clip(debut_fenetre, 0, nb_annees)
+    fin = np.clip(debut_fenetre + fenetre, 0, nb_annees)
+    return (cumul[:, fin] - cumul[:, debut]) / (fin - debut)
+
+
+def detect_waves(taux, years, facteur=FACTEUR_VAGUE, debut=DEBUT_VAGUES,
+                 duree_min=DUREE_MIN_VAGUE):
+    """
+    Détecte les vagues de découvertes : les suites d'au moins duree_min années
+    où le taux glissant d'un continent dépasse facteur fois son taux moyen
+    depuis l'année debut
+
+    Args:
+        taux : résultat de rolling_rate, de forme (n, années)
+        years : années des colonnes
+        facteur : rapport minimal au taux moyen
+        debut : première année prise en compte
+        duree_min : durée minimale d'une vague, en années
+
+    Returns:
+        detect_waves(taux, years, ...) : (masque booléen (n, années) des années
+        de vague, pd.DataFrame des vagues (row, start, end, duration, peak_year,
+        peak_rate), triée par ligne puis par année)
+    """
+    suivies = years >= debut
+    moyenne = taux[:, suivies].mean(axis=1, keepdims=True)
+    en_vague = (taux > facteur * moyenne) & (moyenne > 0) & suivies
+
+    # Débuts et fins des suites de True : une colonne False de chaque côté
+    # empêche une suite de passer d'une ligne à la suivante
+    bornes = np.diff(np.pad(en_vague, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    lignes, debuts = np.nonzero(bornes == 1)
+    _, fins = np.nonzero(bornes == -1)
+    longues = (fins - debuts) >= duree_min
+    lignes, debuts, fins = lignes[longues], debuts[longues], fins[longues]
+
+    # Années de chaque vague retenue, puis masque par ligne
+    colonnes = np.arange(taux.shape[1])
+    dans_vague = (colonnes >= debuts[:, None]) & (colonnes < fins[:, None])
+    masque = np.zeros(en_vague.shape, dtype=bool)
+    np.logical_or.at(masque, lignes, dans_vague)
+
+    # Pic de chaque vague : première année où son taux maximal est atteint
+    pics = np.argmax(np.where(dans_vague, taux[lignes], -np.inf), axis=1)
+    vagues = pd.DataFrame({
+        'row': lignes,
+        'start': years[debuts],
+        'end': years[fins - 1],
+        'duration': fins - debuts,
+        'peak_year': years[pics],
+        'peak_rate': taux[lignes, pics],
+    })
+    return masque, vagues
+
+
+def compare_regions(counts, masque, vagues, years):
+    """
+    Compare les continents : découvertes, vagues et part des découvertes
+    faites pendant une vague
+
+    Args:
+        counts : np.ndarray (n, années) des découvertes
+        masque : masque des années de vague (detect_waves)
+        vagues : vagues détectées (detect_waves)
+        years : années des colonnes
+
+    Returns:
+        compare_regions(counts, masque, vagues, years) : pd.DataFrame, une ligne
+        par ligne de counts (total, waves, in_waves_share, mean_duration,
+        mean_gap, best_year)
+    """
+    n = counts.shape[0]
+    total = counts.sum(axis=1)
+    dans_vagues = np.where(masque, counts, 0).sum(axis=1)
+    lignes = vagues['row'].to_numpy()
+    nb_vagues = np.bincount(lignes, minlength=n)
+    duree = np.bincount(lignes, weights=vagues['duration'].to_numpy(), minlength=n)
+    # Écart entre une vague et la suivante du même continent (vagues triées)
+    suivante = lignes[1:] == lignes[:-1]
+    ecarts = (vagues['start'].to_numpy()[1:] - vagues['end'].to_numpy()[:-1] - 1)[suivante]
+    somme_ecarts = np.bincount(lignes[1:][suivante], weights=ecarts, minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return pd.DataFrame({
+            'total': total,
+            'waves': nb_vagues,
+            'in_waves_share': np.where(total > 0, dans_vagues / np.maximum(total, 1), np.nan),
+            'mean_duration': duree / nb_vagues,
+            'mean_gap': np.where(nb_vagues > 1, somme_ecarts / np.maximum(nb_vagues - 1, 1), np.nan),
+            'best_year': years[np.argmax(counts, axis=1)],
+        })
+
+
+def analyse(matrice, regions, fenetre=FENETRE_DEFAUT):
+    """
+    Analyse les vagues de découvertes de plusieurs continents
+
+    Args:
+        matrice : DiscoveryMatrix
+        regions : noms des continents choisis
+        fenetre : largeur de la fenêtre glissante, en années
+
+    Returns:
+        analyse(matrice, regions, fenetre) : dict (regions, years, rate, waves_mask,
+        waves avec la colonne region, comparison indexée par continent)
+    """
+    retenues, counts = matrice.rows(regions)
+    taux = rolling_rate(counts, fenetre)
+    masque, vagues = detect_waves(taux, matrice.years)
+    comparaison = compare_regions(counts, masque, vagues, matrice.years)
+    comparaison.index = pd.Index(retenues, name='region')
+    vagues.insert(0, 'region', np.array(retenues, dtype=object)[vagues['row'].to_numpy()])
+    return {
+        'regions': retenues,
+        'years': matrice.years,
+        'rate': taux,
+        'waves_mask': masque,
+        'waves': vagues.drop(columns='row'),
+        'comparison': comparaison,
+    }
+
+
+def waves_figure(resultat):
+    """
+    Retourne les courbes du taux de découvertes glissant de chaque continent,
+    les années de vague étant tracées en trait épais
+
+    Args:
+        resultat : résultat de analyse
+
+    Returns:
+        waves_figure(resultat) : go.Figure
+    """
+    fig = go.Figure()
+    couleurs = px.colors.qualitative.Plotly
+    for i, region in enumerate(resultat['regions']):
+        couleur = couleurs[i % len(couleurs)]
+        taux = resultat['rate'][i]
+        fig.add_trace(go.Scatter(
+            x=resultat['years'], y=taux.round(2), name=region, legendgroup=region,
+            mode='lines', line={'color': couleur, 'width': 1},
+        ))
+        fig.add_trace(go.Scatter(
+            x=resultat['years'], y=np.where(resultat['waves_mask'][i], taux.round(2), None),
+            name=region + ' (vagues)', legendgroup=region, showlegend=False,
+            mode='lines', line={'color': couleur, 'width': 5}, connectgaps=False,
+        ))
+    fig.update_layout(
+        xaxis_title='Année', yaxis_title='Découvertes par an (moyenne glissante)',
+        hovermode='x unified'
+    )
+    return apply_theme(fig)
+